@@ -0,0 +1,288 @@
+import click
+import io
+import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import gh_issue_agent.agent as agent  # noqa: E402
+import fake_github  # noqa: E402
+
+"""
+    .. moduleauthor:: Tomas Kvasnicka <kvasntom@fit.cvut.cz>
+    :synopsis: Measure throughput of gh_issue_agent against a local fake GitHub API
+
+    - the fake API (see fake_github) runs in its own process, so it doesn't compete with the measured code for the GIL
+    - console: label all repositories by console_main, webhook: deliver issues to /hook and wait until they are labeled
+    - results (issues/s, requests by endpoint, latency percentiles, peak memory, git commit) are printed as JSON, so
+      runs on different commits can be compared, eg. python benchmarks/bench.py -o before.json
+"""
+
+LABELS = dict(agent.parse_file(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                            'labels.cfg'))['labels'])
+
+
+class TimedSession:
+    """
+
+    Session wrapper recording the duration of every request
+
+    :param session: wrapped session
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self.durations = {}
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+    def _timed(self, method: str, url: str, **kwargs):
+        start = time.perf_counter()
+        try:
+            return getattr(self.session, method)(url, **kwargs)
+        finally:
+            with self._lock:
+                self.durations.setdefault(method.upper(), []).append(time.perf_counter() - start)
+
+    def get(self, url: str, **kwargs):
+        return self._timed('get', url, **kwargs)
+
+    def post(self, url: str, **kwargs):
+        return self._timed('post', url, **kwargs)
+
+    def patch(self, url: str, **kwargs):
+        return self._timed('patch', url, **kwargs)
+
+    def put(self, url: str, **kwargs):
+        return self._timed('put', url, **kwargs)
+
+    def delete(self, url: str, **kwargs):
+        return self._timed('delete', url, **kwargs)
+
+
+def percentiles(values: list) -> dict:
+    """
+
+    Describe a distribution of durations
+
+    :param values: durations in seconds
+    :return: dictionary with number of values and p50/p90/p99/max in milliseconds
+    """
+
+    values = sorted(values)
+    if not values:
+        return {'count': 0}
+
+    def at(q):
+        return round(values[min(int(q * len(values)), len(values) - 1)] * 1000, 3)
+
+    return {'count': len(values), 'p50': at(0.5), 'p90': at(0.9), 'p99': at(0.99), 'max': at(1.0)}
+
+
+def commit() -> str:
+    """
+
+    Find the measured commit
+
+    :return: hash of HEAD (with '+dirty' when the tree has local changes) or None outside of a git repository
+    """
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        head = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=root, stderr=subprocess.DEVNULL)
+        dirty = subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=root)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    return head.decode().strip() + ('+dirty' if dirty.strip() else '')
+
+
+def start_server(**kwargs) -> tuple:
+    """
+
+    Start the fake API in a separate process
+
+    :param kwargs: passed to fake_github.FakeGitHub
+    :return: tuple (process, URL of the API)
+    """
+
+    import socket
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+
+    ready = multiprocessing.Event()
+    process = multiprocessing.Process(target=fake_github.serve, args=(port, ready), kwargs=kwargs, daemon=True)
+    process.start()
+    if not ready.wait(30):
+        process.terminate()
+        raise RuntimeError('Fake GitHub API did not start')
+
+    return process, 'http://127.0.0.1:' + str(port)
+
+
+def server_stats(url: str) -> dict:
+    return requests.get(url + '/_stats').json()
+
+
+def bench_console(url: str, repos: int, options: dict) -> dict:
+    """
+
+    Label all issues of the fake repositories by console_main
+
+    :param url: URL of the fake API
+    :param repos: number of repositories
+    :param options: console arguments (see parse_args) overriding the defaults
+    :return: measured values
+    """
+
+    session = TimedSession(agent.new_session(max(options.get('workers', 1) * options.get('parallel', 1), 10)))
+    args = {'repo': ['bench/r' + str(r) for r in range(repos)], 'token': 'bench', 'labels': LABELS,
+            'default_label': 'default', 'comments': False, 'output': io.StringIO(), 'write_interval': 0,
+            'api_url': url, 'session': session}
+    args.update(options)
+
+    start = time.perf_counter()
+    ret = agent.console_main(args)
+    elapsed = time.perf_counter() - start
+    issues = sum(1 for line in args['output'].getvalue().splitlines()
+                 if line.startswith(('Patched issue', 'Would patch issue')))
+
+    return {'return_code': ret,
+            'seconds': round(elapsed, 3),
+            'labeled': issues,
+            'labeled_per_second': round(issues / elapsed, 1) if elapsed else None,
+            'latency': {method: percentiles(d) for method, d in session.durations.items()},
+            'stages': args['stages'].summary()}
+
+
+def bench_webhook(url: str, deliveries: int, options: dict) -> dict:
+    """
+
+    Deliver issues of bench/r0 to /hook and wait until the workers label them
+
+    :param url: URL of the fake API
+    :param deliveries: number of webhook deliveries
+    :param options: web arguments (see parse_args) overriding the defaults
+    :return: measured values
+    """
+
+    issues = []
+    page = url + '/repos/bench/r0/issues?per_page=100'
+    while page and len(issues) < deliveries:
+        r = requests.get(page)
+        issues += r.json()
+        page = r.links.get('next', {}).get('url')
+
+    agent.g_args = dict({'repo': 'bench/r0', 'token': 'bench', 'labels': LABELS, 'default_label': 'default',
+                         'comments': False, 'api_url': url}, **options)
+    agent.g_session = agent.g_queue = agent.g_rules = agent.g_deliveries = None
+    client = agent.app.test_client()
+    answers = []
+    codes = {}
+
+    start = time.perf_counter()
+    for n in range(deliveries):
+        issue = dict(issues[n % len(issues)], labels=[])
+        sent = time.perf_counter()
+        code = client.post('/hook', json={'issue': issue, 'repository': {'name': 'r0'}},
+                           headers={'X-GitHub-Delivery': str(n)}).status_code
+        answers.append(time.perf_counter() - sent)
+        codes[code] = codes.get(code, 0) + 1
+    agent.get_queue().join()
+    elapsed = time.perf_counter() - start
+    queue = agent.get_queue().stats()
+    agent.web_shutdown()
+
+    return {'seconds': round(elapsed, 3),
+            'statuses': {str(k): v for k, v in codes.items()},
+            'labeled_per_second': round(queue['processed'] / elapsed, 1) if elapsed else None,
+            'answer_latency': percentiles(answers),
+            'queue': queue}
+
+
+@click.command()
+@click.option('--scenario', default='console', type=click.Choice(['console', 'webhook', 'all']),
+              help='what to measure')
+@click.option('--repos', default=1, help='number of fake repositories')
+@click.option('--issues', default=500, help='number of issues in each repository')
+@click.option('--comments', default=5, help='number of comments of each issue')
+@click.option('--length', default=400, help='approximate length of issue bodies and comments')
+@click.option('--labeled', default=0.2, help='fraction of issues which already have a label')
+@click.option('--latency', default=0.0, help='seconds every request to the fake API takes')
+@click.option('--rate-limit', default=1000000, help='requests allowed per rate limit window')
+@click.option('--secondary', default=0.0, help='probability of hitting the secondary rate limit')
+@click.option('--seed', default=0, help='seed of generated data')
+@click.option('--with-comments', is_flag=True, help='label issues according to their comments too')
+@click.option('--workers', default=1, help='see gh_issue_agent console --workers')
+@click.option('--parallel', default=1, help='see gh_issue_agent console --parallel')
+@click.option('--backend', default='rest', type=click.Choice(['rest', 'graphql']), help='backend used for writes')
+@click.option('--read-backend', default='rest', type=click.Choice(['rest', 'graphql']), help='backend used for reads')
+@click.option('--dry-run', is_flag=True, help='see gh_issue_agent console --dry-run')
+@click.option('--pipeline/--no-pipeline', default=True, help='see gh_issue_agent console --pipeline')
+@click.option('--write-workers', default=1, help='see gh_issue_agent console --write-workers')
+@click.option('--deliveries', default=500, help='number of webhook deliveries')
+@click.option('--hook-workers', default=4, help='see gh_issue_agent web --hook-workers')
+@click.option('--coalesce-window', default=0.0, help='see gh_issue_agent web --coalesce-window')
+@click.option('--trace-memory', is_flag=True, help='measure peak Python memory by tracemalloc (slows the run down)')
+@click.option('-o', '--output', default=None, help='file the JSON results are written to (besides stdout)')
+def main(scenario: str, repos: int, issues: int, comments: int, length: int, labeled: float, latency: float,
+         rate_limit: int, secondary: float, seed: int, with_comments: bool, workers: int, parallel: int, backend: str,
+         read_backend: str, dry_run: bool, pipeline: bool, write_workers: int, deliveries: int, hook_workers: int,
+         coalesce_window: float, trace_memory: bool, output: str) -> None:
+    """
+
+    Run the benchmark and print its results
+
+    For the description of Click's command please see Click documentation - http://click.pocoo.org/5/
+    """
+
+    params = {'repos': repos, 'issues': issues, 'comments': comments, 'labeled': labeled, 'length': length,
+              'latency': latency, 'rate_limit': rate_limit, 'secondary': secondary, 'seed': seed}
+    results = {'commit': commit(), 'python': sys.version.split()[0], 'data': params}
+
+    for name in (['console', 'webhook'] if scenario == 'all' else [scenario]):
+        process, url = start_server(**params)
+        if trace_memory:
+            tracemalloc.start()
+        try:
+            if name == 'console':
+                options = {'comments': with_comments, 'workers': workers, 'parallel': parallel, 'backend': backend,
+                           'read_backend': read_backend, 'dry_run': dry_run, 'pipeline': pipeline,
+                           'write_workers': write_workers}
+                results[name] = bench_console(url, repos, options)
+            else:
+                options = {'comments': with_comments, 'hook_workers': hook_workers, 'coalesce_window': coalesce_window}
+                results[name] = bench_webhook(url, deliveries, options)
+            results[name]['options'] = options
+            results[name]['requests'] = server_stats(url)['requests']
+            if trace_memory:
+                results[name]['peak_memory_kb'] = tracemalloc.get_traced_memory()[1] // 1024
+        finally:
+            if trace_memory:
+                tracemalloc.stop()
+            process.terminate()
+            process.join()
+
+    results['max_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    text = json.dumps(results, indent=2, sort_keys=True)
+    print(text)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
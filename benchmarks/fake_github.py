@@ -0,0 +1,338 @@
+import hashlib
+import http.server
+import json
+import random
+import re
+import socketserver
+import threading
+import time
+import urllib.parse
+
+"""
+    .. moduleauthor:: Tomas Kvasnicka <kvasntom@fit.cvut.cz>
+    :synopsis: Local stand-in for the parts of GitHub API used by gh_issue_agent
+
+    - synthetic repositories with configurable number of issues, comments and length of texts
+    - REST: issues and comments with Link pagination and ETags, PATCH of issues, adding labels to issues, labels,
+      organization repos
+    - GraphQL: issues with comments, labels, addLabelsToLabelable mutations (recognized by the query, not parsed)
+    - configurable latency of every request, primary rate limit (X-RateLimit-* headers, 403 when exhausted) and
+      probability of hitting a secondary rate limit (403 with Retry-After)
+    - GET /_stats returns numbers of requests by endpoint and status
+"""
+
+WORDS = ('the', 'issue', 'when', 'install', 'page', 'crash', 'login', 'slow', 'works', 'error', 'python', 'user',
+         'update', 'button', 'server', 'fails', 'expected', 'behaviour', 'steps', 'reproduce', 'version', 'config')
+KEYWORDS = ('bug', 'serious', 'ASAP', 'now')
+
+
+def text(rnd: random.Random, length: int, keywords: float) -> str:
+    """
+
+    Generate a random text
+
+    :param rnd: random number generator
+    :param length: approximate length in characters
+    :param keywords: probability that a word is one of KEYWORDS (the words labels.cfg reacts to)
+    :return: the text
+    """
+
+    words = []
+    while sum(len(w) + 1 for w in words) < length:
+        words.append(rnd.choice(KEYWORDS) if rnd.random() < keywords else rnd.choice(WORDS))
+
+    return ' '.join(words)
+
+
+class FakeGitHub:
+    """
+
+    Data and behaviour of the fake API
+
+    :param url: URL the server is reachable at
+    :param repos: number of repositories, named bench/r0, bench/r1, ...
+    :param issues: number of issues in each repository
+    :param comments: number of comments of each issue
+    :param labeled: fraction of issues which already have a label
+    :param length: approximate length of issue bodies and comments
+    :param keywords: probability of a word being a keyword, see text
+    :param page_size: default number of items per page (per_page is honoured up to 100)
+    :param latency: number of seconds every request takes
+    :param rate_limit: number of requests allowed in one rate limit window
+    :param window: length of the rate limit window in seconds
+    :param secondary: probability of a request hitting the secondary rate limit
+    :param seed: seed of the random number generator, the same seed generates the same repositories
+    """
+
+    def __init__(self, url: str, repos: int = 1, issues: int = 100, comments: int = 5, labeled: float = 0.2,
+                 length: int = 400, keywords: float = 0.01, page_size: int = 30, latency: float = 0.0,
+                 rate_limit: int = 5000, window: int = 3600, secondary: float = 0.0, seed: int = 0):
+        rnd = random.Random(seed)
+        self.url = url
+        self.page_size = page_size
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.window = window
+        self.secondary = secondary
+        self.random = random.Random(seed)
+        self.remaining = rate_limit
+        self.reset = int(time.time()) + window
+        self.stats = {}
+        self.labels = {}
+        self.version = {}
+        self.repos = {}
+        self.lock = threading.Lock()
+
+        for r in range(repos):
+            name = 'bench/r' + str(r)
+            self.version[name] = 0
+            self.repos[name] = [{'number': n,
+                                 'node_id': 'I_%d_%d' % (r, n),
+                                 'title': text(rnd, 40, keywords),
+                                 'body': text(rnd, length, keywords),
+                                 'labels': [{'name': 'triaged'}] if rnd.random() < labeled else [],
+                                 'comments': comments,
+                                 'comment_bodies': [text(rnd, length, keywords) for _ in range(comments)],
+                                 'updated_at': '2016-11-%02dT%02d:%02d:00Z' % (1 + n // 1440 % 28, n // 60 % 24,
+                                                                               n % 60),
+                                 'comments_url': url + '/repos/' + name + '/issues/' + str(n) + '/comments'}
+                                for n in range(1, issues + 1)]
+
+    def count(self, endpoint: str, status: int) -> None:
+        key = endpoint + ' ' + str(status)
+        with self.lock:
+            self.stats[key] = self.stats.get(key, 0) + 1
+
+    def throttle(self) -> tuple:
+        """
+
+        Apply rate limits to a request
+
+        :return: tuple (status, headers, body) of the error answer or (None, headers, None) if the request may proceed
+        """
+
+        with self.lock:
+            now = time.time()
+            if now >= self.reset:
+                self.remaining = self.rate_limit
+                self.reset = int(now) + self.window
+
+            if self.secondary and self.random.random() < self.secondary:
+                return 403, {'Retry-After': '1'}, {'message': 'You have exceeded a secondary rate limit'}
+
+            if self.remaining <= 0:
+                headers = {'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': str(self.reset)}
+                return 403, headers, {'message': 'API rate limit exceeded'}
+
+            self.remaining -= 1
+            return None, {'X-RateLimit-Remaining': str(self.remaining), 'X-RateLimit-Reset': str(self.reset)}, None
+
+    def page(self, items: list, path: str, query: dict) -> tuple:
+        """
+
+        Cut a page out of a list and build the Link header pointing to the next one
+
+        :param items: all items
+        :param path: requested path
+        :param query: parsed query string
+        :return: tuple (items on the page, headers)
+        """
+
+        per_page = min(int(query.get('per_page', self.page_size)), 100)
+        number = int(query.get('page', 1))
+        last = max((len(items) + per_page - 1) // per_page, 1)
+        headers = {}
+
+        if number < last:
+            link = dict(query, page=number + 1, per_page=per_page)
+            last_link = dict(query, page=last, per_page=per_page)
+            headers['Link'] = '<%s%s?%s>; rel="next", <%s%s?%s>; rel="last"' % (
+                self.url, path, urllib.parse.urlencode(link), self.url, path, urllib.parse.urlencode(last_link))
+
+        return items[(number - 1) * per_page:number * per_page], headers
+
+    def rest_issue(self, issue: dict) -> dict:
+        return {k: v for k, v in issue.items() if k != 'comment_bodies'}
+
+    def graphql(self, query: str, variables: dict) -> dict:
+        """
+
+        Answer the GraphQL queries gh_issue_agent sends
+
+        :param query: GraphQL query
+        :param variables: its variables
+        :return: JSON answer
+        """
+
+        if 'addLabelsToLabelable' in query:
+            ids = {v: k for k, v in self.labels.items()}
+            data = {}
+            for alias, mutation in variables.items():
+                r, n = mutation['labelableId'].split('_')[1:]
+                issue = self.repos['bench/r' + r][int(n) - 1]
+                issue['labels'] += [{'name': ids[i]} for i in mutation['labelIds']]
+                data[alias] = {'clientMutationId': None}
+            return {'data': data}
+
+        repo = variables['owner'] + '/' + variables['name']
+        if 'labels(first' in query and 'issues(first' not in query:
+            nodes = [{'id': i, 'name': n} for n, i in self.labels.items()]
+            return {'data': {'repository': {'labels': {'nodes': nodes, 'pageInfo': {'hasNextPage': False}}}}}
+
+        issues = [i for i in self.repos[repo] if not variables.get('since') or i['updated_at'] >= variables['since']]
+        start = int(variables['after'] or 0)
+        comments = variables['comments']
+        nodes = [{'id': i['node_id'], 'number': i['number'], 'title': i['title'], 'body': i['body'],
+                  'updatedAt': i['updated_at'], 'labels': {'nodes': i['labels']},
+                  'comments': {'totalCount': i['comments'],
+                               'nodes': [{'body': b} for b in i['comment_bodies'][:comments]],
+                               'pageInfo': {'hasNextPage': i['comments'] > comments}}}
+                 for i in issues[start:start + 100]]
+
+        return {'data': {'repository': {'issues': {
+            'nodes': nodes, 'pageInfo': {'hasNextPage': start + 100 < len(issues), 'endCursor': str(start + 100)}}}}}
+
+
+class Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """
+
+    HTTP server handling each request in a thread of its own (http.server.ThreadingHTTPServer needs Python 3.7)
+    """
+
+    daemon_threads = True
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """
+
+    HTTP front end of FakeGitHub (server.github)
+    """
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True  # headers and body are written separately, don't wait for delayed ACKs
+
+    def log_message(self, *args):
+        pass
+
+    def answer(self, endpoint: str, status: int, body, headers: dict = None) -> None:
+        data = json.dumps(body).encode('utf-8') if body is not None else b''
+        self.server.github.count(endpoint, status)
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def body(self) -> dict:
+        return json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8') or '{}')
+
+    def handle_request(self, method: str) -> None:
+        github = self.server.github
+        url = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        path = url.path
+        body = self.body() if method in ('POST', 'PATCH') else None
+
+        if path == '/_stats':
+            with github.lock:
+                stats = {'requests': dict(github.stats), 'remaining': github.remaining}
+            return self.answer('stats', 200, stats)
+
+        if github.latency:
+            time.sleep(github.latency)
+
+        m = re.match(r'^/repos/([^/]+/[^/]+)/issues(?:/(\d+)(/comments|/labels)?)?$', path) or \
+            re.match(r'^/repos/([^/]+/[^/]+)/(labels)$', path) or re.match(r'^/orgs/([^/]+)/(repos)$', path) or \
+            re.match(r'^/(graphql)$', path)
+        if not m:
+            return self.answer('unknown', 404, {'message': 'Not Found'})
+
+        if path.startswith('/orgs'):
+            endpoint = 'org_repos'
+        elif path == '/graphql':
+            endpoint = 'graphql_mutation' if 'mutation' in body.get('query', '') else 'graphql_query'
+        elif m.group(2) == 'labels':
+            endpoint = 'create_label'
+        elif m.group(2) is None:
+            endpoint = 'issues'
+        else:
+            endpoint = {'/comments': 'comments', '/labels': 'add_labels'}.get(m.group(3), 'patch_issue')
+
+        if path.startswith('/repos') and m.group(1) not in github.repos:
+            return self.answer(endpoint, 404, {'message': 'Not Found'})
+
+        with github.lock:
+            etag = '"%s"' % hashlib.sha1((self.path + str(github.version.get(m.group(1)))).encode()).hexdigest()
+        if method == 'GET' and self.headers.get('If-None-Match') == etag:
+            return self.answer(endpoint, 304, None, {'ETag': etag})  # conditional requests are free
+
+        status, headers, error = github.throttle()
+        if status:
+            return self.answer(endpoint, status, error, headers)
+
+        if endpoint == 'org_repos':
+            repos, links = github.page([{'full_name': r} for r in github.repos], path, query)
+            return self.answer(endpoint, 200, repos, dict(headers, **links))
+
+        if endpoint.startswith('graphql'):
+            with github.lock:
+                data = github.graphql(body['query'], body.get('variables') or {})
+            return self.answer(endpoint, 200, data, headers)
+
+        repo = m.group(1)
+        if endpoint == 'create_label':
+            with github.lock:
+                node_id = github.labels.setdefault(body['name'], 'L' + str(len(github.labels)))
+            return self.answer(endpoint, 201, {'name': body['name'], 'node_id': node_id}, headers)
+
+        if endpoint == 'issues':
+            issues = [github.rest_issue(i) for i in github.repos[repo] if query.get('since', '') <= i['updated_at']]
+            issues, links = github.page(issues, path, query)
+            return self.answer(endpoint, 200, issues, dict(headers, ETag=etag, **links))
+
+        issue = github.repos[repo][int(m.group(2)) - 1]
+        if endpoint == 'comments':
+            comments, links = github.page([{'body': b} for b in issue['comment_bodies']], path, query)
+            return self.answer(endpoint, 200, comments, dict(headers, ETag=etag, **links))
+
+        with github.lock:
+            if endpoint == 'add_labels':
+                names = [label['name'] for label in issue['labels']]
+                issue['labels'] += [{'name': label} for label in body.get('labels', []) if label not in names]
+            else:
+                issue['labels'] = [{'name': label} for label in body.get('labels', [])]
+            github.version[repo] += 1
+            for label in body.get('labels', []):
+                github.labels.setdefault(label, 'L' + str(len(github.labels)))
+        if endpoint == 'add_labels':
+            return self.answer(endpoint, 200, issue['labels'], headers)
+        return self.answer(endpoint, 200, github.rest_issue(issue), headers)
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_PATCH(self):
+        self.handle_request('PATCH')
+
+
+def serve(port: int, ready=None, **kwargs) -> None:
+    """
+
+    Run the fake API until the process is killed
+
+    :param port: port to listen on (localhost only)
+    :param ready: multiprocessing.Event set once the server accepts connections
+    :param kwargs: passed to FakeGitHub
+    :return: this function does not return
+    """
+
+    server = Server(('127.0.0.1', port), Handler)
+    server.github = FakeGitHub('http://127.0.0.1:' + str(server.server_port), **kwargs)
+    if ready is not None:
+        ready.set()
+    server.serve_forever()
@@ -1,4 +1,26 @@
 from .agent import parse_args, web_main, console_main, app, main, hook, index, console, web, cli, parse_file, \
-    process_response, download_comments
+    process_response, process_pages, download_comments, fetch_comments, paginate, next_link, \
+    label_repo, list_org_repos, label_issue, label_payload, get_queue, get_session, load_rules, reload, status, \
+    new_session, pool_stats, write_report, rule_set, match_cache, get_match_cache, count, get_metrics, \
+    prometheus_metrics, count_response, fetch_pages, match_page, write_issue, store_labels, console_session, \
+    relabel_repo, relabel_main, relabel, get_store, get_deliveries
+from .rules import RuleSet
+from .cache import HTTPCache
+from .scheduler import Scheduler
+from .worker import WorkQueue
+from .graphql import GraphQLReader, GraphQLWriter
+from .metrics import Stages, Metrics, InstrumentedSession
+from .memo import MatchCache
+from .pool import MatchPool
+from .pipeline import pipeline
+from .store import IssueStore
+from .expiring import ExpiringSet
 __all__ = ['parse_args', 'web_main', 'console_main', 'app', 'main', 'hook', 'index', 'console', 'web', 'cli',
-           'parse_file', 'process_response', 'download_comments']
+           'parse_file', 'process_response', 'process_pages', 'download_comments', 'fetch_comments',
+           'paginate', 'next_link', 'label_repo', 'list_org_repos', 'label_issue', 'label_payload', 'get_queue',
+           'get_session', 'load_rules', 'reload', 'status', 'new_session', 'pool_stats', 'RuleSet', 'HTTPCache',
+           'write_report', 'Scheduler', 'WorkQueue', 'GraphQLReader', 'GraphQLWriter', 'Stages', 'rule_set',
+           'match_cache', 'get_match_cache', 'count', 'get_metrics', 'prometheus_metrics', 'count_response', 'Metrics',
+           'InstrumentedSession', 'MatchCache', 'MatchPool', 'pipeline', 'fetch_pages', 'match_page', 'write_issue',
+           'store_labels', 'console_session', 'relabel_repo', 'relabel_main', 'relabel', 'get_store', 'IssueStore',
+           'get_deliveries', 'ExpiringSet']
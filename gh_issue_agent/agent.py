@@ -1,15 +1,50 @@
 import requests
+import urllib3
 import click
 import configparser
+import contextlib
+import csv
+import json
 import os
-import re
+import signal
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 from flask import Flask
 from flask import render_template
 from flask import request as flask_request
+from flask import jsonify
+from flask import Response
+from .rules import RuleSet
+from .cache import HTTPCache
+from .scheduler import Scheduler
+from .state import get_watermark, set_watermark, get_comment_index, set_comment_index
+from .worker import WorkQueue
+from .server import run_gunicorn, run_waitress
+from .graphql import GraphQLReader, GraphQLWriter
+from .metrics import Stages, Metrics, InstrumentedSession
+from .memo import MatchCache
+from .pool import MatchPool
+from .pipeline import pipeline
+from .store import IssueStore
+from .expiring import ExpiringSet
 
 g_args = None
+g_session = None
+g_queue = None
+g_lock = threading.Lock()
+g_rules = None
+g_rules_lock = threading.Lock()
+g_metrics = None
+g_match_cache = None
+g_store = None
+g_deliveries = None
 app = Flask(__name__)
 
+MAX_WORKERS = 100  # GH secondary rate limits forbid more than 100 concurrent requests
+API_URL = 'https://api.github.com'
+
 """
     .. moduleauthor:: Tomas Kvasnicka <kvasntom@fit.cvut.cz>
     :synopsis: Process GitHub issues and label them based on user-defined rules
@@ -33,10 +68,53 @@ app = Flask(__name__)
 """
 
 
+def next_link(response: requests.Response) -> str:
+    """
+
+    Find the URL of the next page of a paginated GitHub response
+
+    :param response: HTTP response parameters (headers, body, etc)
+    :return: URL from the 'Link' HTTP header associated with rel="next" or None if this is the last page
+    """
+
+    if 'link' not in response.headers:
+        return None
+
+    links = response.headers['link'].split(',')
+    links = {x.split("rel=")[1].strip('"'): x.split(';')[0].strip().strip('<').strip('>') for x in links}
+
+    return links.get('next')
+
+
+def paginate(response: requests.Response, request: dict, args: dict):
+    """
+
+    Iterate over pages of a paginated GitHub response
+
+    :param response: HTTP response containing the first page
+    :param request: HTTP request parameters (headers, token, etc)
+    :param args: arguments passed on the command line + session
+    :return: generator of lists, each of them being the decoded JSON of one page
+
+    Yield the content of response and then follow the 'Link' HTTP header containing the word 'next' for as long as
+    there is one. The next page is requested only after the consumer is done with the current one, so there is never
+    more than one page held in memory.
+    """
+
+    while True:
+        url = next_link(response)
+        yield response.json()
+
+        if not url:
+            return
+
+        response = args['session'].get(url, headers=request['headers'])
+
+
 def download_comments(comments_url: str, request: dict, args: dict) -> list:
     """
 
-    Recursively download comments from a given GitHub URL
+    Download comments from a given GitHub URL
 
     :param comments_url: GitHub URL containing comments
     :param request: HTTP request parameters (headers, token, etc)
@@ -45,81 +123,383 @@ def download_comments(comments_url: str, request: dict, args: dict) -> list:
 
     Using data in request connect and session in args['session'] connect to comments_url and download its content. Based
     on GH documentation the content is a JSON which will be processed and the text of each comment will be saved to ret.
+    All pages of the comment thread are followed (see paginate).
+    """
+
+    response = args['session'].get(comments_url, headers=request['headers'])
+
+    return [comment['body'] for page in paginate(response, request, args) for comment in page]
 
-    If there is 'Link' HTTP header containing the word 'next' then recursively follow the URL associated with the header
-    and use this URL as new comments_url.
+
+def fetch_comments(issues: list, request: dict, args: dict) -> list:
     """
 
-    ret = []
+    Download comments for several issues at once
 
-    response = args['session'].get(comments_url, headers=request['headers'])
-    if 'link' in response.headers:
-        links = response.headers['link'].split(',')
-        links = {x.split("rel=")[1].strip('"'): x.split(';')[0].strip('<').strip('>') for x in links}
+    :param issues: issues (as sent by GitHub) whose comments should be downloaded
+    :param request: HTTP request parameters (headers, token, etc)
+    :param args: arguments passed on the command line + session
+    :return: list of lists of strings containing comments, in the same order as issues
+
+    Comment threads are downloaded by download_comments in a pool of args['workers'] threads sharing args['session'].
+    With a single worker (the default when args doesn't say otherwise) no threads are started at all. Issues which
+    already carry their comments in 'comment_bodies' (see GraphQLReader) are not downloaded again, neither are threads
+    of issues whose 'comments' count is 0.
+
+    If args['comment_index'] is set (see label_repo), threads whose issue has the same 'comments' count and
+    'updated_at' as when it was scanned last time aren't downloaded at all. Threads of other indexed issues are
+    downloaded only from the last scan on (the 'since' parameter), unless comments were deleted since then. In both
+    cases the labels matched by the comments scanned before are stored in the issue's 'comment_labels' (see
+    match_page), so only the returned comments need to be matched. Comments edited since the last scan are matched
+    again, but labels matched by their previous text are kept. Issues missing in args['issue_store'] (if set) are
+    always downloaded whole.
+    """
 
-        if 'next' in links:
-            ret += download_comments(links['next'], request, args)
+    index = args.get('comment_index')
+    store = args.get('issue_store')
 
-    for comment in response.json():
-        ret += [comment['body']]
+    def comments(issue: dict) -> list:
+        if issue.get('comment_bodies') is not None:
+            return issue['comment_bodies']
+        if issue.get('comments') == 0:
+            return []
 
-    return ret
+        url = issue['comments_url']
+        seen = index.get(str(issue['number'])) if index is not None else None
+        if store is not None and (args['repo'], issue['number']) not in store:
+            seen = None  # the store needs the whole thread
+        if seen is not None and seen['comments'] <= issue.get('comments', -1):
+            issue['comment_labels'] = seen['labels']
+            if seen['comments'] == issue['comments'] and seen['updated_at'] == issue.get('updated_at'):
+                count(args, 'comment_threads_skipped_total')
+                return []
+            url += '?' + urllib.parse.urlencode({'since': seen['updated_at']})
+
+        return download_comments(url, request, args)
+
+    workers = min(args.get('workers', 1), MAX_WORKERS, len(issues))
+    if workers <= 1:
+        return [comments(issue) for issue in issues]
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(comments, issues))
+
+
+def stage(args: dict, name: str):
+    """
+
+    Measure time spent in a stage of the run
+
+    :param args: arguments passed on the command line + session
+    :param name: name of the stage
+    :return: context manager measuring the time if args['stages'] is set, doing nothing otherwise
+    """
+
+    return args['stages'].measure(name) if args.get('stages') else _unmeasured()
+
+
+@contextlib.contextmanager
+def _unmeasured():
+    yield  # contextlib.nullcontext needs Python 3.7
+
+
+def count(args: dict, name: str, value: float = 1, **labels) -> None:
+    """
+
+    Increase a counter of the run
+
+    :param args: arguments passed on the command line + session
+    :param name: name of the counter
+    :param value: increment
+    :param labels: labels of the counter
+    :return: None
+
+    Nothing is counted unless args['stages'] is Metrics (see console_main).
+    """
+
+    if isinstance(args.get('stages'), Metrics):
+        args['stages'].inc(name, value, **labels)
+
+
+def label_payload(issue: dict) -> dict:
+    """
 
+    Build the body of a PATCH request changing labels of an issue
 
-def process_response(response: requests.Response, request: dict, labels: dict, args: dict) -> list:
+    :param issue: issue with new labels
+    :return: JSON object containing only the labels
+
+    Fields missing in the body of a PATCH request are left untouched by GitHub, so there is no need to send the whole
+    issue back (and risk overwriting whatever changed in the meantime).
     """
 
-    Recursively process JSON response from GitHub API containing data about issues
+    return {'labels': issue['labels']}
+
+
+def process_response(response: requests.Response, request: dict, labels: RuleSet, args: dict) -> list:
+    """
+
+    Process JSON response from GitHub API containing data about issues
 
     :param response: HTTP response parameters (headers, body, etc)
     :param request: HTTP request parameters (headers, token, etc)
-    :param labels: regular expressions and labels corresponding with these expressions
+    :param labels: compiled label rules
     :param args:  arguments passed on the command line + session
-    :return: list of tuples
+    :return: list of tuples (success, issue number, PATCH response)
 
     Using data in response.json() iterate over issues and search its titles and bodies for regular expressions given by
     labels. When such RE is found set a label for given issue accordingly to labels. Send a PATCH HTTP request back to
-    GitHub API to update the issue with associated labels.
+    GitHub API to update the issue with associated labels. Pages following response are processed one by one as they
+    arrive (see paginate and process_pages).
     """
 
+    return process_pages(paginate(response, request, args), request, labels, args)
+
+
+def process_pages(pages, request: dict, labels: RuleSet, args: dict) -> list:
+    """
+
+    Label issues from pages of issues
+
+    :param pages: iterable of lists of issues (see paginate and GraphQLReader.issues)
+    :param request: HTTP request parameters (headers, token, etc)
+    :param labels: compiled label rules
+    :param args:  arguments passed on the command line + session
+    :return: list of tuples (success, issue number, PATCH response)
+
+    See process_response. Issues which already have a label are skipped, comments of the others are downloaded (see
+    fetch_pages), the issues are labeled (see match_page) and their labels are sent to GitHub (see write_issue). The
+    newest 'updated_at' of all seen issues is stored in args['updated_at'].
+
+    With args['pipeline'] set the pages go through a pipeline (see pipeline) instead of one page after another:
+        - fetch: pages and their comments (args['workers'] threads download comments, see fetch_comments)
+        - match: args['match_workers'] threads labeling pages (more than one makes sense with args['match_pool'])
+        - write: args['write_workers'] threads sending labels (only one when args['writer'] batches them)
+    At most args['pipeline_depth'] pages wait for matching and as many pages of issues wait for writing, so a slow
+    stage holds the faster ones back. The run then takes about as long as its slowest stage.
+    """
+
+    if args.get('pipeline'):
+        depth = args.get('pipeline_depth', 2)
+        writers = 1 if args.get('writer') else args.get('write_workers', 1)
+        return pipeline(fetch_pages(pages, request, args),
+                        [(lambda page: match_page(*page, labels, args), args.get('match_workers', 1)),
+                         (lambda issue: write_issue(issue, request, args), writers)],
+                        [depth, depth * 100])
+
     ret = []
+    for issues, threads in fetch_pages(pages, request, args):
+        for issue in match_page(issues, threads, labels, args):
+            ret += write_issue(issue, request, args)
+
+    return ret
 
-    if 'link' in response.headers:
-        links = response.headers['link'].split(',')
-        links = {x.split("rel=")[1].strip('"'): x.split(';')[0].strip('<').strip('>') for x in links}
 
-        if 'next' in links:
-            r = args['session'].get(links['next'], headers=request['headers'])
-            ret += process_response(r, request, labels, args)
+def fetch_pages(pages, request: dict, args: dict):
+    """
 
-    for issue in response.json():
-        if not issue['labels']:
-            issue['labels'] = [label for regexp, label in labels.items()
-                               if re.search(regexp, issue['title']) or re.search(regexp, issue['body'])]
+    Read pages of issues and download comments of issues which need to be labeled
 
+    :param pages: iterable of lists of issues (see paginate and GraphQLReader.issues)
+    :param request: HTTP request parameters (headers, token, etc)
+    :param args:  arguments passed on the command line + session
+    :return: generator of tuples (list of issues without labels, list of lists of their comments)
+
+    Issues which already have a label are skipped (and dropped from args['comment_index'] if set). Comments are
+    downloaded only if args['comments'] is set, see fetch_comments. Time spent in stages 'fetch' and 'comments' is
+    measured by args['stages'] if set (see Stages). If it is Metrics, numbers of pages, issues, skipped issues, scanned
+    comments and comment threads skipped as unchanged are counted.
+
+    All issues of the page, together with the comments of those to be labeled, are stored in args['issue_store'] if
+    set (see IssueStore).
+    """
+
+    pages = iter(pages)
+
+    while True:
+        with stage(args, 'fetch'):
+            page = next(pages, None)
+        if page is None:
+            return
+
+        count(args, 'pages_total')
+        issues = [issue for issue in page if not issue['labels']]
+        if args.get('comment_index') is not None:
+            for issue in page:
+                if issue['labels']:
+                    args['comment_index'].pop(str(issue['number']), None)
+        count(args, 'issues_total', len(page))
+        count(args, 'issues_skipped_total', len(page) - len(issues))
+
+        if args['comments']:
+            with stage(args, 'comments'):
+                threads = fetch_comments(issues, request, args)
+            count(args, 'comments_scanned_total', sum(len(comments) for comments in threads))
+        else:
+            threads = [[] for _ in issues]
+
+        if args.get('issue_store') is not None:
+            for issue in page:
+                if issue['labels'] or not args['comments']:
+                    args['issue_store'].put(args['repo'], issue)
             if args['comments']:
-                comments = download_comments(issue['comments_url'], request, args)
+                for issue, comments in zip(issues, threads):
+                    args['issue_store'].put(args['repo'], issue, comments, append='comment_labels' in issue)
 
-                if comments:
-                    issue['labels'] += [label for comment in comments for regexp, label in labels.items()
-                                        if re.search(regexp, comment)]
+        args['updated_at'] = max([args.get('updated_at') or ''] + [i['updated_at'] for i in page if 'updated_at' in i])
+        yield issues, threads
 
-            if not issue['labels']:
-                issue['labels'] = [args['default_label']]
 
-            del issue['assignee']  # GH APIv3 requires this
-            r = args['session'].patch(request['api'] + args['repo'] + '/issues/' +
-                                      str(issue['number']), json=issue, headers=request['headers'])
+def match_page(issues: list, threads: list, labels: RuleSet, args: dict) -> list:
+    """
 
-            if r.status_code != 200:
-                print("Editing labels failed:", str(r.status_code), '/', str(r.json()), file=args['output'])
-                ret += [(False, response, r)]
-            else:
-                print("Patched issue", str(issue['number']), "-", issue['title'], "with labels:",
-                      str(issue['labels']), file=args['output'])
-                ret += [(True, response, r)]
+    Find labels of issues
 
-    return ret
+    :param issues: issues as sent by GitHub
+    :param threads: lists of comments of the issues
+    :param labels: compiled label rules
+    :param args:  arguments passed on the command line + session
+    :return: the issues, their 'labels' replaced with the matched ones (args['default_label'] if none matched)
+
+    Issues are matched by args['match_pool'] if set (see MatchPool), by labels otherwise. Time spent is measured as the
+    stage 'match' by args['stages'] if set. If it is Metrics, assigned labels are counted and the time spent matching
+    each issue is observed in 'match_seconds'.
+
+    Labels matched by comments scanned before are taken from the issue's 'comment_labels' (see fetch_comments). If
+    args['comment_index'] is set, the labels matched by the whole thread of each downloaded issue (see
+    RuleSet.match_thread, the threads are matched by the pool too) are stored there together with its 'comments' count
+    and 'updated_at'.
+    """
+
+    metrics = args['stages'] if isinstance(args.get('stages'), Metrics) else None
+    index = args.get('comment_index')
+    match = labels.match_issue if index is None else labels.match_thread
+    known = [issue.get('comment_labels', ()) for issue in issues]
+
+    with stage(args, 'match'):
+        if args.get('match_pool') is not None:
+            matched = args['match_pool'].match([(issue['title'], issue['body'], comments, thread_labels)
+                                                for issue, comments, thread_labels in zip(issues, threads, known)],
+                                               threads=index is not None)
+        else:
+            matched = []
+            for issue, comments, thread_labels in zip(issues, threads, known):
+                start = time.perf_counter()
+                matched.append(match(issue['title'], issue['body'], comments, thread_labels))
+                if metrics is not None:
+                    metrics.observe('match_seconds', time.perf_counter() - start)
+
+        if index is not None:
+            for issue, (_, thread_labels) in zip(issues, matched):
+                if issue.get('comment_bodies') is None and 'updated_at' in issue and 'comments' in issue:
+                    index[str(issue['number'])] = {'comments': issue['comments'], 'updated_at': issue['updated_at'],
+                                                   'labels': thread_labels}
+            matched = [found for found, _ in matched]
+
+        for issue, found in zip(issues, matched):
+            issue['labels'] = found or [args['default_label']]
+            for label in issue['labels']:
+                count(args, 'labels_total', label=label)
+
+    return issues
+
+
+def write_issue(issue: dict, request: dict, args: dict) -> list:
+    """
+
+    Send labels of an issue to GitHub
+
+    :param issue: issue with new labels
+    :param request: HTTP request parameters (headers, token, etc)
+    :param args:  arguments passed on the command line + session
+    :return: list of tuples (success, issue number, PATCH response)
+
+    If args['writer'] is set (see label_repo) the labels are queued there instead of being PATCHed, so the returned
+    results may belong to other issues of the batch, or there may be none yet. With args['dry_run'] set nothing is sent,
+    planned labels are appended to args['plan'] instead. Time spent is measured as the stage 'write' by args['stages']
+    if set. Labels which were written are stored in args['issue_store'] if set, see store_labels.
+    """
+
+    if args.get('dry_run'):
+        print("Would patch issue", str(issue['number']), "-", issue['title'], "with labels:",
+              str(issue['labels']), file=args['output'])
+        args['plan'].append({'repo': args['repo'], 'number': issue['number'], 'title': issue['title'],
+                             'labels': issue['labels']})
+        return [(True, issue['number'], None)]
+
+    if args.get('issue_store') is not None:
+        args.setdefault('pending', {})[issue['number']] = issue['labels']
+
+    if args.get('writer') and 'node_id' in issue:
+        with stage(args, 'write'):
+            return store_labels(args['writer'].add(issue), args)
+
+    with stage(args, 'write'):
+        r = args['session'].patch(request['api'] + args['repo'] + '/issues/' +
+                                  str(issue['number']), json=label_payload(issue), headers=request['headers'])
+
+    if r.status_code != 200:
+        print("Editing labels failed:", str(r.status_code), '/', str(r.json()), file=args['output'])
+        return [(False, issue['number'], r)]
+
+    print("Patched issue", str(issue['number']), "-", issue['title'], "with labels:",
+          str(issue['labels']), file=args['output'])
+    return store_labels([(True, issue['number'], r)], args)
+
+
+def store_labels(results: list, args: dict) -> list:
+    """
+
+    Store labels written to GitHub
+
+    :param results: list of tuples (success, issue number, response), see write_issue
+    :param args:  arguments passed on the command line + session
+    :return: results
+
+    Labels of issues written successfully are taken from args['pending'] and stored in args['issue_store'] (see
+    IssueStore.labeled), if it is set.
+    """
+
+    if args.get('issue_store') is not None:
+        for ok, number, _ in results:
+            labels = args.get('pending', {}).pop(number, None)
+            if ok and labels is not None:
+                args['issue_store'].labeled(args['repo'], number, labels)
+
+    return results
+
+
+def rule_set(labels: dict, args: dict, cache: MatchCache = None) -> RuleSet:
+    """
+
+    Compile label rules
+
+    :param labels: the [labels] section of the label file
+    :param args: arguments passed on the command line
+    :param cache: cache of matched rules shared by all rule sets of the process (see match_cache) or None
+    :return: compiled rules
+
+    With args['profile_rules'] set time spent in each rule is recorded (see RuleSet.profile). args['match_budget']
+    (seconds) disables rules whose single match takes longer, args['max_match_length'] cuts longer texts before
+    matching.
+    """
+
+    return RuleSet(labels, profile=args.get('profile_rules', False), time_budget=args.get('match_budget'),
+                   max_length=args.get('max_match_length'), cache=cache)
+
+
+def match_cache(args: dict) -> MatchCache:
+    """
+
+    Create the cache of matched rules
+
+    :param args: arguments passed on the command line
+    :return: MatchCache with args['match_cache_size'] entries (10000 by default) saved to args['match_cache_file'] or
+             None if the size is 0
+    """
+
+    size = args.get('match_cache_size', 10000)
+    return MatchCache(size, args.get('match_cache_file')) if size > 0 else None
 
 
 def parse_file(file: str) -> dict:
@@ -149,64 +529,573 @@ def web_main(args: dict) -> None:
     Run web server Flask
 
     :param args: parsed command line arguments
-    :return: this function does not return
+    :return: this function returns only when the server is stopped
 
     This just starts Flask and then keeps it running. Flask's power is in its hooks. See below for a few examples.
+    Issues sent to the webhook are labeled by args['hook_workers'] background threads, at most args['queue_size'] of
+    them wait in the queue. Label rules are reloaded when the label file changes or on SIGHUP (see load_rules).
+    All workers share one session keeping up to args['pool_size'] connections to GitHub alive.
+
+    args['server'] selects what serves the app on args['host']:args['port']:
+        - 'flask': Flask development server, one process with a thread per request
+        - 'gunicorn': args['processes'] processes with args['threads'] threads each (SIGHUP restarts the processes)
+        - 'waitress': one process with args['threads'] threads
+
+    The queue and the session are created lazily in every process serving the app. When the server stops, issues still
+    waiting in the queue get args['shutdown_timeout'] seconds to be labeled. Gunicorn stops on SIGTERM by itself, the
+    other servers are stopped by SystemExit raised from a SIGTERM handler.
     """
 
-    global g_args
+    global g_args, g_queue, g_rules, g_session, g_metrics, g_match_cache, g_store, g_deliveries
     g_args = args
-    app.run()
+    g_rules = None
+    g_session = None
+    g_queue = None
+    g_metrics = None
+    g_match_cache = None
+    g_store = None
+    g_deliveries = None
+
+    load_rules()
+    server = args.get('server', 'flask')
+    host = args.get('host', '127.0.0.1')
+    port = args.get('port', 5000)
+
+    try:
+        if server == 'gunicorn':
+            run_gunicorn(app, host, port, args.get('processes', 1), args.get('threads', 8),
+                         args.get('shutdown_timeout', 30), web_shutdown)
+        else:
+            if hasattr(signal, 'SIGHUP'):
+                signal.signal(signal.SIGHUP, lambda signum, frame: load_rules(force=True))
+            signal.signal(signal.SIGTERM, _terminate)
 
+            if server == 'waitress':
+                run_waitress(app, host, port, args.get('threads', 8))
+            else:
+                app.run(host, port, threaded=True)
+    finally:
+        web_shutdown()
 
-def console_main(args: dict) -> int:
+
+def _terminate(signum, frame):
+    raise SystemExit(128 + signum)  # like dying of the signal, but web_main's finally runs
+
+
+def web_shutdown() -> None:
+    """
+
+    Label issues still waiting in the webhook queue before the process exits
+
+    :return: None
+
+    The cache of matched rules is saved afterwards (if it has a file) and the store of issues is closed.
+    """
+
+    if g_queue is not None and not g_queue.close((g_args or {}).get('shutdown_timeout', 30)):
+        print('Shutdown timed out,', str(g_queue.stats()['depth']), 'issues were not labeled')
+
+    if g_match_cache is not None:
+        g_match_cache.save()
+
+    if g_store is not None:
+        g_store.close()
+
+
+def new_session(pool_size: int = 10, retries: int = 3) -> requests.Session:
+    """
+
+    Create a session keeping connections to GitHub alive
+
+    :param pool_size: maximal number of connections kept open to one host
+    :param retries: how many times a request is repeated when connecting to GitHub or reading the answer fails
+    :return: session with configured connection pool
+
+    The session can be shared by many threads, connections are taken from the pool and returned to it after the answer
+    is read. Throttled and failed answers are repeated by Scheduler, not here.
+    """
+
+    session = requests.Session()
+    retry = urllib3.util.Retry(total=retries, status=0, raise_on_status=False)
+    for prefix in ('https://', 'http://'):
+        session.mount(prefix, requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                                                            max_retries=retry))
+
+    return session
+
+
+def pool_stats(session) -> list:
+    """
+
+    Describe connection pools of a session
+
+    :param session: requests.Session, possibly wrapped in Scheduler or HTTPCache
+    :return: list of dictionaries, one for each host, with the number of connections opened, requests sent through
+             them and connections currently idle in the pool
+    """
+
+    while not isinstance(session, requests.Session) and hasattr(session, 'session'):
+        session = session.session
+
+    ret = []
+    for adapter in getattr(session, 'adapters', {}).values():
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            ret.append({'host': pool.host,
+                        'connections': pool.num_connections,
+                        'requests': pool.num_requests,
+                        'idle': sum(1 for conn in pool.pool.queue if conn) if pool.pool else 0,
+                        'size': pool.pool.maxsize if pool.pool else 0})
+
+    return ret
+
+
+def list_org_repos(org: str, request: dict, args: dict) -> list:
+    """
+
+    List repositories of a GitHub organization
+
+    :param org: name of the organization
+    :param request: HTTP request parameters (headers, token, etc)
+    :param args: arguments passed on the command line + session
+    :return: list of 'owner/name' strings or None if the listing failed
+
+    Archived repositories are left out as their issues can't be edited.
+    """
+
+    response = args['session'].get(args.get('api_url', API_URL) + '/orgs/' + org + '/repos?per_page=100',
+                                   headers=request['headers'])
+    if response.status_code != 200:
+        print('Listing repositories of', org, 'failed:', str(response.status_code), '/', response.text,
+              file=args['output'])
+        return None
+
+    return [repo['full_name'] for page in paginate(response, request, args) for repo in page
+            if not repo.get('archived')]
+
+
+def label_repo(repo: str, request: dict, labels: RuleSet, args: dict) -> list:
     """
 
     Go through all issues for a given GitHub repo and label them according to user-defined rules
 
+    :param repo: github username and repository
+    :param request: HTTP request parameters (headers, token, etc)
+    :param labels: compiled label rules
+    :param args: arguments passed on the command line + session
+    :return: list of tuples (success, issue number, response), see process_response
+
+    Get a list of issues and process it. If fetching the issues failed print a error message about it and return a
+    single failed tuple with the response.
+
+    If args['state_file'] is set the run is incremental: only issues updated since the newest 'updated_at' seen by the
+    last successful run are requested (unless args['full'] is set) and the new watermark is saved after the run.
+
+    With args['backend'] set to 'graphql' labels are sent in batches of args['batch_size'] issues through GitHub
+    GraphQL API (see GraphQLWriter). With args['read_backend'] set to 'graphql' issues are read through GraphQL API
+    together with their first args['comments_per_issue'] comments (see GraphQLReader).
+
+    When comments are searched, the state file also keeps an index of comment threads scanned so far (see
+    get_comment_index), so that threads which haven't changed aren't downloaded again (see fetch_comments). The index is
+    saved after every run, even a dry or failed one, as it describes only what has been read.
+
+    Issues and written labels are stored in args['issue_store'] if set (see IssueStore). The fingerprint of the rules
+    stored for the repository is forgotten when they differ from labels, so that relabel_repo applies them to all
+    issues.
+
+    args is copied, so several repositories can be labeled at once sharing the same session.
+    """
+
+    args = dict(args, repo=repo, updated_at=None, pending={})
+    since = None
+    if args.get('state_file') and not args.get('full'):
+        since = get_watermark(args['state_file'], repo)
+
+    if args.get('state_file') and args['comments']:
+        args['comment_index'] = get_comment_index(args['state_file'], repo, labels.fingerprint)
+
+    if args.get('backend') == 'graphql' and not args.get('dry_run'):
+        args['writer'] = GraphQLWriter(args['session'], request, repo, args.get('batch_size', 50), args['output'])
+
+    if args.get('read_backend') == 'graphql':
+        reader = GraphQLReader(args['session'], request, repo, args.get('comments_per_issue', 50), args['output'])
+        ret = process_pages(reader.issues(since), request, labels, args)
+        if reader.failed is not None:
+            ret += [(False, None, reader.failed)]
+    else:
+        url = request['api'] + repo + '/issues'
+        if args.get('state_file'):
+            params = {'state': 'open', 'per_page': 100}
+            if since:
+                params['since'] = since
+            url += '?' + urllib.parse.urlencode(params)
+
+        response = args['session'].get(url, headers=request['headers'])
+
+        if response.status_code != 200:
+            print('Fetching issues for', repo, 'failed:', str(response.status_code), '/', response.text,
+                  file=args['output'])
+            return [(False, None, response)]
+
+        ret = process_response(response, request, labels, args)
+
+    if args.get('writer'):
+        ret += store_labels(args['writer'].flush(), args)
+
+    store = args.get('issue_store')
+    if store is not None and any(r[0] for r in ret) and not args.get('dry_run') and \
+            store.fingerprint(repo) not in (None, labels.fingerprint):
+        store.set_fingerprint(repo, None)
+
+    if args.get('state_file') and args['updated_at'] and all(r[0] for r in ret) and not args.get('dry_run'):
+        set_watermark(args['state_file'], repo, args['updated_at'])
+
+    if args.get('comment_index') is not None:
+        set_comment_index(args['state_file'], repo, labels.fingerprint, args['comment_index'])
+
+    return ret
+
+
+def console_session(args: dict, pool_size: int = 10) -> Scheduler:
+    """
+
+    Wrap args['session'] in the layers console runs send requests through
+
+    :param args: parsed command line arguments, args['stages'] collects metrics of the requests
+    :param pool_size: size of the connection pool of a new session (if args has none)
+    :return: the Scheduler of the session
+
+    See console_main.
+    """
+
+    if 'session' not in args:
+        args['session'] = new_session(pool_size)
+
+    if not isinstance(args['session'], (Scheduler, HTTPCache)):
+        args['session'] = Scheduler(InstrumentedSession(args['session'], args['stages']),
+                                    args.get('write_interval', 0), args.get('max_retries', 5))
+    scheduler = args['session'] if isinstance(args['session'], Scheduler) else args['session'].session
+
+    if args.get('cache_dir') and not isinstance(args['session'], HTTPCache):
+        args['session'] = HTTPCache(args['session'], args['cache_dir'], args.get('cache_size', 100) * 1024 * 1024)
+
+    return scheduler
+
+
+def console_main(args: dict) -> int:
+    """
+
+    Go through all issues for given GitHub repos and label them according to user-defined rules
+
     :param args: parsed command line arguments
     :return: 0 if everything was OK, 1 otherwise
 
-    Connect to GitHub, get a list of issues and process this list. Very straightforward. Then just check the results of
-    the processing and exit. Also, if fetching the issues failed print a error message about it and die.
+    Connect to GitHub (args['api_url'] or API_URL) and label issues of each repository by label_repo. Very
+    straightforward. Then just check the results of the processing and exit.
+
+    args['repo'] is either a single repository or a list of them, args['org'] adds all repositories of an organization.
+    Up to args['parallel'] repositories are processed at once, all of them sharing one session (and its connection
+    pool) and one compiled rule set. When there is more than one repository a summary is printed for each of them.
+
+    All requests go through Scheduler which keeps them within GitHub rate limits (args['write_interval'] seconds
+    between writes, args['max_retries'] retries). If args['cache_dir'] is set, GET requests also go through HTTPCache.
+    Statistics of both are printed at the end, together with time spent in each stage of the run and other metrics
+    (HTTP requests by endpoint and status, pages, comments, labels - see Metrics).
+
+    With args['dry_run'] set no labels are sent to GitHub. Planned labels are printed and written to args['report'] (if
+    set) in args['report_format'], see write_report.
+
+    Texts seen before aren't matched again, see match_cache. Its hit rate is printed at the end. With
+    args['match_processes'] set issues are matched by a pool of processes in batches of args['match_batch_size'] (see
+    MatchPool), unless the rules are profiled. With args['pipeline'] set pages are fetched, matched and written at the
+    same time, see process_pages.
+
+    With args['profile_rules'] set the time spent in each label rule is printed, slow rules are flagged. Rules disabled
+    for exceeding args['match_budget'] are always reported. See rule_set.
+
+    With args['store'] set issues, comments and labels are kept in that SQLite database, see IssueStore and
+    relabel_main.
     """
 
-    ret = []
-    api = 'https://api.github.com/repos/'
-    regexp = {re.compile(r, re.IGNORECASE): v for r, v in args['labels'].items()}
+    api = args.get('api_url', API_URL) + '/repos/'
+    cache = match_cache(args)
+    rules = rule_set(args['labels'], args, cache)
     headers = {'Authorization': 'token ' + args['token'], 'User-Agent': 'label-robot'}
+    request = {'api': api, 'graphql': args.get('api_url', API_URL) + '/graphql', 'headers': headers}
+    repos = [args['repo']] if isinstance(args['repo'], str) else list(args['repo'])
+    parallel = args.get('parallel', 1)
+    args['stages'] = Metrics()
+    args['plan'] = []
 
-    if 'session' not in args:
-        args['session'] = requests.session()
+    scheduler = console_session(args, max(args.get('workers', 1) * parallel, 10))
 
-    response = args['session'].get(api + args['repo'] + '/issues', headers=headers)
+    if args.get('org'):
+        org_repos = list_org_repos(args['org'], request, args)
+        if org_repos is None:
+            return 1
+        repos += [r for r in org_repos if r not in repos]
 
-    if response.status_code == 200:
-        request = {'api': api, 'headers': headers}
-        ret += process_response(response, request, regexp, args)
-    else:
-        print('Fetching issues for', args['repo'], 'failed:', str(response.status_code), '/', response.text,
+    if args.get('match_processes', 0) > 0 and not args.get('profile_rules'):
+        args['match_pool'] = MatchPool(args['labels'], args['match_processes'], args.get('match_batch_size', 20),
+                                       time_budget=args.get('match_budget'), max_length=args.get('max_match_length'))
+
+    if args.get('store'):
+        args['issue_store'] = IssueStore(args['store'])
+
+    parallel = min(parallel, len(repos))
+    try:
+        if parallel <= 1:
+            results = [label_repo(repo, request, rules, args) for repo in repos]
+        else:
+            with ThreadPoolExecutor(max_workers=parallel) as pool:
+                results = list(pool.map(lambda repo: label_repo(repo, request, rules, args), repos))
+    finally:
+        if args.get('match_pool') is not None:
+            args.pop('match_pool').close()
+        if args.get('issue_store') is not None:
+            args.pop('issue_store').close()
+
+    if len(repos) > 1:
+        for repo, ret in zip(repos, results):
+            if any(r[1] is None for r in ret):
+                print('Summary for', repo + ':', 'fetching issues failed', file=args['output'])
+            else:
+                print('Summary for', repo + ':', str(sum(1 for r in ret if r[0])), 'patched,',
+                      str(sum(1 for r in ret if not r[0])), 'failed', file=args['output'])
+
+    if isinstance(scheduler, Scheduler):
+        print('Rate limit:', str(scheduler.retries), 'retries,', '%.1f' % scheduler.waited, 's waited',
               file=args['output'])
-        return 1
 
-    for r in ret:
-        if not r[0]:
-            return 1
+    if isinstance(args['session'], HTTPCache):
+        print('HTTP cache:', str(args['session'].hits), 'hits,', str(args['session'].misses), 'misses',
+              file=args['output'])
+
+    if cache is not None:
+        cache.save()
+        stats = cache.stats()
+        print('Match cache:', str(stats['hits']), 'hits,', str(stats['misses']), 'misses',
+              '(%.0f%%)' % (stats['hit_rate'] * 100), file=args['output'])
+
+    print('Timing:', ', '.join('%s %.3fs' % (name, stage['seconds'])
+                               for name, stage in args['stages'].summary().items()), file=args['output'])
+    print('Metrics:', file=args['output'])
+    for line in args['stages'].report():
+        print('   ', line, file=args['output'])
+
+    profile = rules.profile() if args.get('profile_rules') or args.get('match_budget') is not None else None
+    if args.get('profile_rules'):
+        print('Rule profile:', file=args['output'])
+        for rule in profile:
+            print('   ', rule['rule'], '->', rule['label'] + ':', str(rule['calls']), 'texts,', str(rule['hits']),
+                  'hits,', '%.3fs,' % rule['seconds'], '%.1f ns/char' % rule['ns_per_char'],
+                  '(SLOW)' if rule['slow'] else '', file=args['output'])
+
+    for rule in profile or []:
+        if rule['disabled']:
+            print('Rule', rule['rule'], 'disabled: a match took', '%.3fs' % rule['worst'], file=args['output'])
+
+    if args.get('report'):
+        write_report(args['report'], args.get('report_format', 'json'), args['plan'], args['stages'], profile)
+
+    for ret in results:
+        for r in ret:
+            if not r[0]:
+                return 1
 
     return 0
 
 
-def parse_args(repo: str, auth_file: str, label_file: str, default_label: str, comments: bool, output: str) -> dict:
+def relabel_repo(repo: str, request: dict, labels: RuleSet, args: dict) -> list:
+    """
+
+    Apply label rules to the issues of a repository kept in args['issue_store']
+
+    :param repo: github username and repository
+    :param request: HTTP request parameters (headers, token, etc)
+    :param labels: compiled label rules
+    :param args: arguments passed on the command line + session
+    :return: list of tuples (success, issue number, response), see write_issue
+
+    Only issues whose labels were written by the agent and haven't been changed by anybody else since are relabeled
+    (see IssueStore.issues). Their titles, bodies and comments are matched as stored, nothing is downloaded. Labels are
+    sent only to the issues whose labels have changed, always by REST PATCH (see write_issue) which replaces them - the
+    GraphQL backend could only add labels and args['backend'] is ignored.
+
+    The fingerprint of labels is stored for the repository after the run unless a write failed or it was a dry run.
+    The repository is skipped when its stored fingerprint is already the same, unless args['full'] is set.
+    """
+
+    args = dict(args, repo=repo, pending={}, writer=None)
+    store = args['issue_store']
+    if store.fingerprint(repo) == labels.fingerprint and not args.get('full'):
+        print('Labels of', repo, 'are up to date', file=args['output'])
+        return []
+
+    changed = []
+    with stage(args, 'match'):
+        stored = store.issues(repo)
+        for issue, comments in stored:
+            found = labels.match_issue(issue['title'], issue['body'], comments) or [args['default_label']]
+            if sorted(found) != issue['labels']:
+                issue['labels'] = found
+                changed.append(issue)
+    count(args, 'issues_total', len(stored))
+    count(args, 'issues_skipped_total', len(stored) - len(changed))
+
+    ret = []
+    for issue in changed:
+        ret += write_issue(issue, request, args)
+
+    print('Relabeled', repo + ':', str(len(changed)), 'changed,', str(len(stored) - len(changed)), 'unchanged,',
+          str(sum(1 for r in ret if not r[0])), 'failed', file=args['output'])
+
+    if all(r[0] for r in ret) and not args.get('dry_run'):
+        store.set_fingerprint(repo, labels.fingerprint)
+
+    return ret
+
+
+def relabel_main(args: dict) -> int:
+    """
+
+    Apply changed label rules to the issues kept in a local store
+
+    :param args: parsed command line arguments
+    :return: 0 if everything was OK, 1 otherwise
+
+    Open the SQLite database args['store'] filled by console_main or the webhook and relabel each of args['repo'] (all
+    stored repositories if empty) by relabel_repo. Requests go through the same layers as in console_main. Time spent
+    in each stage and other metrics are printed at the end, with args['dry_run'] set the planned labels are written to
+    args['report'] (if set).
+    """
+
+    api = args.get('api_url', API_URL) + '/repos/'
+    rules = rule_set(args['labels'], args, match_cache(args))
+    headers = {'Authorization': 'token ' + args['token'], 'User-Agent': 'label-robot'}
+    request = {'api': api, 'graphql': args.get('api_url', API_URL) + '/graphql', 'headers': headers}
+    args['stages'] = Metrics()
+    args['plan'] = []
+    console_session(args)
+
+    args['issue_store'] = IssueStore(args['store'])
+    try:
+        repos = [args['repo']] if isinstance(args['repo'], str) else list(args['repo'] or args['issue_store'].repos())
+        results = [relabel_repo(repo, request, rules, args) for repo in repos]
+    finally:
+        args.pop('issue_store').close()
+
+    print('Timing:', ', '.join('%s %.3fs' % (name, stage['seconds'])
+                               for name, stage in args['stages'].summary().items()), file=args['output'])
+    print('Metrics:', file=args['output'])
+    for line in args['stages'].report():
+        print('   ', line, file=args['output'])
+
+    if args.get('report'):
+        write_report(args['report'], args.get('report_format', 'json'), args['plan'], args['stages'])
+
+    return 0 if all(r[0] for ret in results for r in ret) else 1
+
+
+def write_report(file: str, report_format: str, plan: list, stages: Stages, rules: list = None) -> None:
+    """
+
+    Write planned label changes to a file
+
+    :param file: path to the report
+    :param report_format: 'json' or 'csv'
+    :param plan: list of dictionaries with 'repo', 'number', 'title' and 'labels' of each issue
+    :param stages: time spent in stages of the run
+    :param rules: time spent in label rules (see RuleSet.profile) or None when they weren't profiled
+    :return: None
+
+    JSON report is an object with 'issues' (the plan), 'stages' (see Stages.summary) and 'rules' if given. CSV report
+    has a row for each issue, labels are separated by ';', and the time spent in stages and rules is left out.
+    """
+
+    with open(file, 'w', newline='', encoding='utf-8') as f:
+        if report_format == 'csv':
+            writer = csv.writer(f)
+            writer.writerow(['repo', 'number', 'title', 'labels'])
+            for issue in plan:
+                writer.writerow([issue['repo'], issue['number'], issue['title'], ';'.join(issue['labels'])])
+        else:
+            report = {'issues': plan, 'stages': stages.summary()}
+            if rules is not None:
+                report['rules'] = rules
+            json.dump(report, f, indent=2)
+
+
+def parse_args(repo: str, auth_file: str, label_file: str, default_label: str, comments: bool, output: str,
+               workers: int = 1, cache_dir: str = None, cache_size: int = 100, state_file: str = None,
+               full: bool = False, repo_file: str = None, org: str = None, parallel: int = 1,
+               write_interval: float = 1.0, max_retries: int = 5, hook_workers: int = 4,
+               queue_size: int = 1000, pool_size: int = 10, http_retries: int = 3, server: str = 'flask',
+               host: str = '127.0.0.1', port: int = 5000, processes: int = 1, threads: int = 8,
+               shutdown_timeout: int = 30, backend: str = 'rest', batch_size: int = 50, read_backend: str = 'rest',
+               comments_per_issue: int = 50, dry_run: bool = False, report: str = None,
+               report_format: str = 'json', api_url: str = API_URL, profile_rules: bool = False,
+               match_budget: float = None, max_match_length: int = None, match_cache_size: int = 10000,
+               match_cache_file: str = None, match_processes: int = 0, match_batch_size: int = 20,
+               pipeline: bool = True, match_workers: int = 1, write_workers: int = 1, pipeline_depth: int = 2,
+               store: str = None, dedupe_size: int = 10000, dedupe_ttl: float = 3600,
+               coalesce_window: float = 1.0) -> dict:
     """
 
     Parse command line arguments
 
-    :param repo: github username and repository to use
+    :param repo: github username and repository to use or a list of them
     :param auth_file: config file containing github token for user
     :param label_file: config file containing RE expressions and labels
     :param default_label: default issue label when non from label_file matches
     :param comments: search for RE also in comments
     :param output: path to output file or None for stdout
+    :param workers: number of threads downloading comments
+    :param cache_dir: path to directory with cached GitHub responses or None to disable caching
+    :param cache_size: maximal size of the cache in MB
+    :param state_file: path to file remembering the last processed issue of each repo or None to always process all
+    :param full: ignore state_file and process all issues
+    :param repo_file: path to file listing repositories to use, one per line, in addition to repo
+    :param org: GitHub organization whose repositories are used in addition to repo
+    :param parallel: number of repositories processed at once
+    :param write_interval: minimal number of seconds between two PATCH requests
+    :param max_retries: how many times a throttled or failed request is repeated
+    :param hook_workers: number of threads labeling issues sent to the webhook
+    :param queue_size: maximal number of webhook issues waiting to be labeled
+    :param pool_size: maximal number of connections to GitHub kept alive by the web server
+    :param http_retries: how many times the web server repeats a request when the connection to GitHub fails
+    :param server: what serves the web app - 'flask', 'gunicorn' or 'waitress'
+    :param host: address the web server binds to
+    :param port: port the web server binds to
+    :param processes: number of web server processes (gunicorn only)
+    :param threads: number of threads handling requests in each web server process
+    :param shutdown_timeout: number of seconds the web server waits for queued issues when stopping
+    :param backend: API used to write labels - 'rest' (one request per issue) or 'graphql' (batches of issues)
+    :param batch_size: number of issues labeled by one GraphQL request
+    :param read_backend: API used to read issues - 'rest' (comments are read by a request per issue) or 'graphql'
+                         (issues are read together with their comments)
+    :param comments_per_issue: number of comments read together with each issue by GraphQL
+    :param dry_run: don't send any labels to GitHub, just print what would be done
+    :param report: path to file the planned labels are written to or None
+    :param report_format: format of the report - 'json' or 'csv'
+    :param api_url: URL of GitHub API (eg. of GitHub Enterprise or a stand-in server used for benchmarks)
+    :param profile_rules: record time spent in each label rule
+    :param match_budget: seconds a single match of a label rule may take before the rule is disabled, None for no limit
+    :param max_match_length: number of characters of each text the label rules are matched against, None for all
+    :param match_cache_size: number of texts whose matched rules are remembered, 0 turns the cache off
+    :param match_cache_file: path to file the cache of matched rules is kept in between runs or None
+    :param match_processes: number of processes matching label rules, 0 matches them in the main process
+    :param match_batch_size: number of issues sent to a matching process at once
+    :param pipeline: fetch, match and write issues at the same time instead of one page after another
+    :param match_workers: number of threads matching pages of issues in the pipeline
+    :param write_workers: number of threads writing labels in the pipeline (REST backend only)
+    :param pipeline_depth: number of pages of issues waiting for matching in the pipeline
+    :param store: path to SQLite database keeping issues, comments and labels (see IssueStore) or None
+    :param dedupe_size: number of webhook deliveries remembered to recognize redeliveries
+    :param dedupe_ttl: number of seconds a webhook delivery is remembered
+    :param coalesce_window: number of seconds webhook events of one issue are collected before it is labeled (events
+                            still waiting in the queue are merged even with 0)
     :return: dictionary with parsed arguments
 
     Use Click and parse command line arguments. Also do some basic checks like presence of the section github/labels in
@@ -229,15 +1118,84 @@ def parse_args(repo: str, auth_file: str, label_file: str, default_label: str, c
                           "....\n\n"
                           "Obviously label definitions should use basic RE and are totally up to you")
 
+    if workers < 1 or parallel < 1 or hook_workers < 1 or processes < 1 or threads < 1 or batch_size < 1:
+        raise ValueError("Number of workers must be at least 1")
+
+    if (match_budget is not None and match_budget <= 0) or (max_match_length is not None and max_match_length < 1):
+        raise ValueError("Match budget and maximal match length must be positive")
+
+    if match_cache_size < 0:
+        raise ValueError("Size of the match cache can't be negative")
+
+    if match_processes < 0 or match_batch_size < 1:
+        raise ValueError("Number of matching processes can't be negative and batches must have at least 1 issue")
+
+    if match_workers < 1 or write_workers < 1 or pipeline_depth < 1:
+        raise ValueError("Pipeline stages must have at least 1 worker and 1 page of depth")
+
+    if dedupe_size < 1 or dedupe_ttl <= 0 or coalesce_window < 0:
+        raise ValueError("Webhook deliveries must be remembered and events can't be coalesced for negative time")
+
+    if repo_file:
+        if not os.path.isfile(repo_file):
+            raise FileNotFoundError("File " + str(repo_file) + " doesn't exist")
+
+        with open(repo_file) as f:
+            repo = ([repo] if isinstance(repo, str) else list(repo or [])) + \
+                   [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
     if output:
         output = open(output, 'a')
 
     return {'token': auth['github']['token'],
             'labels': labels['labels'],
+            'label_file': label_file,
             'repo': repo,
             'default_label': default_label,
             'comments': comments,
-            'output': output}
+            'output': output,
+            'workers': workers,
+            'cache_dir': cache_dir,
+            'cache_size': cache_size,
+            'state_file': state_file,
+            'full': full,
+            'org': org,
+            'parallel': parallel,
+            'write_interval': write_interval,
+            'max_retries': max_retries,
+            'hook_workers': hook_workers,
+            'queue_size': queue_size,
+            'pool_size': pool_size,
+            'http_retries': http_retries,
+            'server': server,
+            'host': host,
+            'port': port,
+            'processes': processes,
+            'threads': threads,
+            'shutdown_timeout': shutdown_timeout,
+            'backend': backend,
+            'batch_size': batch_size,
+            'read_backend': read_backend,
+            'comments_per_issue': comments_per_issue,
+            'dry_run': dry_run,
+            'report': report,
+            'report_format': report_format,
+            'api_url': api_url.rstrip('/'),
+            'profile_rules': profile_rules,
+            'match_budget': match_budget,
+            'max_match_length': max_match_length,
+            'match_cache_size': match_cache_size,
+            'match_cache_file': match_cache_file,
+            'match_processes': match_processes,
+            'match_batch_size': match_batch_size,
+            'pipeline': pipeline,
+            'match_workers': match_workers,
+            'write_workers': write_workers,
+            'pipeline_depth': pipeline_depth,
+            'store': store,
+            'dedupe_size': dedupe_size,
+            'dedupe_ttl': dedupe_ttl,
+            'coalesce_window': coalesce_window}
 
 
 @click.group()
@@ -256,7 +1214,33 @@ def cli():
 @click.option('--default-label', default='take-a-look-personally', help='default label')
 @click.option('--comments', default=True, help='check comments')
 @click.option('--output', default=None, help='path to file used instead of stdout')
-def web(repo: str, auth_file: str, label_file: str, default_label: str, comments: bool, output: str) -> None:
+@click.option('--hook-workers', default=4, help='number of threads labeling issues sent to the webhook')
+@click.option('--queue-size', default=1000, help='maximal number of issues waiting to be labeled')
+@click.option('--pool-size', default=10, help='number of connections to GitHub kept alive')
+@click.option('--http-retries', default=3, help='how many times a request is repeated when the connection fails')
+@click.option('--server', default='flask', type=click.Choice(['flask', 'gunicorn', 'waitress']),
+              help='web server to use, flask is for development only')
+@click.option('--host', default='127.0.0.1', help='address to bind to')
+@click.option('--port', default=5000, help='port to bind to')
+@click.option('--processes', default=1, help='number of server processes (gunicorn only)')
+@click.option('--threads', default=8, help='number of threads handling requests in each process')
+@click.option('--shutdown-timeout', default=30, help='seconds to wait for queued issues when stopping')
+@click.option('--api-url', default=API_URL, help='URL of GitHub API')
+@click.option('--profile-rules', is_flag=True, help='measure time spent in each label rule')
+@click.option('--match-budget', default=None, type=float,
+              help='seconds one match of a label rule may take before the rule is disabled')
+@click.option('--max-match-length', default=None, type=int, help='number of characters of a text matched by rules')
+@click.option('--match-cache-size', default=10000, help='number of texts whose matched rules are remembered, 0 = off')
+@click.option('--match-cache-file', default=None, help='path to file the matched rules are remembered in')
+@click.option('--store', default=None, help='SQLite database keeping labeled issues for the relabel command')
+@click.option('--dedupe-size', default=10000, help='number of webhook deliveries remembered to skip redeliveries')
+@click.option('--dedupe-ttl', default=3600.0, help='seconds a webhook delivery is remembered')
+@click.option('--coalesce-window', default=1.0, help='seconds events of one issue wait for each other')
+def web(repo: str, auth_file: str, label_file: str, default_label: str, comments: bool, output: str,
+        hook_workers: int, queue_size: int, pool_size: int, http_retries: int, server: str, host: str, port: int,
+        processes: int, threads: int, shutdown_timeout: int, api_url: str, profile_rules: bool, match_budget: float,
+        max_match_length: int, match_cache_size: int, match_cache_file: str, store: str, dedupe_size: int,
+        dedupe_ttl: float, coalesce_window: float) -> None:
     """
 
     Run web_main with parsed command line arguments
@@ -267,36 +1251,191 @@ def web(repo: str, auth_file: str, label_file: str, default_label: str, comments
     :param default_label: see parse_args
     :param comments: see parse_args
     :param output: see parse_args
+    :param hook_workers: see parse_args
+    :param queue_size: see parse_args
+    :param pool_size: see parse_args
+    :param http_retries: see parse_args
+    :param server: see parse_args
+    :param host: see parse_args
+    :param port: see parse_args
+    :param processes: see parse_args
+    :param threads: see parse_args
+    :param shutdown_timeout: see parse_args
+    :param api_url: see parse_args
+    :param profile_rules: see parse_args
+    :param match_budget: see parse_args
+    :param max_match_length: see parse_args
+    :param match_cache_size: see parse_args
+    :param match_cache_file: see parse_args
+    :param store: see parse_args
+    :param dedupe_size: see parse_args
+    :param dedupe_ttl: see parse_args
+    :param coalesce_window: see parse_args
     :return: return code from web_main
 
     For the description of Click's command please see Click documentation - http://click.pocoo.org/5/
     """
-    return web_main(parse_args(repo, auth_file, label_file, default_label, comments, output))
+    return web_main(parse_args(repo, auth_file, label_file, default_label, comments, output,
+                               hook_workers=hook_workers, queue_size=queue_size, pool_size=pool_size,
+                               http_retries=http_retries, server=server, host=host, port=port, processes=processes,
+                               threads=threads, shutdown_timeout=shutdown_timeout, api_url=api_url,
+                               profile_rules=profile_rules, match_budget=match_budget,
+                               max_match_length=max_match_length, match_cache_size=match_cache_size,
+                               match_cache_file=match_cache_file, store=store, dedupe_size=dedupe_size,
+                               dedupe_ttl=dedupe_ttl, coalesce_window=coalesce_window))
 
 
 @cli.command()
-@click.option('--repo', default='mi-pyt-label-robot/r1', help='default repo to watch, including username')
+@click.option('--repo', multiple=True, help='repo to watch, including username (can be repeated)')
+@click.option('--repo-file', default=None, help='path to file listing repos to watch, one per line')
+@click.option('--org', default=None, help='watch all repos of this GitHub organization')
+@click.option('--parallel', default=4, help='number of repos processed at once')
 @click.option('--auth-file', default='auth.cfg', help='path to auth file')
 @click.option('--label-file', default='labels.cfg', help='path to label definitions file')
 @click.option('--default-label', default='take-a-look-personally', help='default label')
 @click.option('--comments', default=True, help='check comments')
 @click.option('--output', default=None, help='path to file used instead of stdout')
-def console(repo: str, auth_file: str, label_file: str, default_label: str, comments: bool, output: str) -> int:
+@click.option('--workers', default=4, help='number of comment threads downloaded at once')
+@click.option('--cache-dir', default=None, help='directory caching GitHub responses between runs')
+@click.option('--cache-size', default=100, help='maximal size of the cache in MB')
+@click.option('--state-file', default='state.json', help='path to file remembering already processed issues')
+@click.option('--full', is_flag=True, help='process all issues, not only those updated since the last run')
+@click.option('--write-interval', default=1.0, help='minimal number of seconds between two label edits')
+@click.option('--max-retries', default=5, help='how many times a throttled or failed request is repeated')
+@click.option('--backend', default='rest', type=click.Choice(['rest', 'graphql']), help='API used to write labels')
+@click.option('--batch-size', default=50, help='number of issues labeled by one GraphQL request')
+@click.option('--read-backend', default='rest', type=click.Choice(['rest', 'graphql']), help='API used to read issues')
+@click.option('--comments-per-issue', default=50, help='number of comments read together with each issue by GraphQL')
+@click.option('--dry-run', is_flag=True, help='do not change any labels, just show what would be done')
+@click.option('--report', default=None, help='path to file the planned labels are written to')
+@click.option('--report-format', default='json', type=click.Choice(['json', 'csv']), help='format of the report')
+@click.option('--api-url', default=API_URL, help='URL of GitHub API')
+@click.option('--profile-rules', is_flag=True, help='measure time spent in each label rule')
+@click.option('--match-budget', default=None, type=float,
+              help='seconds one match of a label rule may take before the rule is disabled')
+@click.option('--max-match-length', default=None, type=int, help='number of characters of a text matched by rules')
+@click.option('--match-cache-size', default=10000, help='number of texts whose matched rules are remembered, 0 = off')
+@click.option('--match-cache-file', default=None, help='path to file the matched rules are remembered in')
+@click.option('--match-processes', default=0, help='number of processes matching label rules, 0 = none')
+@click.option('--match-batch-size', default=20, help='number of issues sent to a matching process at once')
+@click.option('--pipeline/--no-pipeline', default=True, help='fetch, match and write issues at the same time')
+@click.option('--match-workers', default=1, help='number of threads matching issues in the pipeline')
+@click.option('--write-workers', default=1, help='number of threads writing labels in the pipeline')
+@click.option('--pipeline-depth', default=2, help='number of pages waiting for matching in the pipeline')
+@click.option('--store', default=None, help='SQLite database keeping labeled issues for the relabel command')
+def console(repo: tuple, repo_file: str, org: str, parallel: int, auth_file: str, label_file: str, default_label: str,
+            comments: bool, output: str, workers: int, cache_dir: str, cache_size: int, state_file: str,
+            full: bool, write_interval: float, max_retries: int, backend: str, batch_size: int, read_backend: str,
+            comments_per_issue: int, dry_run: bool, report: str, report_format: str, api_url: str, profile_rules: bool,
+            match_budget: float, max_match_length: int, match_cache_size: int, match_cache_file: str,
+            match_processes: int, match_batch_size: int, pipeline: bool, match_workers: int, write_workers: int,
+            pipeline_depth: int, store: str) -> int:
     """
 
     Run console_main with parsed command line arguments
 
     :param repo: see parse_args
+    :param repo_file: see parse_args
+    :param org: see parse_args
+    :param parallel: see parse_args
     :param auth_file: see parse_args
     :param label_file: see parse_args
     :param default_label: see parse_args
     :param comments: see parse_args
     :param output: see parse_args
+    :param workers: see parse_args
+    :param cache_dir: see parse_args
+    :param cache_size: see parse_args
+    :param state_file: see parse_args
+    :param full: see parse_args
+    :param write_interval: see parse_args
+    :param max_retries: see parse_args
+    :param backend: see parse_args
+    :param batch_size: see parse_args
+    :param read_backend: see parse_args
+    :param comments_per_issue: see parse_args
+    :param dry_run: see parse_args
+    :param report: see parse_args
+    :param report_format: see parse_args
+    :param api_url: see parse_args
+    :param profile_rules: see parse_args
+    :param match_budget: see parse_args
+    :param max_match_length: see parse_args
+    :param match_cache_size: see parse_args
+    :param match_cache_file: see parse_args
+    :param match_processes: see parse_args
+    :param match_batch_size: see parse_args
+    :param pipeline: see parse_args
+    :param match_workers: see parse_args
+    :param write_workers: see parse_args
+    :param pipeline_depth: see parse_args
+    :param store: see parse_args
     :return: return code from console_main
 
+    Without any of repo, repo_file and org the default repo mi-pyt-label-robot/r1 is used.
+
+    For the description of Click's command please see Click documentation - http://click.pocoo.org/5/
+    """
+    if not repo and not repo_file and not org:
+        repo = 'mi-pyt-label-robot/r1'
+    elif len(repo) == 1:
+        repo = repo[0]
+
+    return console_main(parse_args(repo, auth_file, label_file, default_label, comments, output, workers, cache_dir,
+                                   cache_size, state_file, full, repo_file, org, parallel, write_interval,
+                                   max_retries, backend=backend, batch_size=batch_size, read_backend=read_backend,
+                                   comments_per_issue=comments_per_issue, dry_run=dry_run, report=report,
+                                   report_format=report_format, api_url=api_url, profile_rules=profile_rules,
+                                   match_budget=match_budget, max_match_length=max_match_length,
+                                   match_cache_size=match_cache_size, match_cache_file=match_cache_file,
+                                   match_processes=match_processes, match_batch_size=match_batch_size,
+                                   pipeline=pipeline, match_workers=match_workers, write_workers=write_workers,
+                                   pipeline_depth=pipeline_depth, store=store))
+
+
+@cli.command()
+@click.option('--store', required=True, help='SQLite database filled by the console or web command')
+@click.option('--repo', multiple=True, help='stored repo to relabel (can be repeated), all of them by default')
+@click.option('--auth-file', default='auth.cfg', help='path to auth file')
+@click.option('--label-file', default='labels.cfg', help='path to label definitions file')
+@click.option('--default-label', default='take-a-look-personally', help='default label')
+@click.option('--output', default=None, help='path to file used instead of stdout')
+@click.option('--full', is_flag=True, help='relabel even repos already labeled by the current rules')
+@click.option('--write-interval', default=1.0, help='minimal number of seconds between two label edits')
+@click.option('--max-retries', default=5, help='how many times a throttled or failed request is repeated')
+@click.option('--dry-run', is_flag=True, help='do not change any labels, just show what would be done')
+@click.option('--report', default=None, help='path to file the planned labels are written to')
+@click.option('--report-format', default='json', type=click.Choice(['json', 'csv']), help='format of the report')
+@click.option('--api-url', default=API_URL, help='URL of GitHub API')
+def relabel(store: str, repo: tuple, auth_file: str, label_file: str, default_label: str, output: str, full: bool,
+            write_interval: float, max_retries: int, dry_run: bool, report: str, report_format: str,
+            api_url: str) -> int:
+    """
+
+    Run relabel_main with parsed command line arguments
+
+    :param store: see parse_args
+    :param repo: see parse_args
+    :param auth_file: see parse_args
+    :param label_file: see parse_args
+    :param default_label: see parse_args
+    :param output: see parse_args
+    :param full: see relabel_repo
+    :param write_interval: see parse_args
+    :param max_retries: see parse_args
+    :param dry_run: see parse_args
+    :param report: see parse_args
+    :param report_format: see parse_args
+    :param api_url: see parse_args
+    :return: return code from relabel_main
+
+    Labels are always written by REST PATCH, see relabel_repo.
+
     For the description of Click's command please see Click documentation - http://click.pocoo.org/5/
     """
-    return console_main(parse_args(repo, auth_file, label_file, default_label, comments, output))
+    return relabel_main(parse_args(list(repo), auth_file, label_file, default_label, True, output, full=full,
+                                   write_interval=write_interval, max_retries=max_retries, dry_run=dry_run,
+                                   report=report, report_format=report_format, api_url=api_url, store=store))
 
 
 @app.route('/')
@@ -316,53 +1455,335 @@ def index():
     return render_template('index.html')
 
 
+def label_issue(issue: dict, repo: str, token: str, labels: RuleSet) -> requests.Response:
+    """
+
+    Label an issue sent by GitHub webhook
+
+    :param issue: the issue part of the webhook payload
+    :param repo: github username and repository the issue belongs to
+    :param token: github token
+    :param labels: compiled label rules
+    :return: HTTP response to the POST request adding the labels
+
+    Search issue title and body for string matching one of configured RE and set a label configured for this RE, then
+    send the labels back to GitHub. Called by the workers of the webhook queue, see hook.
+
+    The labels are added to the issue (POST .../issues/:number/labels) rather than replacing its labels by PATCH. The
+    issue was unlabeled when hook received it, but it waited in the queue since, and labels somebody added meanwhile
+    must not be overwritten.
+
+    The issue and its new labels are kept in the store (see get_store) if there is one. Comments aren't read by the
+    webhook, so those stored before are kept. Labels of the issue returned by GitHub are stored as its current labels,
+    so an issue labeled by somebody else meanwhile is left alone by relabel_repo.
+    """
+
+    api = (g_args or {}).get('api_url', API_URL) + '/repos/'
+    headers = {'Authorization': 'token ' + token, 'User-Agent': 'webhook-gh'}
+
+    with get_metrics().timer('match_seconds'):
+        issue['labels'] = labels.match(issue['title'], issue['body'])
+
+    if not issue['labels']:
+        issue['labels'] = ['take-a-look-personally']
+
+    for label in issue['labels']:
+        get_metrics().inc('labels_total', label=label)
+
+    store = get_store()
+    if store is not None:
+        store.put(repo, dict(issue, labels=[]))
+
+    r = get_session().post(api + repo + '/issues/' + str(issue['number']) + '/labels', json=label_payload(issue),
+                           headers=headers)
+
+    if r.status_code != 200:
+        print("Editing labels failed:", str(r.status_code), '/', str(r.json()))
+    elif store is not None:
+        store.labeled(repo, issue['number'], issue['labels'])
+        if isinstance(r.json(), list):
+            store.put(repo, dict(issue, labels=r.json()))
+        if store.fingerprint(repo) not in (None, labels.fingerprint):
+            store.set_fingerprint(repo, None)
+
+    return r
+
+
+def get_session() -> Scheduler:
+    """
+
+    Get the session shared by webhook workers, create it on first use
+
+    :return: the session
+
+    The session is configured by command line arguments given to web_main. When the app is served some other way the
+    defaults are used.
+    """
+
+    global g_session
+    args = g_args or {}
+    metrics = get_metrics()
+    with g_lock:
+        if g_session is None:
+            session = new_session(args.get('pool_size', 10), args.get('http_retries', 3))
+            g_session = Scheduler(InstrumentedSession(session, metrics))
+
+    return g_session
+
+
+def get_queue() -> WorkQueue:
+    """
+
+    Get the queue of webhook jobs, create it on first use
+
+    :return: the queue
+
+    The queue is configured by command line arguments given to web_main. When the app is served some other way the
+    defaults are used.
+    """
+
+    global g_queue
+    args = g_args or {}
+    metrics = get_metrics()
+    with g_lock:
+        if g_queue is None:
+            g_queue = WorkQueue(label_issue, args.get('hook_workers', 4), args.get('queue_size', 1000), metrics,
+                                args.get('coalesce_window', 0))
+
+    return g_queue
+
+
+def get_deliveries() -> ExpiringSet:
+    """
+
+    Get the set of webhook deliveries seen recently, create it on first use
+
+    :return: ExpiringSet of X-GitHub-Delivery ids, args['dedupe_size'] of them are remembered for args['dedupe_ttl']
+             seconds
+    """
+
+    global g_deliveries
+    args = g_args or {}
+    with g_lock:
+        if g_deliveries is None:
+            g_deliveries = ExpiringSet(args.get('dedupe_size', 10000), args.get('dedupe_ttl', 3600))
+
+    return g_deliveries
+
+
+def get_match_cache() -> MatchCache:
+    """
+
+    Get the cache of matched rules used by the webhook, create it on first use
+
+    :return: the cache (see match_cache) or None if it is turned off
+
+    The cache outlives reloads of the label rules, a changed rule set just empties it.
+    """
+
+    global g_match_cache
+    with g_lock:
+        if g_match_cache is None:
+            g_match_cache = match_cache(g_args or {})
+
+    return g_match_cache
+
+
+def get_store() -> IssueStore:
+    """
+
+    Get the store of issues labeled by the webhook, open it on first use
+
+    :return: IssueStore of the database given as args['store'] to web_main or None if there is none
+    """
+
+    global g_store
+    with g_lock:
+        if g_store is None and (g_args or {}).get('store'):
+            g_store = IssueStore(g_args['store'])
+
+    return g_store
+
+
+def get_metrics() -> Metrics:
+    """
+
+    Get metrics of the web server, create them on first use
+
+    :return: the metrics, exported at /metrics
+    """
+
+    global g_metrics
+    with g_lock:
+        if g_metrics is None:
+            g_metrics = Metrics()
+
+    return g_metrics
+
+
+def load_rules(force: bool = False) -> tuple:
+    """
+
+    Get the token and compiled label rules used by the webhook, (re)load them when needed
+
+    :param force: reload even if the label file didn't change
+    :return: tuple (token, RuleSet)
+
+    Rules are compiled only once per process and kept in g_rules. On every call the modification time of the label file
+    (args['label_file'] or 'labels.cfg' when web_main wasn't used) is checked and the file is parsed again only if it
+    changed. When args contain labels but no label file the rules never change.
+    """
+
+    global g_rules
+    args = g_args or {'auth_file': 'auth.cfg', 'label_file': 'labels.cfg'}
+    label_file = args.get('label_file')
+    mtime = os.path.getmtime(label_file) if label_file and os.path.isfile(label_file) else None
+
+    with g_rules_lock:
+        if g_rules is None or force or (mtime is not None and mtime != g_rules[2]):
+            token = args['token'] if 'token' in args else parse_file(args['auth_file'])['github']['token']
+            labels = parse_file(label_file)['labels'] if mtime is not None else args['labels']
+            g_rules = (token, rule_set(labels, args, get_match_cache()), mtime)
+
+        return g_rules[:2]
+
+
+@app.route('/reload', methods=['POST'])
+def reload() -> str:
+    """
+
+    Flask hook for path '/reload'
+
+    :return: JSON with the number of loaded rules, empty body with HTTP status code 403 unless the request came from
+             the local host
+
+    Reload label rules without restarting the server, same as sending SIGHUP to the process. See load_rules. Only the
+    process which handled the request reloads its rules, with several gunicorn processes send SIGHUP to the master
+    instead (it restarts all of them). Changes of the label file are picked up by every process anyway.
+    """
+    if flask_request.remote_addr not in ('127.0.0.1', '::1'):
+        return '', 403
+
+    return jsonify({'rules': len(load_rules(force=True)[1])})
+
+
 @app.route('/hook', methods=['POST'])
-def hook() -> str:
+def hook():
     """
 
-    Process incoming issue and label it accordingly
+    Check incoming issue and queue it for labeling
 
-    :return: empty string
+    :return: empty body with HTTP status code 202 if the issue was queued, 200 if it already has labels or the delivery
+             was seen before, 400 if the payload isn't an issue and 503 if the queue is full
 
     When a POST request with '/hook' in its location is received then its body is passed to this function. It parses the
-    body as a JSON and tries to label issues in a similar manner as process_response -> search issue title and body for
-    for string matching one of configured RE and set a label configured for this RE.
+    body as a JSON and checks it looks like an issue event. The issue is then put into a queue and labeled by a
+    background worker in a similar manner as process_response (see label_issue), so that the answer is sent right away.
 
     It is meant to be used with GitHub webhooks - when the issue gets created a request is sent to this '/hook' location
     and this code labels the issue immediately. Event-driven issue labeling ;)
+
+    Deliveries whose X-GitHub-Delivery header was seen recently (see get_deliveries) are redeliveries and are ignored.
+    Events of the same issue arriving within args['coalesce_window'] seconds are labeled once (see WorkQueue.submit).
+    Both are per process, so with several server processes a duplicate may still reach another one.
     """
-    if not g_args:
-        token = parse_file('auth.cfg')['github']['token']
-        labels = parse_file('labels.cfg')['labels']
-        labels = {re.compile(r, re.IGNORECASE): v for r, v in labels.items()}
+    token, labels = load_rules()
+
+    payload = flask_request.get_json(silent=True)
+    repository = (payload.get('repository') or {}) if isinstance(payload, dict) else None
+    if not isinstance(payload, dict) or not isinstance(payload.get('issue'), dict) or \
+            not all(k in payload['issue'] for k in ('number', 'title', 'body', 'labels')) or \
+            not isinstance(repository, dict) or 'name' not in repository:
+        return '', 400
+
+    if payload['issue']['labels']:
+        return '', 200
+
+    delivery = flask_request.headers.get('X-GitHub-Delivery')
+    if delivery and not get_deliveries().add(delivery):
+        get_metrics().inc('deliveries_duplicate_total')
+        return '', 200
+
+    if g_args is None:
+        repo = 'gh_issue_agent-label-robot/' + payload['repository']['name']
     else:
-        token = g_args['token']
-        labels = {re.compile(r, re.IGNORECASE): v for r, v in g_args['labels'].items()}
+        repo = g_args['repo']
 
-    issue = flask_request.get_json()
-    api = 'https://api.github.com/repos/'
-    headers = {'Authorization': 'token ' + token, 'User-Agent': 'webhook-gh'}
+    if not get_queue().submit(payload['issue'], repo, token, labels, key=(repo, payload['issue']['number'])):
+        if delivery:
+            get_deliveries().discard(delivery)  # let GitHub deliver it again
+        return '', 503
 
-    if not issue['issue']['labels']:
-        issue['issue']['labels'] = [label for regexp, label in labels.items()
-                                    if re.search(regexp, issue['issue']['title']) or
-                                    re.search(regexp, issue['issue']['body'])]
+    return '', 202
 
-        if not issue['issue']['labels']:
-            issue['issue']['labels'] = ['take-a-look-personally']
 
-        del issue['issue']['assignee']
-        if g_args is None:
-            r = requests.patch(api + 'gh_issue_agent-label-robot/' + issue['repository']['name'] + '/issues/' +
-                               str(issue['issue']['number']), json=issue['issue'], headers=headers)
-        else:
-            r = requests.patch(api + g_args['repo'] + '/issues/' +
-                               str(issue['issue']['number']), json=issue['issue'], headers=headers)
+@app.route('/status')
+def status():
+    """
 
-        if r.status_code != 200:
-            print("Editing labels failed:", str(r.status_code), '/', str(r.json()))
+    Flask hook for path '/status'
+
+    :return: JSON describing the webhook queue (see WorkQueue.stats), connection pools (see pool_stats), the cache of
+             matched rules (see MatchCache.stats) and recently seen deliveries (see get_deliveries)
+    """
+    cache = get_match_cache()
+    deliveries = get_deliveries()
+    return jsonify({'queue': get_queue().stats(), 'pool': pool_stats(get_session()),
+                    'match_cache': cache.stats() if cache is not None else None,
+                    'deliveries': {'remembered': len(deliveries), 'duplicates': deliveries.duplicates}})
+
+
+@app.route('/metrics')
+def prometheus_metrics() -> Response:
+    """
+
+    Flask hook for path '/metrics'
+
+    :return: metrics in Prometheus text format
+
+    Besides counters and histograms collected since the start (see Metrics, InstrumentedSession and WorkQueue) the state
+    of the webhook queue, of the connection pools and of the cache of matched rules is exported as gauges, as well as
+    time spent in label rules when they are profiled (see rule_set).
+    """
+    queue = get_queue().stats()
+    pools = pool_stats(get_session())
+    gauges = {'queue_depth': [({}, queue['depth'])],
+              'queue_size': [({}, queue['size'])],
+              'queue_workers': [({}, queue['workers'])],
+              'pool_connections': [({'host': pool['host']}, pool['connections']) for pool in pools],
+              'pool_idle_connections': [({'host': pool['host']}, pool['idle']) for pool in pools]}
+
+    cache = get_match_cache()
+    if cache is not None:
+        stats = cache.stats()
+        gauges.update({'match_cache_entries': [({}, stats['entries'])],
+                       'match_cache_hits': [({}, stats['hits'])],
+                       'match_cache_misses': [({}, stats['misses'])]})
+
+    rules = load_rules()[1]
+    if rules.profiling or rules.time_budget is not None:
+        profile = [({'rule': rule['rule'], 'label': rule['label']}, rule) for rule in rules.profile()]
+        gauges.update({'rule_seconds': [(labels, rule['seconds']) for labels, rule in profile],
+                       'rule_texts': [(labels, rule['calls']) for labels, rule in profile],
+                       'rule_hits': [(labels, rule['hits']) for labels, rule in profile],
+                       'rule_disabled': [(labels, int(rule['disabled'])) for labels, rule in profile]})
+
+    return Response(get_metrics().prometheus(gauges), mimetype='text/plain; version=0.0.4')
+
+
+@app.after_request
+def count_response(response: Response) -> Response:
+    """
+
+    Count answers of the web server by route and status code ('responses_total')
+
+    :param response: the answer
+    :return: the same answer
+    """
+    rule = flask_request.url_rule.rule if flask_request.url_rule else 'unknown'
+    get_metrics().inc('responses_total', path=rule, status=response.status_code)
 
-    return ''
+    return response
 
 
 def main() -> None:
@@ -0,0 +1,157 @@
+import hashlib
+import json
+import os
+import threading
+import requests
+
+"""
+    .. moduleauthor:: Tomas Kvasnicka <kvasntom@fit.cvut.cz>
+    :synopsis: Persistent cache of GitHub API responses using conditional requests
+
+    - GitHub doesn't count '304 Not Modified' answers to conditional requests against the rate limit
+    - ETag and Last-Modified of every cached URL are sent back as If-None-Match and If-Modified-Since
+    - one JSON file per URL, least recently used files are evicted when the cache grows over its size
+"""
+
+
+class HTTPCache:
+    """
+
+    Session wrapper answering repeated GET requests from disk
+
+    :param session: session used for the actual HTTP requests (requests.Session or anything with the same API)
+    :param directory: path to directory with cached responses, created if it doesn't exist
+    :param max_size: maximal size of the cache in bytes
+
+    Every method other than get() is passed to the wrapped session untouched, so an instance of this class can be used
+    as args['session'].
+    """
+
+    HEADERS = ('content-type', 'etag', 'last-modified', 'link')
+
+    def __init__(self, session, directory: str, max_size: int = 100 * 1024 * 1024):
+        self.session = session
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(os.path.getsize(os.path.join(directory, f)) for f in os.listdir(directory))
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+    def _path(self, url: str, headers: dict) -> str:
+        """
+
+        Find the file caching given URL
+
+        :param url: requested URL
+        :param headers: HTTP request headers
+        :return: path to the cache file
+
+        The token is part of the key as different users may see different content under the same URL.
+        """
+
+        key = (headers or {}).get('Authorization', '') + ' ' + url
+        return os.path.join(self.directory, hashlib.sha256(key.encode('utf-8')).hexdigest() + '.json')
+
+    def get(self, url: str, headers: dict = None, **kwargs) -> requests.Response:
+        """
+
+        GET an URL, using the cached response if the server says it didn't change
+
+        :param url: requested URL
+        :param headers: HTTP request headers
+        :param kwargs: passed to the wrapped session
+        :return: HTTP response, either the real one or rebuilt from the cache
+
+        The cache may be shared by several threads, so the file can be evicted by another thread at any time. The entry
+        is read into memory once and the response is rebuilt from that.
+        """
+
+        path = self._path(url, headers)
+        headers = dict(headers or {})
+        entry = None
+
+        try:
+            with open(path, encoding='utf-8') as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            pass
+
+        if entry:
+            if 'etag' in entry['headers']:
+                headers['If-None-Match'] = entry['headers']['etag']
+            if 'last-modified' in entry['headers']:
+                headers['If-Modified-Since'] = entry['headers']['last-modified']
+
+        response = self.session.get(url, headers=headers, **kwargs)
+
+        if response.status_code == 304 and entry:
+            with self._lock:
+                self.hits += 1
+            try:
+                os.utime(path)
+            except FileNotFoundError:  # evicted meanwhile
+                pass
+
+            cached = requests.Response()
+            cached.status_code = 200
+            cached.url = url
+            cached.encoding = 'utf-8'
+            cached.headers = requests.structures.CaseInsensitiveDict(entry['headers'])
+            cached._content = entry['body'].encode('utf-8')
+            return cached
+
+        with self._lock:
+            self.misses += 1
+
+        if response.status_code == 200 and ('etag' in response.headers or 'last-modified' in response.headers):
+            self._store(path, {'url': url,
+                               'headers': {h: response.headers[h] for h in self.HEADERS if h in response.headers},
+                               'body': response.content.decode('utf-8')})
+
+        return response
+
+    def _store(self, path: str, entry: dict) -> None:
+        """
+
+        Save an entry to the cache and evict old entries if the cache is too big
+
+        :param path: path to the cache file
+        :param entry: URL, headers and body of the response
+        :return: None
+        """
+
+        data = json.dumps(entry).encode('utf-8')
+        tmp = path + '.' + str(threading.get_ident())
+
+        with open(tmp, 'wb') as f:
+            f.write(data)
+
+        with self._lock:
+            old = os.path.getsize(path) if os.path.isfile(path) else 0
+            os.replace(tmp, path)
+            self._size += len(data) - old
+
+            if self._size > self.max_size:
+                self._evict()
+
+    def _evict(self) -> None:
+        """
+
+        Remove least recently used entries until the cache fits into max_size
+
+        :return: None
+        """
+
+        files = [os.path.join(self.directory, f) for f in os.listdir(self.directory) if f.endswith('.json')]
+        for path in sorted(files, key=os.path.getmtime):
+            if self._size <= self.max_size:
+                break
+
+            self._size -= os.path.getsize(path)
+            os.remove(path)
@@ -0,0 +1,70 @@
+import collections
+import threading
+import time
+
+"""
+    .. moduleauthor:: Tomas Kvasnicka <kvasntom@fit.cvut.cz>
+    :synopsis: Remember keys for a limited time
+
+    - GitHub redelivers webhook events with the same X-GitHub-Delivery id, they must not be labeled twice
+    - keys expire after ttl seconds, the oldest ones are evicted when there are more than size of them
+"""
+
+
+class ExpiringSet:
+    """
+
+    Bounded set of keys which expire
+
+    :param size: maximal number of remembered keys
+    :param ttl: number of seconds a key is remembered
+
+    Keys are kept in the order they were added, so expired keys are always at the front. Safe to use from several
+    threads.
+    """
+
+    def __init__(self, size: int = 10000, ttl: float = 3600):
+        self.size = size
+        self.ttl = ttl
+        self.duplicates = 0
+        self._keys = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, key) -> bool:
+        """
+
+        Remember a key
+
+        :param key: the key
+        :return: True if the key is new, False if it was added less than ttl seconds ago
+        """
+
+        now = time.monotonic()
+        with self._lock:
+            while self._keys and next(iter(self._keys.values())) <= now - self.ttl:
+                self._keys.popitem(last=False)
+
+            if key in self._keys:
+                self.duplicates += 1
+                return False
+
+            while self._keys and len(self._keys) >= self.size:
+                self._keys.popitem(last=False)
+            self._keys[key] = now
+            return True
+
+    def discard(self, key) -> None:
+        """
+
+        Forget a key (eg. when the event it belongs to wasn't handled after all)
+
+        :param key: the key
+        :return: None
+        """
+
+        with self._lock:
+            self._keys.pop(key, None)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._keys)
@@ -0,0 +1,253 @@
+"""
+    .. moduleauthor:: Tomas Kvasnicka <kvasntom@fit.cvut.cz>
+    :synopsis: Label issues through GitHub GraphQL API (API v4)
+
+    - many addLabelsToLabelable mutations are sent in one request, each under its own alias
+    - GraphQL needs node IDs of labels -> labels of the repository are listed once per run
+    - labels which don't exist yet are created through REST API, as PATCHing an issue would do
+    - issues are read together with their first comments, REST API is used only for longer comment threads
+"""
+
+GRAPHQL = 'https://api.github.com/graphql'  # used when request doesn't say otherwise (request['graphql'])
+
+LABELS_QUERY = """
+query($owner: String!, $name: String!, $after: String) {
+  repository(owner: $owner, name: $name) {
+    labels(first: 100, after: $after) {
+      nodes { id name }
+      pageInfo { hasNextPage endCursor }
+    }
+  }
+}
+"""
+
+ISSUES_QUERY = """
+query($owner: String!, $name: String!, $after: String, $since: DateTime, $comments: Int!) {
+  repository(owner: $owner, name: $name) {
+    issues(first: 100, after: $after, states: OPEN, filterBy: {since: $since}) {
+      nodes {
+        id number title body updatedAt
+        labels(first: 100) { nodes { name } }
+        comments(first: $comments) { totalCount nodes { body } pageInfo { hasNextPage } }
+      }
+      pageInfo { hasNextPage endCursor }
+    }
+  }
+}
+"""
+
+
+class GraphQLReader:
+    """
+
+    Read issues of a repository together with their comments
+
+    :param session: session used for HTTP requests (see console_main)
+    :param request: HTTP request parameters (headers, token, etc)
+    :param repo: github username and repository
+    :param comments: number of comments read together with each issue
+    :param output: file used instead of stdout
+
+    Issues are converted to the format of REST API (see issues), so they can be processed by process_pages. If a request
+    fails the error is printed, the iteration stops and failed is set to the response.
+    """
+
+    def __init__(self, session, request: dict, repo: str, comments: int = 50, output=None):
+        self.session = session
+        self.request = request
+        self.repo = repo
+        self.comments = comments
+        self.output = output
+        self.failed = None
+
+    def issues(self, since: str = None):
+        """
+
+        Iterate over pages of open issues
+
+        :param since: ISO 8601 timestamp, only issues updated since then are read
+        :return: generator of lists of issues
+
+        Each issue contains the same keys fetch_pages uses from REST API. Comments of threads which were read whole are
+        stored in 'comment_bodies', it is None for longer threads (fetch_comments downloads those from 'comments_url').
+        """
+
+        owner, name = self.repo.split('/')
+        variables = {'owner': owner, 'name': name, 'after': None, 'since': since, 'comments': self.comments}
+
+        while True:
+            r = self.session.post(self.request.get('graphql', GRAPHQL),
+                                  json={'query': ISSUES_QUERY, 'variables': variables}, headers=self.request['headers'])
+            body = r.json() if r.status_code == 200 else {}
+            issues = ((body.get('data') or {}).get('repository') or {}).get('issues')
+
+            if issues is None:
+                print('Fetching issues for', self.repo, 'failed:', str(r.status_code), '/',
+                      str(body.get('errors', body)), file=self.output)
+                self.failed = r
+                return
+
+            yield [self._convert(issue) for issue in issues['nodes']]
+
+            if not issues['pageInfo']['hasNextPage']:
+                return
+            variables['after'] = issues['pageInfo']['endCursor']
+
+    def _convert(self, issue: dict) -> dict:
+        """
+
+        Convert a GraphQL issue to the format of REST API
+
+        :param issue: issue as returned by ISSUES_QUERY
+        :return: issue as returned by REST API (only the keys used by this package)
+        """
+
+        comments = issue['comments']
+
+        return {'number': issue['number'],
+                'node_id': issue['id'],
+                'title': issue['title'],
+                'body': issue['body'],
+                'updated_at': issue['updatedAt'],
+                'labels': [{'name': label['name']} for label in issue['labels']['nodes']],
+                'comments': comments['totalCount'],
+                'comments_url': self.request['api'] + self.repo + '/issues/' + str(issue['number']) + '/comments',
+                'comment_bodies': None if comments['pageInfo']['hasNextPage'] else
+                [comment['body'] for comment in comments['nodes']]}
+
+
+class GraphQLWriter:
+    """
+
+    Collect label changes and send them to GitHub in batches
+
+    :param session: session used for HTTP requests (see console_main)
+    :param request: HTTP request parameters (headers, token, etc)
+    :param repo: github username and repository
+    :param batch_size: number of issues labeled by one request
+    :param output: file used instead of stdout
+
+    Results have the same format as results of process_pages: tuples (success, issue number, response), where response
+    is the response to the whole batch.
+    """
+
+    def __init__(self, session, request: dict, repo: str, batch_size: int = 50, output=None):
+        self.session = session
+        self.request = request
+        self.repo = repo
+        self.batch_size = batch_size
+        self.output = output
+        self._labels = None
+        self._batch = []
+
+    def query(self, query: str, variables: dict):
+        """
+
+        Send a GraphQL query
+
+        :param query: GraphQL query or mutation
+        :param variables: values of the variables used by query
+        :return: HTTP response
+        """
+
+        return self.session.post(self.request.get('graphql', GRAPHQL), json={'query': query, 'variables': variables},
+                                 headers=self.request['headers'])
+
+    def label_ids(self, names: list) -> list:
+        """
+
+        Find node IDs of labels, create labels which don't exist yet
+
+        :param names: label names
+        :return: list of node IDs, None in place of labels which couldn't be found nor created
+        """
+
+        if self._labels is None:
+            self._labels = {}
+            owner, name = self.repo.split('/')
+            variables = {'owner': owner, 'name': name, 'after': None}
+
+            while True:
+                r = self.query(LABELS_QUERY, variables)
+                labels = (((r.json() if r.status_code == 200 else {}).get('data') or {}).get('repository') or {})
+                labels = labels.get('labels') or {'nodes': [], 'pageInfo': {}}
+                self._labels.update({label['name']: label['id'] for label in labels['nodes']})
+
+                if not labels['pageInfo'].get('hasNextPage'):
+                    break
+                variables['after'] = labels['pageInfo']['endCursor']
+
+        for name in names:
+            if name not in self._labels:
+                r = self.session.post(self.request['api'] + self.repo + '/labels', json={'name': name},
+                                      headers=self.request['headers'])
+                self._labels[name] = r.json().get('node_id') if r.status_code == 201 else None
+
+        return [self._labels[name] for name in names]
+
+    def add(self, issue: dict) -> list:
+        """
+
+        Queue labels of an issue, send the batch if it is full
+
+        :param issue: issue (as sent by GitHub REST API, including 'node_id') with new labels
+        :return: results of the sent batch or an empty list if nothing was sent
+        """
+
+        self._batch.append(issue)
+        if len(self._batch) >= self.batch_size:
+            return self.flush()
+
+        return []
+
+    def flush(self) -> list:
+        """
+
+        Send all queued labels
+
+        :return: list of tuples (success, issue number, response)
+        """
+
+        batch, self._batch = self._batch, []
+        if not batch:
+            return []
+
+        variables = {}
+        for n, issue in enumerate(batch):
+            variables['i' + str(n)] = {'labelableId': issue['node_id'], 'labelIds': self.label_ids(issue['labels'])}
+
+        ret = []
+        missing = [n for n in range(len(batch)) if None in variables['i' + str(n)]['labelIds']]
+        for n in missing:
+            print("Editing labels failed: label of issue", str(batch[n]['number']), "can't be created",
+                  file=self.output)
+            ret += [(False, batch[n]['number'], None)]
+            del variables['i' + str(n)]
+
+        if not variables:
+            return ret
+
+        mutation = 'mutation(' + ', '.join('$' + v + ': AddLabelsToLabelableInput!' for v in variables) + ') {\n' + \
+                   '\n'.join(v + ': addLabelsToLabelable(input: $' + v + ') { clientMutationId }'
+                             for v in variables) + '\n}'
+        r = self.query(mutation, variables)
+
+        body = r.json() if r.status_code == 200 else {}
+        data = body.get('data') or {}
+        failed = {e['path'][0] for e in body.get('errors', []) if e.get('path')}
+
+        for n, issue in enumerate(batch):
+            alias = 'i' + str(n)
+            if n in missing:
+                continue
+
+            if data.get(alias) is None or alias in failed:
+                print("Editing labels failed:", str(r.status_code), '/', str(issue['number']), '/',
+                      str(body.get('errors', body)), file=self.output)
+                ret += [(False, issue['number'], r)]
+            else:
+                print("Patched issue", str(issue['number']), "-", issue['title'], "with labels:",
+                      str(issue['labels']), file=self.output)
+                ret += [(True, issue['number'], r)]
+
+        return ret
@@ -0,0 +1,140 @@
+import collections
+import hashlib
+import json
+import os
+import threading
+
+"""
+    .. moduleauthor:: Tomas Kvasnicka <kvasntom@fit.cvut.cz>
+    :synopsis: Remember which label rules matched a text
+
+    - reruns and webhook redeliveries match the same titles, bodies and comments again and again
+    - texts are identified by a hash of their content, results belong to a fingerprint of the rule set
+    - a different fingerprint (eg. labels.cfg changed) empties the cache
+    - bounded, least recently used entries are evicted, optionally saved to a JSON file between runs
+"""
+
+
+class MatchCache:
+    """
+
+    LRU cache of sets of rules matching a text
+
+    :param size: maximal number of remembered texts
+    :param file: path to JSON file the cache is loaded from and saved to (see save) or None to keep it in memory only
+
+    The cache is shared by all threads using one RuleSet (see RuleSet.matching), it counts hits and misses.
+    """
+
+    def __init__(self, size: int = 10000, file: str = None):
+        self.size = size
+        self.file = file
+        self.fingerprint = None
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+        if file and os.path.isfile(file):
+            with open(file, encoding='utf-8') as f:
+                data = json.load(f)
+            self.fingerprint = data.get('fingerprint')
+            for key, indices in data.get('entries', [])[-size:]:
+                self._entries[key] = frozenset(indices)
+
+    @staticmethod
+    def key(text: str) -> str:
+        """
+
+        Hash a text
+
+        :param text: the text
+        :return: hex digest identifying the text
+        """
+
+        return hashlib.sha256(text.encode('utf-8', 'surrogatepass')).hexdigest()[:32]  # blake2b needs Python 3.6
+
+    def _bind(self, fingerprint: str) -> None:
+        if fingerprint != self.fingerprint:
+            self._entries.clear()
+            self.fingerprint = fingerprint
+
+    def get(self, fingerprint: str, key: str) -> frozenset:
+        """
+
+        Look a text up
+
+        :param fingerprint: fingerprint of the rule set asking (see RuleSet.fingerprint)
+        :param key: hash of the text (see key)
+        :return: indices of matching rules or None if the text isn't cached for this rule set
+        """
+
+        with self._lock:
+            self._bind(fingerprint)
+            indices = self._entries.get(key)
+            if indices is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+
+            return indices
+
+    def put(self, fingerprint: str, key: str, indices) -> None:
+        """
+
+        Remember rules matching a text
+
+        :param fingerprint: fingerprint of the rule set (see RuleSet.fingerprint)
+        :param key: hash of the text (see key)
+        :param indices: indices of matching rules
+        :return: None
+        """
+
+        if self.size < 1:
+            return
+
+        with self._lock:
+            self._bind(fingerprint)
+            self._entries[key] = frozenset(indices)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def save(self) -> None:
+        """
+
+        Save the cache to its file (if it has one)
+
+        :return: None
+
+        The file is written to a temporary file first and then renamed, see save_state.
+        """
+
+        if not self.file:
+            return
+
+        with self._lock:
+            data = {'fingerprint': self.fingerprint,
+                    'entries': [[key, sorted(indices)] for key, indices in self._entries.items()]}
+
+        with open(self.file + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+
+        os.replace(self.file + '.tmp', self.file)
+
+    def stats(self) -> dict:
+        """
+
+        Describe the cache
+
+        :return: dictionary with number of entries, maximal size, hits, misses and the hit rate
+        """
+
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'entries': len(self._entries),
+                    'size': self.size,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': self.hits / lookups if lookups else 0.0}
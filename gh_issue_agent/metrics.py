@@ -0,0 +1,294 @@
+import bisect
+import contextlib
+import re
+import threading
+import time
+import urllib.parse
+
+"""
+    .. moduleauthor:: Tomas Kvasnicka <kvasntom@fit.cvut.cz>
+    :synopsis: Measure where a run spends its time
+
+    - stages: fetch (waiting for pages of issues), comments (downloading comments), match (regular expressions),
+      write (sending labels to GitHub)
+    - counters and histograms of HTTP requests (by endpoint and status), pages, comments, matches and queue waits
+    - printed as a summary by console runs, exported in Prometheus text format by the web server (/metrics)
+    - thread safe, one instance is shared by all repositories and workers of a run
+"""
+
+PREFIX = 'gh_issue_agent_'
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)  # seconds
+ENDPOINTS = ((re.compile(r'^/repos/[^/]+/[^/]+'), '/repos/:repo'),
+             (re.compile(r'^/repositories/\d+'), '/repositories/:id'),
+             (re.compile(r'^/orgs/[^/]+'), '/orgs/:org'),
+             (re.compile(r'/\d+(?=/|$)'), '/:number'))
+
+
+class Stages:
+    """
+
+    Accumulated wall clock time and number of calls of each stage
+
+    Concurrent stages (eg. comments of several repositories downloaded at once) add up, so the sum over stages may be
+    longer than the whole run.
+    """
+
+    def __init__(self):
+        self.seconds = {}
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float) -> None:
+        """
+
+        Account time spent in a stage
+
+        :param stage: name of the stage
+        :param seconds: time spent
+        :return: None
+        """
+
+        with self._lock:
+            self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+            self.calls[stage] = self.calls.get(stage, 0) + 1
+
+    @contextlib.contextmanager
+    def measure(self, stage: str):
+        """
+
+        Measure the time spent inside a with block
+
+        :param stage: name of the stage
+        :return: context manager
+        """
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def summary(self) -> dict:
+        """
+
+        Describe the stages
+
+        :return: dictionary mapping names of stages to dictionaries with 'seconds' and 'calls'
+        """
+
+        with self._lock:
+            return {stage: {'seconds': round(self.seconds[stage], 6), 'calls': self.calls[stage]}
+                    for stage in self.seconds}
+
+
+class Metrics(Stages):
+    """
+
+    Stages together with counters and histograms
+
+    Metrics are identified by a name and labels (keyword arguments of inc and observe), eg.
+    inc('http_requests_total', method='GET', endpoint='/repos/:repo/issues', status=200). Time spent in every stage is
+    also observed in the histogram 'stage_seconds', so an instance of this class can be used anywhere Stages is.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.counters = {}
+        self.histograms = {}
+
+    def add(self, stage: str, seconds: float) -> None:
+        super().add(stage, seconds)
+        self.observe('stage_seconds', seconds, stage=stage)
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        """
+
+        Increase a counter
+
+        :param name: name of the counter
+        :param value: increment
+        :param labels: labels of the counter
+        :return: None
+        """
+
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        """
+
+        Add a value to a histogram
+
+        :param name: name of the histogram
+        :param value: observed value (seconds for all histograms of this package)
+        :param labels: labels of the histogram
+        :return: None
+        """
+
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {'buckets': [0] * (len(BUCKETS) + 1), 'sum': 0.0, 'count': 0,
+                                                    'max': 0.0}
+            histogram['buckets'][bisect.bisect_left(BUCKETS, value)] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+            histogram['max'] = max(histogram['max'], value)
+
+    @contextlib.contextmanager
+    def timer(self, name: str, **labels):
+        """
+
+        Observe the time spent inside a with block
+
+        :param name: name of the histogram
+        :param labels: labels of the histogram
+        :return: context manager
+        """
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def report(self) -> list:
+        """
+
+        Describe all counters and histograms in a human readable way
+
+        :return: list of lines, eg. 'http_request_seconds{endpoint=/graphql,method=POST} 3x, avg 12.0 ms, max 15.1 ms'
+        """
+
+        def name(key):
+            return key[0] + ('{' + ','.join(k + '=' + v for k, v in key[1]) + '}' if key[1] else '')
+
+        with self._lock:
+            lines = [name(key) + ' ' + ('%g' % value) for key, value in sorted(self.counters.items())]
+            lines += ['%s %dx, avg %.1f ms, max %.1f ms' % (name(key), h['count'], h['sum'] / h['count'] * 1000,
+                                                           h['max'] * 1000)
+                      for key, h in sorted(self.histograms.items())]
+
+        return lines
+
+    def prometheus(self, gauges: dict = None) -> str:
+        """
+
+        Export metrics in Prometheus text format
+
+        :param gauges: current values to export besides counters and histograms, dictionary mapping names to lists of
+                       tuples (labels, value)
+        :return: text served at /metrics
+        """
+
+        def labels(pairs, **extra):
+            pairs = list(pairs) + sorted(extra.items())
+            if not pairs:
+                return ''
+            return '{' + ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"')
+                                                .replace('\n', '\\n')) for k, v in pairs) + '}'
+
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, dict(h, buckets=list(h['buckets']))) for key, h in self.histograms.items())
+
+        for kind, metrics in (('counter', counters), ('histogram', histograms)):
+            typed = set()
+            for (name, pairs), value in metrics:
+                if name not in typed:
+                    lines.append('# TYPE ' + PREFIX + name + ' ' + kind)
+                    typed.add(name)
+
+                if kind == 'counter':
+                    lines.append(PREFIX + name + labels(pairs) + ' ' + ('%g' % value))
+                    continue
+
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ('+Inf',), value['buckets']):
+                    cumulative += count
+                    lines.append(PREFIX + name + '_bucket' + labels(pairs, le=bound) + ' ' + str(cumulative))
+                lines.append(PREFIX + name + '_sum' + labels(pairs) + ' ' + repr(value['sum']))
+                lines.append(PREFIX + name + '_count' + labels(pairs) + ' ' + str(value['count']))
+
+        for name, values in sorted((gauges or {}).items()):
+            lines.append('# TYPE ' + PREFIX + name + ' gauge')
+            lines += [PREFIX + name + labels(sorted(pairs.items())) + ' ' + ('%g' % value) for pairs, value in values]
+
+        return '\n'.join(lines) + '\n'
+
+
+def endpoint(url: str) -> str:
+    """
+
+    Turn a URL into an endpoint label
+
+    :param url: requested URL
+    :return: path of the URL with repository, organization and numbers replaced, eg. /repos/:repo/issues/:number
+    """
+
+    path = urllib.parse.urlsplit(url).path
+    for pattern, replacement in ENDPOINTS:
+        path = pattern.sub(replacement, path)
+
+    return path
+
+
+class InstrumentedSession:
+    """
+
+    Session wrapper counting requests and measuring their duration
+
+    :param session: session used for the actual HTTP requests (requests.Session or anything with the same API)
+    :param metrics: Metrics the requests are recorded to
+
+    Every request is counted in 'http_requests_total' (method, endpoint, status - 'error' if no response arrived) and
+    its duration is observed in 'http_request_seconds' (method, endpoint). Wrapped by Scheduler, retried requests are
+    counted once per attempt.
+    """
+
+    def __init__(self, session, metrics: Metrics):
+        self.session = session
+        self.metrics = metrics
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+    def get(self, url: str, **kwargs):
+        return self.request('get', url, **kwargs)
+
+    def post(self, url: str, **kwargs):
+        return self.request('post', url, **kwargs)
+
+    def patch(self, url: str, **kwargs):
+        return self.request('patch', url, **kwargs)
+
+    def put(self, url: str, **kwargs):
+        return self.request('put', url, **kwargs)
+
+    def delete(self, url: str, **kwargs):
+        return self.request('delete', url, **kwargs)
+
+    def request(self, method: str, url: str, **kwargs):
+        """
+
+        Send a request and record it
+
+        :param method: lowercase HTTP method
+        :param url: requested URL
+        :param kwargs: passed to the wrapped session
+        :return: HTTP response
+        """
+
+        labels = {'method': method.upper(), 'endpoint': endpoint(url)}
+        status = 'error'
+        start = time.perf_counter()
+        try:
+            response = getattr(self.session, method)(url, **kwargs)
+            status = response.status_code
+            return response
+        finally:
+            self.metrics.observe('http_request_seconds', time.perf_counter() - start, **labels)
+            self.metrics.inc('http_requests_total', status=status, **labels)
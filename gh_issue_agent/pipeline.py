@@ -0,0 +1,87 @@
+import queue
+import threading
+
+"""
+    .. moduleauthor:: Tomas Kvasnicka <kvasntom@fit.cvut.cz>
+    :synopsis: Run items through stages connected by bounded queues
+
+    - every stage has its own threads, so fetching, matching and writing overlap instead of taking turns
+    - queues between stages are bounded, a fast stage waits for a slow one instead of piling items up in memory
+    - the first exception stops the source, items already queued are drained and the exception is raised again
+"""
+
+_DONE = object()  # sentinel telling a thread of a stage there are no more items
+
+
+def pipeline(source, stages: list, sizes: list) -> list:
+    """
+
+    Process items by a pipeline of stages
+
+    :param source: iterable of items for the first stage, iterated by a thread of its own
+    :param stages: list of tuples (function, number of threads), function takes an item and returns a list of items for
+                   the next stage
+    :param sizes: capacities of the queues in front of each stage
+    :return: list of items returned by the last stage, in order of the source only if every stage has a single thread
+    """
+
+    queues = [queue.Queue(size) for size in sizes]
+    running = [threads for _, threads in stages]
+    results = []
+    errors = []
+    lock = threading.Lock()
+
+    def feed():
+        try:
+            for item in source:
+                if errors:
+                    break
+                queues[0].put(item)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            for _ in range(stages[0][1]):
+                queues[0].put(_DONE)
+
+    def work(n):
+        function = stages[n][0]
+        while True:
+            item = queues[n].get()
+            if item is _DONE:
+                break
+            if errors:
+                continue  # keep draining, so that nobody waits on a full queue
+
+            try:
+                items = function(item)
+            except Exception as e:
+                errors.append(e)
+                continue
+
+            if n + 1 < len(stages):
+                for item in items:
+                    queues[n + 1].put(item)
+            else:
+                with lock:
+                    results.extend(items)
+
+        with lock:
+            running[n] -= 1
+            last = running[n] == 0
+        if last and n + 1 < len(stages):
+            for _ in range(stages[n + 1][1]):
+                queues[n + 1].put(_DONE)
+
+    threads = [threading.Thread(target=feed, daemon=True)]
+    threads += [threading.Thread(target=work, args=(n,), daemon=True)
+                for n, (_, count) in enumerate(stages) for _ in range(count)]
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0]
+
+    return results
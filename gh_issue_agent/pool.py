@@ -0,0 +1,73 @@
+import multiprocessing
+from .rules import RuleSet
+
+"""
+    .. moduleauthor:: Tomas Kvasnicka <kvasntom@fit.cvut.cz>
+    :synopsis: Match label rules in a pool of processes
+
+    - regular expressions hold the GIL, threads can't match texts of more issues at once
+    - every worker process compiles the rule set once, issues are sent to it in batches
+    - results come back in the order of the issues and are the same as those of RuleSet.match_issue
+"""
+
+_rules = None  # rule set of the worker process
+
+
+def _init(labels: dict, options: dict) -> None:
+    global _rules
+    _rules = RuleSet(labels, **options)
+
+
+def _match_batch(batch: list) -> list:
+    return [_rules.match_issue(*issue) for issue in batch]
+
+
+def _match_thread_batch(batch: list) -> list:
+    return [_rules.match_thread(*issue) for issue in batch]
+
+
+class MatchPool:
+    """
+
+    Pool of processes labeling issues
+
+    :param labels: regular expressions and labels corresponding with these expressions (the [labels] section)
+    :param processes: number of worker processes, None for the number of CPUs
+    :param batch_size: number of issues sent to a worker at once
+    :param options: passed to RuleSet in every worker (eg. time_budget, max_length)
+
+    Workers are started by 'spawn', so it is safe to create the pool while other threads of the process are running.
+    Profiling and MatchCache of the parent process don't apply to the workers. multiprocessing.Pool is used rather
+    than ProcessPoolExecutor, whose mp_context and initializer need Python 3.7.
+    """
+
+    def __init__(self, labels: dict, processes: int = None, batch_size: int = 20, **options):
+        self.batch_size = batch_size
+        self._pool = multiprocessing.get_context('spawn').Pool(processes, _init, (dict(labels), options))
+
+    def match(self, issues: list, threads: bool = False) -> list:
+        """
+
+        Label issues
+
+        :param issues: list of tuples (title, body, list of comments[, labels of comments scanned before])
+        :param threads: return the labels matched by the comments too (see RuleSet.match_thread)
+        :return: list of lists of labels, in the same order as issues (see RuleSet.match_issue), list of tuples (labels,
+                 labels of comments) if threads
+        """
+
+        batches = [issues[i:i + self.batch_size] for i in range(0, len(issues), self.batch_size)]
+        match_batch = _match_thread_batch if threads else _match_batch
+
+        return [labels for batch in self._pool.map(match_batch, batches) for labels in batch]
+
+    def close(self) -> None:
+        """
+
+        Stop the worker processes
+
+        :return: None
+        """
+
+        self._pool.close()
+        self._pool.join()
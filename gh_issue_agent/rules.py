@@ -0,0 +1,442 @@
+import hashlib
+import json
+import re
+import threading
+import time
+
+try:
+    from re import _parser as sre_parse  # Python 3.11+
+except ImportError:
+    import sre_parse
+
+"""
+    .. moduleauthor:: Tomas Kvasnicka <kvasntom@fit.cvut.cz>
+    :synopsis: Compile user-defined label rules into a single matcher
+
+    - all rules from the [labels] section are merged into one alternation of named groups
+    - every text is scanned once for all rules instead of once per rule
+    - rules that can't be safely merged (backreferences, conditionals) are matched on their own
+    - literals every match of a rule must contain are found when the rules are compiled, texts which don't contain them
+      skip the rule without running the regular expression, rules which are just a literal (eg. .*bug.*) never run it
+    - profiling mode matches every rule on its own and records its time and hits, slow rules are flagged
+    - optional budgets: texts are cut to a maximal length, a rule whose single match took too long is disabled
+    - results can be remembered in a MatchCache, so that a text seen before isn't matched again
+"""
+
+SLOW = 100  # nanoseconds per character of input, rules slower than that on average are flagged by profile()
+OVERHEAD = 2000  # nanoseconds per matched text allowed for the call itself, so that short texts don't look slow
+
+# backreferences, conditionals and named groups depend on group numbering/names, global inline flags (eg. (?s)) would
+# apply to all merged rules before Python 3.11 -> such rules can't be merged
+_UNMERGEABLE = re.compile(r'\\[1-9]|\(\?P[<=]|\(\?\(|\(\?[aiLmsux]+\)')
+
+_REPEATS = {sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT, getattr(sre_parse, 'POSSESSIVE_REPEAT', None)} - {None}
+_ATOMIC_GROUP = getattr(sre_parse, 'ATOMIC_GROUP', object())  # Python 3.11+, mustn't be None like the end of _literals
+_CACHE_SIZE = 256  # number of alternations of surviving rules kept compiled
+
+
+def _literals(sequence) -> frozenset:
+    """
+
+    Find literals one of which is contained in every match of a parsed regular expression
+
+    :param sequence: parsed regular expression (list of tuples (opcode, argument), see sre_parse)
+    :return: frozenset of lowercase ASCII strings or None if no such literals were found
+
+    Runs of literal characters, groups, repeats matching at least once and alternations whose every branch has its
+    literals are considered, the set whose shortest literal is the longest wins.
+    """
+
+    candidates = []
+    run = ''
+
+    for op, arg in list(sequence) + [(None, None)]:
+        if op is sre_parse.LITERAL and arg < 128:
+            run += chr(arg).lower()
+            continue
+
+        if run:
+            candidates.append(frozenset([run]))
+            run = ''
+
+        if op is sre_parse.SUBPATTERN:
+            candidate = _literals(arg[-1])
+        elif op is _ATOMIC_GROUP:
+            candidate = _literals(arg)
+        elif op in _REPEATS and arg[0] >= 1:
+            candidate = _literals(arg[2])
+        elif op is sre_parse.BRANCH:
+            branches = [_literals(branch) for branch in arg[1]]
+            candidate = frozenset().union(*branches) if all(branches) else None
+        else:
+            candidate = None
+
+        if candidate:
+            candidates.append(candidate)
+
+    return max(candidates, key=lambda c: min(len(literal) for literal in c), default=None)
+
+
+def _exact(sequence) -> str:
+    """
+
+    Check whether a parsed regular expression is found exactly where a literal is
+
+    :param sequence: parsed regular expression (list of tuples (opcode, argument), see sre_parse)
+    :return: the literal or None if the expression is anything more than an ASCII literal surrounded by repeats which
+             may match nothing (like .*)
+
+    Such expression is found by re.search() if and only if the literal is contained in the text.
+    """
+
+    items = list(sequence)
+    while items and items[0][0] in _REPEATS and items[0][1][0] == 0:
+        items.pop(0)
+    while items and items[-1][0] in _REPEATS and items[-1][1][0] == 0:
+        items.pop()
+
+    if items and all(op is sre_parse.LITERAL and arg < 128 for op, arg in items):
+        return ''.join(chr(arg) for _, arg in items)
+
+    return None
+
+
+class RuleSet:
+    """
+
+    Compiled set of label rules
+
+    :param labels: regular expressions and labels corresponding with these expressions (the [labels] section)
+    :param flags: flags used to compile every regular expression
+    :param profile: match rules one by one and record time spent in each of them (see profile)
+    :param time_budget: maximal number of seconds a single match of a rule may take, None for no limit
+    :param max_length: texts longer than this are cut before matching, None for no limit
+    :param cache: MatchCache remembering rules matched by each text or None
+
+    Each rule is wrapped in a named group and all of them are joined into one alternation. Matching a text runs
+    finditer() over the alternation and collects the names of the groups that matched. Alternation reports only one
+    rule per position, so rules hidden behind an earlier match are found by scanning again for the rules not matched
+    yet. A text which matches no rule is thus scanned exactly once and a text matching k rules at most k + 1 times.
+
+    Before that the rules are pruned: every rule has a set of literals (see literals) one of which must be contained in
+    any text it matches. An ASCII text is lowercased and searched for all the literals by str.find, rules whose literals
+    are missing are left out of the alternation. Rules which are just a literal are decided by the literal alone. Texts
+    with other than ASCII characters skip the pruning, as case insensitive matching of Unicode text has exceptions
+    (eg. 'ſ' matches 's') str.lower doesn't know about.
+
+    A running match can't be interrupted, so time_budget can't stop the match which exceeds it. It keeps the rule from
+    stalling the following texts instead: the rule is disabled (see disabled) and never matched again. Both profiling
+    and time_budget need to know which rule the time is spent in, so they turn the merging off.
+
+    Results in cache belong to fingerprint, a hash of everything which affects them (rules, flags, max_length and
+    disabled rules). Profiling bypasses the cache, so that every text is measured.
+    """
+
+    def __init__(self, labels: dict, flags: int = re.IGNORECASE, profile: bool = False, time_budget: float = None,
+                 max_length: int = None, cache=None):
+        self.flags = flags
+        self.rules = [(pattern, label, re.compile(pattern, flags)) for pattern, label in labels.items()]
+        self.profiling = profile
+        self.time_budget = time_budget
+        self.max_length = max_length
+        self.cache = cache
+        self.disabled = set()
+        self.stats = [{'calls': 0, 'hits': 0, 'seconds': 0.0, 'chars': 0, 'worst': 0.0} for _ in self.rules]
+        self._lock = threading.Lock()
+        self._merged = []
+        self._single = []
+        self._combined = {}
+        self.literals = []
+        self._exact = {}
+        self._unfiltered = set()
+        self._by_literal = {}
+
+        for index, (pattern, _, regexp) in enumerate(self.rules):
+            try:
+                parsed = sre_parse.parse(pattern, flags)
+            except Exception:  # the parser is private to re, never let it break matching
+                parsed = []
+
+            self.literals.append(_literals(parsed))
+            if self.literals[index] is None:
+                self._unfiltered.add(index)
+            for literal in self.literals[index] or ():
+                self._by_literal.setdefault(literal, []).append(index)
+
+            exact = _exact(parsed)
+            if exact is not None:
+                self._exact[index] = exact if not regexp.flags & re.IGNORECASE else None
+
+            if _UNMERGEABLE.search(pattern):
+                self._single.append(index)
+                continue
+
+            try:
+                re.compile('(?P<_r%d>%s)' % (index, pattern), flags)
+            except re.error:  # eg. global inline flags not at the start of the expression
+                self._single.append(index)
+            else:
+                self._merged.append(index)
+
+        self._fingerprint = hashlib.sha256(json.dumps([flags, max_length, [list(rule[:2]) for rule in self.rules]])
+                                           .encode('utf-8')).hexdigest()
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+    @property
+    def fingerprint(self) -> str:
+        """
+
+        Identify the results of this rule set
+
+        :return: hex digest, the same for rule sets which label every text the same way
+        """
+
+        if not self.disabled:
+            return self._fingerprint
+
+        return hashlib.sha256((self._fingerprint + repr(sorted(self.disabled))).encode('utf-8')).hexdigest()
+
+    def _compile(self, indices: tuple):
+        """
+
+        Build (and cache) the alternation of given rules
+
+        :param indices: indices of rules to merge
+        :return: compiled regular expression
+        """
+
+        regexp = self._combined.get(indices)
+        if regexp is None:
+            if len(self._combined) >= _CACHE_SIZE:
+                self._combined.clear()
+            regexp = re.compile('|'.join('(?P<_r%d>%s)' % (i, self.rules[i][0]) for i in indices), self.flags)
+            self._combined[indices] = regexp
+
+        return regexp
+
+    def _prune(self, text: str) -> tuple:
+        """
+
+        Decide which rules may match a text by looking for their literals
+
+        :param text: text to search
+        :return: tuple (indices of rules which match, indices of rules which need to be matched by their regular
+                 expression) or (empty set, None) when the text can't be pruned and every rule has to be matched
+        """
+
+        try:
+            text.encode('ascii')  # str.isascii needs Python 3.7
+        except UnicodeEncodeError:
+            return set(), None
+
+        lowered = text.lower()
+        found = set()
+        survivors = set(self._unfiltered)
+
+        for literal, indices in self._by_literal.items():
+            if literal not in lowered:
+                continue
+
+            for index in indices:
+                if index not in self._exact:
+                    survivors.add(index)
+                elif self._exact[index] is None or self._exact[index] in text:  # None = case insensitive
+                    found.add(index)
+
+        return found, survivors - found
+
+    def matching(self, text: str) -> set:
+        """
+
+        Find all rules matching a text
+
+        :param text: text to search
+        :return: set of indices of rules which re.search() would find in text
+        """
+
+        found = set()
+        if text is None:  # GH sends null body for issues created without description
+            return found
+
+        if self.max_length is not None:
+            text = text[:self.max_length]
+
+        if self.cache is not None and not self.profiling:
+            fingerprint, key = self.fingerprint, self.cache.key(text)
+            cached = self.cache.get(fingerprint, key)
+            if cached is not None:
+                return set(cached)
+
+            found = self._matching(text)
+            self.cache.put(fingerprint, key, found)
+            return found
+
+        return self._matching(text)
+
+    def _matching(self, text: str) -> set:
+        """
+
+        Find all rules matching a text, see matching
+
+        :param text: text to search (not None, already cut to max_length)
+        :return: set of indices of matching rules
+        """
+
+        if self.profiling or self.time_budget is not None:
+            return self._timed(text)
+
+        found, survivors = self._prune(text)
+        if survivors is None:
+            remaining = tuple(self._merged)
+            single = self._single
+        else:
+            remaining = tuple(i for i in self._merged if i in survivors)
+            single = [i for i in self._single if i in survivors]
+
+        while remaining:
+            new = {int(m.lastgroup[2:]) for m in self._compile(remaining).finditer(text)}
+            if not new:
+                break
+
+            found |= new
+            remaining = tuple(i for i in remaining if i not in found)
+
+        found.update(i for i in single if self.rules[i][2].search(text))
+
+        return found
+
+    def _timed(self, text: str) -> set:
+        """
+
+        Find all rules matching a text one rule at a time, measure each of them
+
+        :param text: text to search
+        :return: set of indices of matching rules
+
+        Unless profiling, the rules are pruned first (see _prune), only the surviving ones are matched and measured.
+        """
+
+        found, survivors = set(), None
+        if not self.profiling:
+            found, survivors = self._prune(text)
+
+        for index, (_, _, regexp) in enumerate(self.rules):
+            if index in self.disabled or (survivors is not None and index not in survivors):
+                continue
+
+            start = time.perf_counter()
+            hit = regexp.search(text) is not None
+            seconds = time.perf_counter() - start
+
+            if hit:
+                found.add(index)
+
+            with self._lock:
+                stats = self.stats[index]
+                stats['calls'] += 1
+                stats['hits'] += hit
+                stats['seconds'] += seconds
+                stats['chars'] += len(text)
+                stats['worst'] = max(stats['worst'], seconds)
+
+                if self.time_budget is not None and seconds > self.time_budget:
+                    self.disabled.add(index)
+
+        return found
+
+    def profile(self, slow: float = SLOW) -> list:
+        """
+
+        Describe time spent in each rule
+
+        :param slow: rules taking more nanoseconds per character of input than this (besides OVERHEAD for each text)
+                     are flagged as slow
+        :return: list of dictionaries, one for each rule in the order of the label file, with the rule, its label,
+                 number of matched texts (calls), texts it was found in (hits), total and worst time of a match in
+                 seconds, number of scanned characters, nanoseconds per character, and flags 'slow' and 'disabled'
+
+        Statistics are collected only in profiling mode or with time_budget set.
+        """
+
+        ret = []
+        with self._lock:
+            for index, (pattern, label, _) in enumerate(self.rules):
+                stats = self.stats[index]
+                per_char = stats['seconds'] * 1e9 / stats['chars'] if stats['chars'] else 0.0
+                ret.append({'rule': pattern,
+                            'label': label,
+                            'calls': stats['calls'],
+                            'hits': stats['hits'],
+                            'seconds': round(stats['seconds'], 6),
+                            'worst': round(stats['worst'], 6),
+                            'chars': stats['chars'],
+                            'ns_per_char': round(per_char, 1),
+                            'slow': stats['seconds'] * 1e9 > stats['calls'] * OVERHEAD + stats['chars'] * slow,
+                            'disabled': index in self.disabled})
+
+        return ret
+
+    def match_issue(self, title: str, body: str, comments: list = (), known: list = ()) -> list:
+        """
+
+        Label an issue
+
+        :param title: title of the issue (None is skipped)
+        :param body: body of the issue (None is skipped)
+        :param comments: texts of its comments
+        :param known: labels matched by comments scanned before (eg. by an earlier run), treated as if they matched
+                      comments
+        :return: labels matching the title or the body followed by the labels matching only the comments
+        """
+
+        labels = self.match(title, body)
+        found = self.match(*comments) if comments else []
+        if known:
+            order = {}
+            for _, label, _ in self.rules:
+                order.setdefault(label, len(order))
+            found = sorted(set(found) | set(known), key=lambda label: order.get(label, len(order)))
+        labels += [label for label in found if label not in labels]
+
+        return labels
+
+    def match_thread(self, title: str, body: str, comments: list = (), known: list = ()) -> tuple:
+        """
+
+        Label an issue, keep the labels matched by its comments apart
+
+        :param title: title of the issue (None is skipped)
+        :param body: body of the issue (None is skipped)
+        :param comments: texts of its comments
+        :param known: labels matched by comments scanned before
+        :return: tuple (labels of the issue as returned by match_issue, labels matched by comments and known)
+        """
+
+        thread = self.match_issue(None, None, comments, known)
+
+        return self.match_issue(title, body, (), thread), thread
+
+    def match(self, *texts: str) -> list:
+        """
+
+        Label texts
+
+        :param texts: texts to search (None is skipped)
+        :return: list of labels whose rule matches at least one of texts, in the order of the label file
+
+        Equivalent to [label for regexp, label in labels.items() if any(re.search(regexp, t) for t in texts)] without
+        the duplicate labels.
+        """
+
+        found = set()
+        for text in texts:
+            found |= self.matching(text)
+
+        ret = []
+        for index in sorted(found):
+            if self.rules[index][1] not in ret:
+                ret.append(self.rules[index][1])
+
+        return ret
@@ -0,0 +1,180 @@
+import random
+import threading
+import time
+
+"""
+    .. moduleauthor:: Tomas Kvasnicka <kvasntom@fit.cvut.cz>
+    :synopsis: Send GitHub API requests as fast as the rate limit allows, but not faster
+
+    - token bucket holding X-RateLimit-Remaining tokens, refilled by GitHub at X-RateLimit-Reset
+    - waits out 'Retry-After' and exhausted rate limits instead of failing
+    - retries 429 and 5xx answers with exponential backoff and full jitter
+    - keeps a minimal interval between writes (GitHub asks for at least a second between mutating requests)
+"""
+
+WRITES = ('post', 'patch', 'put', 'delete')
+
+
+class Scheduler:
+    """
+
+    Session wrapper pacing requests according to GitHub rate limits
+
+    :param session: session used for the actual HTTP requests (requests.Session or anything with the same API)
+    :param write_interval: minimal number of seconds between two writes (POST, PATCH, PUT, DELETE)
+    :param max_retries: how many times a throttled or failed request is repeated
+    :param backoff: base of the exponential backoff in seconds
+    :param max_backoff: maximal backoff in seconds
+
+    Until the first response arrives the number of remaining requests is unknown and requests are not delayed at all.
+    Once the bucket is empty every request waits for the reset, the first response after it fills the bucket again.
+    Every method of the
+    wrapped session other than get/post/patch/put/delete is passed to it untouched, so an instance of this class can be
+    used as args['session'].
+    """
+
+    def __init__(self, session, write_interval: float = 0, max_retries: int = 5, backoff: float = 1,
+                 max_backoff: float = 60):
+        self.session = session
+        self.write_interval = write_interval
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retries = 0
+        self.waited = 0.0
+        self._tokens = None
+        self._reset = 0.0
+        self._next_write = 0.0
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+    def get(self, url: str, **kwargs):
+        return self.request('get', url, **kwargs)
+
+    def post(self, url: str, **kwargs):
+        return self.request('post', url, **kwargs)
+
+    def patch(self, url: str, **kwargs):
+        return self.request('patch', url, **kwargs)
+
+    def put(self, url: str, **kwargs):
+        return self.request('put', url, **kwargs)
+
+    def delete(self, url: str, **kwargs):
+        return self.request('delete', url, **kwargs)
+
+    def request(self, method: str, url: str, **kwargs):
+        """
+
+        Send a request when the rate limit allows it, repeat it if it gets throttled
+
+        :param method: lowercase HTTP method
+        :param url: requested URL
+        :param kwargs: passed to the wrapped session
+        :return: HTTP response, the last one if all retries failed
+        """
+
+        # GraphQL queries are POSTed but they are reads, only mutations count as writes
+        write = method in WRITES and not (url.endswith('/graphql') and
+                                          not kwargs.get('json', {}).get('query', '').lstrip().startswith('mutation'))
+
+        for attempt in range(self.max_retries + 1):
+            self._sleep(self._acquire(write))
+            response = getattr(self.session, method)(url, **kwargs)
+            self._update(response)
+
+            delay = self._delay(response, attempt)
+            if delay is None or attempt == self.max_retries:
+                return response
+
+            with self._lock:
+                self.retries += 1
+            self._sleep(delay)
+
+    def _sleep(self, seconds: float) -> None:
+        if seconds > 0:
+            with self._lock:
+                self.waited += seconds
+            time.sleep(seconds)
+
+    def _acquire(self, write: bool) -> float:
+        """
+
+        Take a token from the bucket
+
+        :param write: whether the request is a write
+        :return: number of seconds to wait before sending the request
+
+        Writes are additionally spaced write_interval seconds apart, concurrent writers queue up behind each other.
+        """
+
+        with self._lock:
+            now = time.time()
+            wait = 0.0
+
+            if self._tokens is not None:
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                elif now < self._reset:
+                    wait = self._reset - now
+                else:
+                    self._tokens = None  # GitHub has refilled the bucket, next response tells us how much
+
+            if write:
+                wait = max(wait, self._next_write - now)
+                self._next_write = now + wait + self.write_interval
+
+            return wait
+
+    def _update(self, response) -> None:
+        """
+
+        Fill the bucket according to rate limit headers
+
+        :param response: HTTP response
+        :return: None
+
+        Responses to concurrent requests may arrive out of order, the lower number of remaining requests wins within
+        one rate limit window.
+        """
+
+        headers = response.headers
+        if 'x-ratelimit-remaining' not in headers or 'x-ratelimit-reset' not in headers:
+            return
+
+        remaining = int(headers['x-ratelimit-remaining'])
+        reset = int(headers['x-ratelimit-reset'])
+
+        with self._lock:
+            if self._tokens is None or reset != self._reset:
+                self._tokens = remaining
+            else:
+                self._tokens = min(self._tokens, remaining)
+            self._reset = reset
+
+    def _delay(self, response, attempt: int) -> float:
+        """
+
+        Decide whether and when to repeat a request
+
+        :param response: HTTP response
+        :param attempt: number of attempts made so far minus one
+        :return: number of seconds to wait before repeating the request or None if it shouldn't be repeated
+        """
+
+        status = response.status_code
+        if status in (403, 429):
+            if 'retry-after' in response.headers:
+                return int(response.headers['retry-after'])
+
+            if response.headers.get('x-ratelimit-remaining') == '0' and 'x-ratelimit-reset' in response.headers:
+                return max(int(response.headers['x-ratelimit-reset']) - time.time(), 0) + 1
+
+            if status == 403 and 'rate limit' not in getattr(response, 'text', ''):
+                return None  # genuine permission problem
+        elif status < 500:
+            return None
+
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
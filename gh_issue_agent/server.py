@@ -0,0 +1,66 @@
+"""
+    .. moduleauthor:: Tomas Kvasnicka <kvasntom@fit.cvut.cz>
+    :synopsis: Serve the Flask app by a production WSGI server
+
+    - gunicorn: several worker processes, each of them with several threads (POSIX only)
+    - waitress: one process with several threads, pure python
+    - both are optional dependencies, see extras_require in setup.py
+"""
+
+
+def run_gunicorn(app, host: str, port: int, processes: int, threads: int, shutdown_timeout: int, on_exit) -> None:
+    """
+
+    Serve app by gunicorn
+
+    :param app: WSGI application
+    :param host: address to bind to
+    :param port: port to bind to
+    :param processes: number of worker processes
+    :param threads: number of threads in each worker process
+    :param shutdown_timeout: number of seconds workers get to finish their work after SIGTERM
+    :param on_exit: function called in a worker process before it exits
+    :return: None when gunicorn stops
+
+    The app is loaded in the master process and the workers are forked from it, so anything started lazily (threads,
+    connection pools) is created separately in every worker.
+    """
+
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        raise ImportError("Serving by gunicorn requires it to be installed: pip install gh_issue_agent[gunicorn]")
+
+    class Application(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', host + ':' + str(port))
+            self.cfg.set('workers', processes)
+            self.cfg.set('threads', threads)
+            self.cfg.set('worker_class', 'gthread')
+            self.cfg.set('graceful_timeout', shutdown_timeout)
+            self.cfg.set('worker_exit', lambda server, worker: on_exit())
+
+        def load(self):
+            return app
+
+    Application().run()
+
+
+def run_waitress(app, host: str, port: int, threads: int) -> None:
+    """
+
+    Serve app by waitress
+
+    :param app: WSGI application
+    :param host: address to bind to
+    :param port: port to bind to
+    :param threads: number of threads handling requests
+    :return: None when waitress stops
+    """
+
+    try:
+        import waitress
+    except ImportError:
+        raise ImportError("Serving by waitress requires it to be installed: pip install gh_issue_agent[waitress]")
+
+    waitress.serve(app, host=host, port=port, threads=threads)
@@ -0,0 +1,116 @@
+import json
+import os
+import threading
+
+"""
+    .. moduleauthor:: Tomas Kvasnicka <kvasntom@fit.cvut.cz>
+    :synopsis: Persist information about previous runs in a local JSON file
+
+    - the file maps repository names to whatever the agent needs to remember about them
+    - the newest 'updated_at' of processed issues (the watermark) used for incremental runs
+    - the comment index: number of comments, 'updated_at' and labels of comments of each issue scanned so far
+"""
+
+_lock = threading.Lock()
+
+
+def load_state(file: str) -> dict:
+    """
+
+    Load state file
+
+    :param file: path to the state file
+    :return: content of the file or an empty dict if it doesn't exist yet
+    """
+
+    if not os.path.isfile(file):
+        return {}
+
+    with open(file, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_state(file: str, state: dict) -> None:
+    """
+
+    Save state file
+
+    :param file: path to the state file
+    :param state: content to save
+    :return: None
+
+    The file is written to a temporary file first and then renamed, so an interrupted run never leaves a corrupted state
+    file behind.
+    """
+
+    with open(file + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+
+    os.replace(file + '.tmp', file)
+
+
+def get_watermark(file: str, repo: str) -> str:
+    """
+
+    Find the newest 'updated_at' processed during previous runs
+
+    :param file: path to the state file
+    :param repo: github username and repository
+    :return: ISO 8601 timestamp or None if the repository hasn't been processed yet
+    """
+
+    return load_state(file).get(repo, {}).get('updated_at')
+
+
+def set_watermark(file: str, repo: str, updated_at: str) -> None:
+    """
+
+    Remember the newest 'updated_at' processed during this run
+
+    :param file: path to the state file
+    :param repo: github username and repository
+    :param updated_at: ISO 8601 timestamp
+    :return: None
+    """
+
+    with _lock:
+        state = load_state(file)
+        state.setdefault(repo, {})['updated_at'] = updated_at
+        save_state(file, state)
+
+
+def get_comment_index(file: str, repo: str, fingerprint: str) -> dict:
+    """
+
+    Load comment threads scanned during previous runs
+
+    :param file: path to the state file
+    :param repo: github username and repository
+    :param fingerprint: fingerprint of the label rules (see RuleSet.fingerprint)
+    :return: dict mapping issue numbers (strings) to dicts with the number of comments, 'updated_at' of the issue and
+             labels matched by the comments, empty if the rules have changed since the index was saved
+    """
+
+    state = load_state(file).get(repo, {})
+    if state.get('comment_rules') != fingerprint:
+        return {}
+
+    return state.get('comment_index', {})
+
+
+def set_comment_index(file: str, repo: str, fingerprint: str, index: dict) -> None:
+    """
+
+    Remember comment threads scanned during this run
+
+    :param file: path to the state file
+    :param repo: github username and repository
+    :param fingerprint: fingerprint of the label rules the labels were matched by
+    :param index: see get_comment_index
+    :return: None
+    """
+
+    with _lock:
+        state = load_state(file)
+        state.setdefault(repo, {}).update(comment_rules=fingerprint, comment_index=dict(index))
+        save_state(file, state)
@@ -0,0 +1,188 @@
+import json
+import sqlite3
+import threading
+
+"""
+    .. moduleauthor:: Tomas Kvasnicka <kvasntom@fit.cvut.cz>
+    :synopsis: Keep issues, their comments and labels in a local SQLite database
+
+    - filled by console runs and the webhook, a changed label file is then applied without downloading anything
+    - 'labels' are the labels an issue had when it was last seen or written, 'agent_labels' those the agent wrote
+    - an issue whose labels differ from what the agent wrote was labeled by somebody else and is left alone
+    - the fingerprint of the rules the stored labels were computed by is kept for each repository
+"""
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS issues (
+    repo TEXT NOT NULL,
+    number INTEGER NOT NULL,
+    node_id TEXT,
+    title TEXT,
+    body TEXT,
+    updated_at TEXT,
+    comments TEXT NOT NULL DEFAULT '[]',
+    labels TEXT NOT NULL DEFAULT '[]',
+    agent_labels TEXT,
+    PRIMARY KEY (repo, number)
+);
+CREATE TABLE IF NOT EXISTS repos (
+    repo TEXT PRIMARY KEY,
+    fingerprint TEXT
+);
+'''
+
+
+def _names(labels: list) -> str:
+    return json.dumps(sorted(label['name'] if isinstance(label, dict) else label for label in labels))
+
+
+class IssueStore:
+    """
+
+    Local copy of labeled repositories
+
+    :param file: path to the SQLite database, created if it doesn't exist
+
+    One connection is shared by all threads of the process, statements are serialized by a lock. Every method commits
+    its own transaction. (repo, number) in store tells whether an issue is stored.
+    """
+
+    def __init__(self, file: str):
+        self.file = file
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(file, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.executescript(_SCHEMA)
+
+    def put(self, repo: str, issue: dict, comments: list = None, append: bool = False) -> None:
+        """
+
+        Store an issue as sent by GitHub
+
+        :param repo: github username and repository
+        :param issue: the issue, its 'labels' may be names or objects with 'name'
+        :param comments: texts of its comments or None to keep the stored ones
+        :param append: comments are new ones only (see fetch_comments), add them to the stored ones
+        :return: None
+        """
+
+        row = (issue.get('node_id'), issue.get('title'), issue.get('body'), issue.get('updated_at'),
+               _names(issue.get('labels') or []), repo, issue['number'])
+
+        with self._lock, self._db:
+            stored = self._db.execute('SELECT comments FROM issues WHERE repo = ? AND number = ?',
+                                      (repo, issue['number'])).fetchone()
+            if stored is None:
+                self._db.execute('INSERT INTO issues (node_id, title, body, updated_at, labels, repo, number) '
+                                 'VALUES (?, ?, ?, ?, ?, ?, ?)', row)
+            else:
+                self._db.execute('UPDATE issues SET node_id = ?, title = ?, body = ?, updated_at = ?, labels = ? '
+                                 'WHERE repo = ? AND number = ?', row)
+
+            if comments is not None:
+                if append and stored is not None:
+                    comments = json.loads(stored[0]) + list(comments)
+                self._db.execute('UPDATE issues SET comments = ? WHERE repo = ? AND number = ?',
+                                 (json.dumps(list(comments)), repo, issue['number']))
+
+    def __contains__(self, key: tuple) -> bool:
+        with self._lock:
+            return self._db.execute('SELECT 1 FROM issues WHERE repo = ? AND number = ?', key).fetchone() is not None
+
+    def labeled(self, repo: str, number: int, labels: list) -> None:
+        """
+
+        Remember labels written by the agent
+
+        :param repo: github username and repository
+        :param number: number of the issue
+        :param labels: the labels
+        :return: None
+        """
+
+        with self._lock, self._db:
+            self._db.execute('UPDATE issues SET labels = ?, agent_labels = ? WHERE repo = ? AND number = ?',
+                             (_names(labels), _names(labels), repo, number))
+
+    def issues(self, repo: str) -> list:
+        """
+
+        List issues labeled by the agent
+
+        :param repo: github username and repository
+        :return: list of tuples (issue, list of comments), the issue has 'number', 'node_id', 'title', 'body',
+                 'updated_at' and 'labels' (the labels the agent wrote, sorted), issues labeled by somebody else since
+                 are left out
+        """
+
+        with self._lock:
+            rows = self._db.execute('SELECT number, node_id, title, body, updated_at, comments, agent_labels '
+                                    'FROM issues WHERE repo = ? AND agent_labels = labels ORDER BY number',
+                                    (repo,)).fetchall()
+
+        return [({'number': number, 'node_id': node_id, 'title': title, 'body': body, 'updated_at': updated_at,
+                  'labels': json.loads(labels)}, json.loads(comments))
+                for number, node_id, title, body, updated_at, comments, labels in rows]
+
+    def repos(self) -> list:
+        """
+
+        List stored repositories
+
+        :return: sorted list of github usernames and repositories
+        """
+
+        with self._lock:
+            return [row[0] for row in self._db.execute('SELECT DISTINCT repo FROM issues ORDER BY repo')]
+
+    def fingerprint(self, repo: str) -> str:
+        """
+
+        Find the fingerprint of the rules the stored labels were computed by
+
+        :param repo: github username and repository
+        :return: see RuleSet.fingerprint, None if unknown
+        """
+
+        with self._lock:
+            row = self._db.execute('SELECT fingerprint FROM repos WHERE repo = ?', (repo,)).fetchone()
+
+        return row[0] if row else None
+
+    def set_fingerprint(self, repo: str, fingerprint: str) -> None:
+        """
+
+        Remember the fingerprint of the rules the stored labels were computed by
+
+        :param repo: github username and repository
+        :param fingerprint: see RuleSet.fingerprint
+        :return: None
+        """
+
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO repos (repo, fingerprint) VALUES (?, ?)', (repo, fingerprint))
+
+    def stats(self) -> dict:
+        """
+
+        Describe the store
+
+        :return: dictionary with numbers of repositories, issues and issues labeled by the agent
+        """
+
+        with self._lock:
+            repos, issues, labeled = self._db.execute('SELECT COUNT(DISTINCT repo), COUNT(*), '
+                                                      'COUNT(agent_labels) FROM issues').fetchone()
+
+        return {'repos': repos, 'issues': issues, 'labeled': labeled}
+
+    def close(self) -> None:
+        """
+
+        Close the database
+
+        :return: None
+        """
+
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,169 @@
+import queue
+import threading
+import time
+
+"""
+    .. moduleauthor:: Tomas Kvasnicka <kvasntom@fit.cvut.cz>
+    :synopsis: In-process work queue processed by a pool of background threads
+
+    - used by the webhook so that GitHub gets its answer before the issue is labeled
+    - the queue is bounded, a full queue refuses new jobs instead of growing without limit
+    - time jobs wait in the queue and time they take can be recorded to Metrics
+    - jobs with the same key (eg. events of one issue) arriving within a short window are coalesced into one
+"""
+
+
+class WorkQueue:
+    """
+
+    Bounded queue of jobs processed by background threads
+
+    :param handler: function called with the arguments of each job
+    :param workers: number of threads processing jobs
+    :param size: maximal number of jobs waiting in the queue
+    :param metrics: Metrics recording 'queue_wait_seconds', 'job_seconds', 'jobs_total' (by result) and
+                    'jobs_coalesced_total' or None
+    :param window: number of seconds jobs submitted with a key wait for newer jobs with the same key (see submit)
+
+    Worker threads are daemons started right away. Exceptions raised by handler are printed and counted, they don't
+    stop the worker.
+    """
+
+    def __init__(self, handler, workers: int = 4, size: int = 1000, metrics=None, window: float = 0):
+        self.handler = handler
+        self.workers = workers
+        self.size = size
+        self.metrics = metrics
+        self.window = window
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.coalesced = 0
+        self._pending = {}
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.closed = False
+        self._queue = queue.Queue(size)
+        self._lock = threading.Lock()
+        self._threads = [threading.Thread(target=self._work, daemon=True) for _ in range(workers)]
+
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, *args, key=None) -> bool:
+        """
+
+        Put a job into the queue
+
+        :param args: arguments for handler
+        :param key: jobs with the same key are coalesced, None for a job of its own
+        :return: True if the job was queued (or coalesced), False if the queue is full or closed
+
+        A job with a key waits in the queue for at least window seconds. When another job with the same key is submitted
+        in the meantime (or while the job is still queued behind others), it just replaces the arguments of the waiting
+        one, so the handler is called once with the newest arguments. Jobs submitted after the handler has been called
+        are queued again.
+        """
+
+        if self.closed:
+            with self._lock:
+                self.rejected += 1
+            return False
+
+        with self._lock:
+            if key is not None and key in self._pending:
+                self._pending[key] = args
+                self.coalesced += 1
+                if self.metrics is not None:
+                    self.metrics.inc('jobs_coalesced_total')
+                return True
+
+            try:
+                self._queue.put_nowait((time.monotonic(), key, args))
+            except queue.Full:
+                self.rejected += 1
+                return False
+
+            if key is not None:
+                self._pending[key] = args
+
+        return True
+
+    def join(self) -> None:
+        """
+
+        Wait until all queued jobs are processed
+
+        :return: None
+        """
+
+        self._queue.join()
+
+    def close(self, timeout: float = 30) -> bool:
+        """
+
+        Stop accepting new jobs and wait until the queued ones are processed
+
+        :param timeout: maximal number of seconds to wait
+        :return: True if all jobs were processed, False if some were still waiting when the timeout expired
+        """
+
+        self.closed = True
+        deadline = time.monotonic() + timeout
+
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+
+        return True
+
+    def _work(self) -> None:
+        while True:
+            queued, key, args = self._queue.get()
+            if key is not None:
+                time.sleep(max(0.0, queued + self.window - time.monotonic()))
+                with self._lock:
+                    args = self._pending.pop(key)
+            started = time.monotonic()
+            result = 'ok'
+            try:
+                self.handler(*args)
+            except Exception as e:
+                print('Processing job failed:', repr(e))
+                result = 'failed'
+                with self._lock:
+                    self.failed += 1
+            finally:
+                finished = time.monotonic()
+                with self._lock:
+                    self.processed += 1
+                    self.latency_sum += finished - queued
+                    self.latency_max = max(self.latency_max, finished - queued)
+                if self.metrics is not None:
+                    self.metrics.observe('queue_wait_seconds', started - queued)
+                    self.metrics.observe('job_seconds', finished - started)
+                    self.metrics.inc('jobs_total', result=result)
+                self._queue.task_done()
+
+    def stats(self) -> dict:
+        """
+
+        Describe the state of the queue
+
+        :return: dictionary with queue depth, number of workers, processed/failed/rejected/coalesced jobs and latency in
+                 seconds (from submitting a job to finishing it)
+        """
+
+        with self._lock:
+            return {'depth': self._queue.qsize(),
+                    'size': self.size,
+                    'workers': self.workers,
+                    'processed': self.processed,
+                    'failed': self.failed,
+                    'rejected': self.rejected,
+                    'coalesced': self.coalesced,
+                    'latency_avg': self.latency_sum / self.processed if self.processed else 0.0,
+                    'latency_max': self.latency_max}
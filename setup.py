@@ -23,6 +23,10 @@ setup(
         'Programming Language :: Python :: 3',
         'Programming Language :: Python :: 3.5'],
     install_requires=['flask', 'requests', 'click', 'jinja2'],
+    extras_require={
+        'gunicorn': ['gunicorn'],
+        'waitress': ['waitress'],
+    },
     setup_requires=['pytest-runner'],
     tests_require=['pytest', 'flexmock', 'betamax'],
     entry_points={
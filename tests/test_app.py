@@ -1,6 +1,15 @@
 import pytest
 import gh_issue_agent as gh
 import io
+import base64
+import copy
+import gzip
+import json
+import http.server
+import socketserver
+import signal
+import threading
+import time
 import configparser
 from flexmock import flexmock
 import os
@@ -78,3 +87,335 @@ def test_console(betamax_session):
             'session': betamax_session}
 
     assert gh.console_main(args) == 0
+
+
+class FakeResponse:
+    def __init__(self, data, status_code=200, headers=None):
+        self.data = data
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def json(self):
+        return self.data
+
+
+class FakeSession:
+    """Serves issues and their comments from memory and records PATCH requests and labels added by POST"""
+
+    def __init__(self, issues, comments):
+        self.issues = issues
+        self.comments = comments
+        self.patched = {}
+        self.patched_urls = []
+        self.comment_urls = []
+        self.added = {}
+        self.added_urls = []
+
+    def get(self, url, headers=None):
+        self.requested = url
+        if url.split('?')[0].endswith('/comments'):
+            self.comment_urls.append(url)
+            return FakeResponse([{'body': b} for b in self.comments[int(url.split('?')[0].split('/')[-2])]])
+        return FakeResponse(copy.deepcopy(self.issues))
+
+    def patch(self, url, json=None, headers=None):
+        assert set(json) == {'labels'}
+        self.patched[int(url.split('/')[-1])] = json['labels']
+        self.patched_urls.append(url)
+        return FakeResponse(json)
+
+    def post(self, url, json=None, headers=None):
+        assert set(json) == {'labels'} and url.endswith('/labels')
+        number = int(url.split('/')[-2])
+        self.added.setdefault(number, []).extend(json['labels'])
+        self.added_urls.append(url)
+        return FakeResponse([{'name': label} for label in self.added[number]])
+
+
+def fake_issues(count):
+    return [{'number': n, 'title': 'issue %d' % n, 'body': 'serious' if n % 3 else None, 'labels': [],
+             'assignee': None, 'comments_url': 'https://api.github.com/repos/a/b/issues/%d/comments' % n}
+            for n in range(count)]
+
+
+@pytest.mark.parametrize('workers', [1, 8])
+def test_fetch_comments(workers):
+    comments = {n: ['a bug', 'fix it now'] if n % 2 else [] for n in range(20)}
+    session = FakeSession(fake_issues(20), comments)
+    args = {'labels': {'.*bug.*': 'possible_bug', '.*now.*': 'ASAP', '.*serious.*': 'serious_issue'},
+            'repo': 'a/b', 'default_label': 'default', 'comments': True, 'output': None, 'session': session,
+            'token': 'XXXXXXXX', 'workers': workers}
+
+    assert gh.console_main(args) == 0
+    for n in range(20):
+        expected = (['serious_issue'] if n % 3 else []) + (['possible_bug', 'ASAP'] if n % 2 else [])
+        assert session.patched[n] == (expected or ['default'])
+
+
+class PagedSession:
+    """Serves `pages` pages of one issue each, linked by Link headers"""
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.requested = 0
+
+    def get(self, url, headers=None):
+        self.requested += 1
+        n = int(url.split('page=')[1]) if 'page=' in url else 1
+        headers = {}
+        if n < self.pages:
+            headers['link'] = '<https://api.github.com/x?page=%d>; rel="next", ' \
+                              '<https://api.github.com/x?page=%d>; rel="last"' % (n + 1, self.pages)
+        return FakeResponse([n], headers=headers)
+
+
+def test_paginate():
+    session = PagedSession(3000)  # far beyond the recursion limit
+    args = {'session': session}
+    request = {'headers': {}}
+    pages = gh.paginate(session.get('https://api.github.com/x'), request, args)
+
+    assert next(pages) == [1]
+    assert session.requested == 1  # next page is fetched lazily
+    assert [p[0] for p in pages] == list(range(2, 3001))
+
+
+def test_incremental(tmpdir):
+    state_file = str(tmpdir.join('state.json'))
+    issues = fake_issues(3)
+    for n, issue in enumerate(issues):
+        issue['updated_at'] = '2016-11-0%dT08:20:45Z' % (n + 1)
+    session = FakeSession(issues, {})
+    args = {'labels': {'.*bug.*': 'possible_bug'}, 'repo': 'a/b', 'default_label': 'default', 'comments': False,
+            'output': None, 'session': session, 'token': 'XXXXXXXX', 'state_file': state_file}
+
+    assert gh.console_main(args) == 0
+    assert 'since' not in session.requested and 'per_page=100' in session.requested
+
+    assert gh.console_main(args) == 0
+    assert 'since=2016-11-03T08%3A20%3A45Z' in session.requested
+
+    args['full'] = True
+    assert gh.console_main(args) == 0
+    assert 'since' not in session.requested
+
+
+def test_multiple_repos(tmpdir):
+    repo_file = tmpdir.join('repos.txt')
+    repo_file.write('# comment\nc/d\n\ne/f\n')
+    auth_file = tmpdir.join('auth.cfg')
+    auth_file.write('[github]\ntoken = XXXXXXXX\n')
+    session = FakeSession(fake_issues(5), {})
+    args = gh.parse_args(('a/b',), str(auth_file), 'labels.cfg', 'default', False, None, repo_file=str(repo_file),
+                         parallel=3, write_interval=0)
+    output = io.StringIO()
+    args.update(session=session, output=output)
+
+    assert args['repo'] == ['a/b', 'c/d', 'e/f']
+    assert gh.console_main(args) == 0
+    assert sorted(session.patched_urls) == sorted('https://api.github.com/repos/%s/issues/%d' % (r, n)
+                                                  for r in ['a/b', 'c/d', 'e/f'] for n in range(5))
+    assert 'Summary for e/f: 5 patched, 0 failed' in output.getvalue()
+    assert 'http_requests_total{endpoint=/repos/:repo/issues/:number,method=PATCH,status=200} 15' in output.getvalue()
+    assert 'pages_total 3' in output.getvalue()
+
+
+@pytest.fixture
+def hook_args(monkeypatch):
+    session = FakeSession([], {})
+    args = {'token': 'XXXXXXXX', 'labels': {'.*bug.*': 'possible_bug'}, 'repo': 'a/b', 'hook_workers': 2}
+    monkeypatch.setattr(gh.agent, 'g_args', args)
+    monkeypatch.setattr(gh.agent, 'g_session', session)
+    monkeypatch.setattr(gh.agent, 'g_queue', None)
+    monkeypatch.setattr(gh.agent, 'g_rules', None)
+    monkeypatch.setattr(gh.agent, 'g_metrics', None)
+    monkeypatch.setattr(gh.agent, 'g_match_cache', None)
+    monkeypatch.setattr(gh.agent, 'g_store', None)
+    monkeypatch.setattr(gh.agent, 'g_deliveries', None)
+    return session
+
+
+def test_hook(flask_app, hook_args):
+    payload = {'issue': fake_issues(1)[0], 'repository': {'name': 'b'}}
+    payload['issue']['title'] = 'a bug'
+
+    assert flask_app.post('/hook', json=payload).status_code == 202
+    gh.get_queue().join()
+    assert hook_args.added == {0: ['possible_bug']} and not hook_args.patched  # labels are added, not replaced
+    assert hook_args.added_urls == ['https://api.github.com/repos/a/b/issues/0/labels']
+    assert flask_app.get('/status').get_json()['queue']['processed'] == 1
+
+    payload['issue']['labels'] = ['possible_bug']
+    assert flask_app.post('/hook', json=payload).status_code == 200
+    assert flask_app.post('/hook', json={'zen': 'Design for failure.'}).status_code == 400
+    for repository in (None, 'b', ['b']):
+        assert flask_app.post('/hook', json=dict(payload, repository=repository)).status_code == 400
+
+
+def test_hook_dedupe(flask_app, hook_args):
+    gh.agent.g_args['coalesce_window'] = 0.2
+    payload = {'issue': dict(fake_issues(1)[0], title='a bug'), 'repository': {'name': 'b'}}
+
+    assert flask_app.post('/hook', json=payload, headers={'X-GitHub-Delivery': '1'}).status_code == 202
+    assert flask_app.post('/hook', json=payload, headers={'X-GitHub-Delivery': '1'}).status_code == 200  # redelivery
+    assert flask_app.post('/hook', json=payload, headers={'X-GitHub-Delivery': '2'}).status_code == 202  # edited
+    gh.get_queue().join()
+
+    assert hook_args.added_urls == ['https://api.github.com/repos/a/b/issues/0/labels']
+    status = flask_app.get('/status').get_json()
+    assert (status['queue']['coalesced'], status['deliveries']['duplicates']) == (1, 1)
+    assert 'gh_issue_agent_deliveries_duplicate_total 1' in flask_app.get('/metrics').get_data(as_text=True)
+
+
+def test_metrics(flask_app, hook_args):
+    payload = {'issue': fake_issues(1)[0], 'repository': {'name': 'b'}}
+    flask_app.post('/hook', json=payload)
+    gh.get_queue().join()
+
+    text = flask_app.get('/metrics').data.decode('utf-8')
+    assert 'gh_issue_agent_responses_total{path="/hook",status="202"} 1\n' in text
+    assert 'gh_issue_agent_jobs_total{result="ok"} 1\n' in text
+    assert 'gh_issue_agent_labels_total{label="take-a-look-personally"} 1\n' in text
+    assert 'gh_issue_agent_queue_wait_seconds_count 1\n' in text
+    assert 'gh_issue_agent_queue_depth 0\n' in text
+
+
+def test_hook_reload(flask_app, hook_args, tmpdir):
+    label_file = tmpdir.join('labels.cfg')
+    label_file.write('[labels]\n.*bug.* = possible_bug\n')
+    gh.agent.g_args['label_file'] = str(label_file)
+
+    token, rules = gh.load_rules()
+    assert gh.load_rules()[1] is rules  # compiled only once
+
+    label_file.write('[labels]\n.*bug.* = possible_bug\n.*now.* = ASAP\n')
+    os.utime(str(label_file), (0, 0))
+    rules = gh.load_rules()[1]
+    assert rules.match('do it now') == ['ASAP']
+
+    assert flask_app.post('/reload', environ_base={'REMOTE_ADDR': '10.0.0.1'}).status_code == 403
+    assert gh.load_rules()[1] is rules
+    assert flask_app.post('/reload').get_json() == {'rules': 2}
+    assert gh.load_rules()[1] is not rules
+
+
+def test_pool_stats():
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Length', '2')
+            self.end_headers()
+            self.wfile.write(b'[]')
+
+        def log_message(self, *args):
+            pass
+
+    class Server(socketserver.ThreadingMixIn, http.server.HTTPServer):  # http.server.ThreadingHTTPServer is 3.7+
+        daemon_threads = True
+
+    server = Server(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    session = gh.Scheduler(gh.new_session(pool_size=2))
+
+    for _ in range(3):
+        assert session.get('http://127.0.0.1:%d/' % server.server_port).json() == []
+    server.shutdown()
+
+    assert gh.pool_stats(session) == [{'host': '127.0.0.1', 'connections': 1, 'requests': 3, 'idle': 1, 'size': 2}]
+
+
+def test_web_main(hook_args, monkeypatch):
+    calls = []
+    monkeypatch.setattr(gh.app, 'run', lambda *args, **kwargs: calls.append((args, kwargs)))
+    args = dict(gh.agent.g_args, host='0.0.0.0', port=8080, shutdown_timeout=1)
+
+    gh.web_main(args)
+    assert calls == [(('0.0.0.0', 8080), {'threaded': True})]
+    assert gh.agent.g_rules is not None and gh.agent.g_queue is None  # nothing started before serving
+
+
+def test_web_main_sigterm(hook_args, flask_app, monkeypatch):
+    def run(*args, **kwargs):
+        monkeypatch.setattr(gh.agent, 'g_session', hook_args)  # web_main forgets the session of the fixture
+        payload = {'issue': dict(fake_issues(1)[0], title='a bug'), 'repository': {'name': 'b'}}
+        assert flask_app.post('/hook', json=payload).status_code == 202
+        os.kill(os.getpid(), signal.SIGTERM)
+        time.sleep(5)
+
+    monkeypatch.setattr(gh.app, 'run', run)
+    handler = signal.getsignal(signal.SIGTERM)
+    try:
+        with pytest.raises(SystemExit):
+            gh.web_main(dict(gh.agent.g_args, shutdown_timeout=5))
+    finally:
+        signal.signal(signal.SIGTERM, handler)
+    assert hook_args.added == {0: ['possible_bug']}  # the queue was drained
+
+
+def test_label_payload():
+    with open('tests/cassetes/test_app.test_console.json') as f:
+        body = json.load(f)['http_interactions'][-2]['response']['body']['base64_string']
+    page = json.loads(gzip.decompress(base64.b64decode(body)).decode('utf-8'))
+
+    for issue in page:
+        issue['labels'] = ['possible_bug']
+        assert len(json.dumps(gh.label_payload(issue))) * 10 < len(json.dumps(issue))
+
+
+@pytest.mark.parametrize('options', [{}, {'match_processes': 2}])
+def test_comment_index(tmpdir, options):
+    state_file = str(tmpdir.join('state.json'))
+    issues = fake_issues(4)
+    for n, issue in enumerate(issues):
+        issue.update(comments=n, updated_at='2016-11-0%dT08:20:45Z' % (n + 1))
+    session = FakeSession(issues, {1: ['fix it now'], 2: ['bug', 'bug'], 3: ['a', 'b', 'c']})
+    args = {'labels': {'.*now.*': 'ASAP', '.*bug.*': 'possible_bug'}, 'repo': 'a/b', 'default_label': 'default',
+            'comments': True, 'output': io.StringIO(), 'session': session, 'token': 'XXXXXXXX', 'dry_run': True,
+            'state_file': state_file, 'full': True, **options}
+    url = 'https://api.github.com/repos/a/b/issues/%d/comments'
+
+    assert gh.console_main(args) == 0
+    assert sorted(session.comment_urls) == [url % n for n in (1, 2, 3)]  # issue 0 has no comments
+    assert [i['labels'] for i in args['plan']] == [['default'], ['ASAP'], ['possible_bug'], ['default']]
+
+    issues[2].update(comments=3, updated_at='2016-11-09T08:20:45Z')
+    session.comments[2] = ['now']  # comments since the last scan
+    session.comment_urls = []
+    assert gh.console_main(args) == 0
+    assert session.comment_urls == [url % 2 + '?since=2016-11-03T08%3A20%3A45Z']
+    assert [i['labels'] for i in args['plan']] == [['default'], ['ASAP'], ['ASAP', 'possible_bug'], ['default']]
+    assert 'comment_threads_skipped_total 2' in args['output'].getvalue()
+
+    args['labels'] = {'.*bug.*': 'possible_bug'}  # the index belongs to the old rules
+    session.comments[2] = ['bug', 'bug', 'now']
+    session.comment_urls = []
+    assert gh.console_main(args) == 0
+    assert sorted(session.comment_urls) == [url % n for n in (1, 2, 3)]
+
+
+@pytest.mark.parametrize('report_format', ['json', 'csv'])
+def test_dry_run(tmpdir, report_format):
+    report = str(tmpdir.join('report'))
+    session = FakeSession(fake_issues(3), {n: ['fix it now'] for n in range(3)})
+    args = {'labels': {'.*now.*': 'ASAP', '.*serious.*': 'serious_issue'}, 'repo': 'a/b', 'default_label': 'default',
+            'comments': True, 'output': io.StringIO(), 'session': session, 'token': 'XXXXXXXX', 'dry_run': True,
+            'report': report, 'report_format': report_format, 'profile_rules': True}
+
+    assert gh.console_main(args) == 0
+    assert not session.patched
+    assert 'Would patch issue 1 - issue 1 with labels:' in args['output'].getvalue()
+    assert '    .*now.* -> ASAP: 8 texts, 3 hits,' in args['output'].getvalue()
+
+    with open(report) as f:
+        if report_format == 'json':
+            data = json.load(f)
+            assert data['issues'][1] == {'repo': 'a/b', 'number': 1, 'title': 'issue 1',
+                                         'labels': ['serious_issue', 'ASAP']}
+            assert set(data['stages']) == {'fetch', 'comments', 'match'}
+            assert [(r['label'], r['calls'], r['hits']) for r in data['rules']] == [('ASAP', 8, 3),
+                                                                                    ('serious_issue', 8, 2)]
+        else:
+            assert f.read().splitlines() == ['repo,number,title,labels', 'a/b,0,issue 0,ASAP',
+                                             'a/b,1,issue 1,serious_issue;ASAP', 'a/b,2,issue 2,serious_issue;ASAP']
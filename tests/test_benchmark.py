@@ -0,0 +1,43 @@
+import pytest
+import gh_issue_agent as gh
+import io
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+import fake_github  # noqa: E402
+
+
+@pytest.fixture
+def fake_api():
+    server = fake_github.Server(('127.0.0.1', 0), fake_github.Handler)
+    url = 'http://127.0.0.1:' + str(server.server_port)
+    server.github = fake_github.FakeGitHub(url, repos=2, issues=45, comments=3, keywords=0.05, page_size=20)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server.github
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize('backends', [('rest', 'rest'), ('graphql', 'graphql')])
+def test_fake_api(fake_api, backends):
+    labels = {'.*bug.*': 'possible_bug', '.*ASAP.*': 'ASAP'}
+    args = {'repo': ['bench/r0', 'bench/r1'], 'token': 'bench', 'labels': labels, 'default_label': 'default',
+            'comments': True, 'output': io.StringIO(), 'api_url': fake_api.url, 'backend': backends[0],
+            'read_backend': backends[1]}
+    unlabeled = sum(1 for repo in fake_api.repos.values() for i in repo if not i['labels'])
+
+    assert gh.console_main(args) == 0
+    assert [i['number'] for i in fake_api.repos['bench/r0'] if i['labels']] == list(range(1, 46))
+    for issue in fake_api.repos['bench/r1']:
+        if not issue['labels']:
+            continue
+        text = issue['title'] + issue['body'] + ''.join(issue['comment_bodies'])
+        names = [label['name'] for label in issue['labels']]
+        expected = {label for pattern, label in labels.items() if pattern.strip('.*') in text} or {'default'}
+        assert names == ['triaged'] or set(names) == expected
+
+    endpoint = 'patch_issue 200' if backends[0] == 'rest' else 'graphql_mutation 200'
+    assert fake_api.stats[endpoint] == (unlabeled if backends[0] == 'rest' else 2)
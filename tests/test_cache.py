@@ -0,0 +1,61 @@
+import gh_issue_agent as gh
+
+
+class Response:
+    def __init__(self, status_code, body=b'', headers=None):
+        self.status_code = status_code
+        self.content = body
+        self.headers = headers or {}
+
+
+class ConditionalSession:
+    """Answers 304 whenever the client already has the current ETag"""
+
+    def __init__(self):
+        self.requests = []
+
+    def get(self, url, headers=None):
+        self.requests.append(headers)
+        etag = '"' + url + '"'
+        if headers.get('If-None-Match') == etag:
+            return Response(304)
+        return Response(200, ('[%d]' % len(url)).encode(), {'etag': etag, 'link': '<next>; rel="next"'})
+
+
+def test_cache_hit(tmpdir):
+    session = ConditionalSession()
+    cache = gh.HTTPCache(session, str(tmpdir))
+    first = cache.get('https://api.github.com/a', headers={'Authorization': 'token X'})
+
+    cache = gh.HTTPCache(session, str(tmpdir))  # persisted between runs
+    second = cache.get('https://api.github.com/a', headers={'Authorization': 'token X'})
+
+    assert session.requests[1]['If-None-Match'] == '"https://api.github.com/a"'
+    assert second.status_code == 200 and second.json() == [24] and second.headers['link'] == first.headers['link']
+    assert (cache.hits, cache.misses) == (1, 0)
+
+
+def test_cache_evicted_meanwhile(tmpdir):
+    session = ConditionalSession()
+    cache = gh.HTTPCache(session, str(tmpdir))
+    cache.get('https://api.github.com/a')
+
+    def get(url, headers=None):  # another thread evicts the entry while the request is on its way
+        for path in tmpdir.listdir():
+            path.remove()
+        return ConditionalSession.get(session, url, headers)
+
+    session.get = get
+    response = cache.get('https://api.github.com/a')
+    assert response.status_code == 200 and response.json() == [24]
+    assert cache.hits == 1
+
+
+def test_cache_eviction(tmpdir):
+    cache = gh.HTTPCache(ConditionalSession(), str(tmpdir), max_size=300)
+    for n in range(10):
+        cache.get('https://api.github.com/%d' % n)
+
+    assert cache.misses == 10
+    assert 0 < len(tmpdir.listdir()) < 10
+    assert sum(f.size() for f in tmpdir.listdir()) <= 300
@@ -0,0 +1,99 @@
+import gh_issue_agent as gh
+
+
+class Response:
+    def __init__(self, data, status_code=200):
+        self.data = data
+        self.status_code = status_code
+        self.headers = {}
+
+    def json(self):
+        return self.data
+
+
+class GraphQLSession:
+    """Knows labels 'possible_bug' and 'ASAP', lets any issue but #13 be labeled"""
+
+    def __init__(self):
+        self.labels = {'possible_bug': 'L1', 'ASAP': 'L2'}
+        self.mutations = []
+        self.created = []
+
+    def post(self, url, json=None, headers=None):
+        if url.endswith('/labels'):
+            self.created.append(json['name'])
+            self.labels[json['name']] = 'L' + str(len(self.labels) + 1)
+            return Response({'node_id': self.labels[json['name']]}, 201)
+
+        if json['query'].lstrip().startswith('query'):
+            nodes = [{'id': i, 'name': n} for n, i in self.labels.items()]
+            return Response({'data': {'repository': {'labels': {'nodes': nodes, 'pageInfo': {'hasNextPage': False}}}}})
+
+        self.mutations.append(json['variables'])
+        data, errors = {}, []
+        for alias, variables in json['variables'].items():
+            if variables['labelableId'] == 'I13':
+                data[alias] = None
+                errors.append({'path': [alias], 'message': 'Could not resolve to a node'})
+            else:
+                data[alias] = {'clientMutationId': None}
+        return Response({'data': data, 'errors': errors})
+
+
+def test_graphql_writer():
+    session = GraphQLSession()
+    writer = gh.GraphQLWriter(session, {'api': 'https://api.github.com/repos/', 'headers': {}}, 'a/b', batch_size=2)
+    issues = [{'number': n, 'node_id': 'I' + str(n), 'title': str(n), 'labels': labels}
+              for n, labels in [(11, ['possible_bug']), (12, ['ASAP', 'default']), (13, ['ASAP'])]]
+
+    ret = writer.add(issues[0]) + writer.add(issues[1]) + writer.add(issues[2]) + writer.flush()
+
+    assert [(ok, number) for ok, number, _ in ret] == [(True, 11), (True, 12), (False, 13)]
+    assert len(session.mutations) == 2
+    assert session.mutations[0]['i1'] == {'labelableId': 'I12', 'labelIds': ['L2', 'L3']}
+    assert session.created == ['default']
+
+
+class IssuesSession:
+    """Serves two pages of GraphQL issues and REST comments of long threads"""
+
+    def __init__(self):
+        self.requests = []
+        self.patched = {}
+
+    def post(self, url, json=None, headers=None):
+        self.requests.append(url)
+        after = json['variables']['after']
+        numbers = [1, 2] if after is None else [3]
+        nodes = [{'id': 'I%d' % n, 'number': n, 'title': 'issue', 'body': None, 'labels': {'nodes': []},
+                  'updatedAt': '2016-11-0%dT00:00:00Z' % n,
+                  'comments': {'totalCount': n, 'nodes': [{'body': 'a bug'}][:n], 'pageInfo': {'hasNextPage': n > 1}}}
+                 for n in numbers]
+        return Response({'data': {'repository': {'issues': {
+            'nodes': nodes, 'pageInfo': {'hasNextPage': after is None, 'endCursor': 'c1'}}}}})
+
+    def get(self, url, headers=None):
+        self.requests.append(url)
+        return Response([{'body': 'now'}])
+
+    def patch(self, url, json=None, headers=None):
+        self.requests.append(url)
+        self.patched[int(url.split('/')[-1])] = json['labels']
+        return Response(json)
+
+
+def test_graphql_reader():
+    session = IssuesSession()
+    args = {'token': 'XXXXXXXX', 'labels': {'.*bug.*': 'possible_bug', '.*now.*': 'ASAP'}, 'repo': 'a/b',
+            'default_label': 'default', 'comments': True, 'output': None, 'session': session,
+            'read_backend': 'graphql'}
+
+    assert gh.console_main(args) == 0
+    assert session.requests == ['https://api.github.com/graphql',
+                                'https://api.github.com/repos/a/b/issues/2/comments',
+                                'https://api.github.com/repos/a/b/issues/1',
+                                'https://api.github.com/repos/a/b/issues/2',
+                                'https://api.github.com/graphql',
+                                'https://api.github.com/repos/a/b/issues/3/comments',
+                                'https://api.github.com/repos/a/b/issues/3']
+    assert session.patched == {1: ['possible_bug'], 2: ['ASAP'], 3: ['ASAP']}
@@ -0,0 +1,40 @@
+import gh_issue_agent as gh
+
+labels = {'.*bug.*': 'possible_bug', '(crash)\\s+\\1': 'double_crash', 'now': 'ASAP'}
+
+
+def test_match_cache():
+    cache = gh.MatchCache(size=2)
+    rules = gh.RuleSet(labels, cache=cache)
+
+    assert rules.match('a bug', 'crash crash') == ['possible_bug', 'double_crash']
+    assert rules.match('a bug', None) == ['possible_bug']
+    assert cache.stats() == {'entries': 2, 'size': 2, 'hits': 1, 'misses': 2, 'hit_rate': 1 / 3}
+
+    assert rules.match('now') == ['ASAP']  # evicts 'crash crash', the least recently used text
+    assert rules.match('crash crash') == ['double_crash']
+    assert (cache.hits, cache.misses) == (1, 4)
+
+
+def test_match_cache_fingerprint():
+    cache = gh.MatchCache()
+    rules = gh.RuleSet(labels, cache=cache)
+    rules.match('a bug')
+
+    assert gh.RuleSet(dict(labels), cache=cache).fingerprint == rules.fingerprint
+    changed = gh.RuleSet(dict(labels, **{'.*bug.*': 'bug'}), cache=cache)
+    assert changed.fingerprint != rules.fingerprint
+
+    assert changed.match('a bug') == ['bug']  # label file changed -> nothing stale is returned
+    assert cache.stats()['entries'] == 1 and cache.hits == 0
+
+
+def test_match_cache_file(tmpdir):
+    file = str(tmpdir.join('matches.json'))
+    cache = gh.MatchCache(file=file)
+    gh.RuleSet(labels, cache=cache).match('a bug now')
+    cache.save()
+
+    loaded = gh.MatchCache(file=file)
+    assert gh.RuleSet(labels, cache=loaded).match('a bug now') == ['possible_bug', 'ASAP']
+    assert (loaded.hits, loaded.misses) == (1, 0)
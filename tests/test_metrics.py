@@ -0,0 +1,67 @@
+import pytest
+import gh_issue_agent as gh
+from gh_issue_agent.metrics import endpoint
+
+
+class Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class Session:
+    def get(self, url, **kwargs):
+        if 'broken' in url:
+            raise ConnectionError(url)
+        return Response(200)
+
+    def patch(self, url, **kwargs):
+        return Response(422)
+
+
+def test_endpoint():
+    assert endpoint('https://api.github.com/repos/a/b/issues?state=open') == '/repos/:repo/issues'
+    assert endpoint('https://api.github.com/repos/a/b/issues/12/comments?page=2') == \
+        '/repos/:repo/issues/:number/comments'
+    assert endpoint('https://api.github.com/repositories/70062336/issues?page=2') == '/repositories/:id/issues'
+    assert endpoint('https://api.github.com/orgs/o/repos') == '/orgs/:org/repos'
+
+
+def test_instrumented_session():
+    metrics = gh.Metrics()
+    session = gh.InstrumentedSession(Session(), metrics)
+
+    session.get('https://api.github.com/repos/a/b/issues')
+    session.get('https://api.github.com/repos/c/d/issues?page=2')
+    session.patch('https://api.github.com/repos/a/b/issues/1', json={'labels': ['x']})
+    with pytest.raises(ConnectionError):
+        session.get('https://broken/graphql')
+
+    assert metrics.counters == {
+        ('http_requests_total', (('endpoint', '/repos/:repo/issues'), ('method', 'GET'), ('status', '200'))): 2,
+        ('http_requests_total', (('endpoint', '/repos/:repo/issues/:number'), ('method', 'PATCH'),
+                                 ('status', '422'))): 1,
+        ('http_requests_total', (('endpoint', '/graphql'), ('method', 'GET'), ('status', 'error'))): 1}
+    assert metrics.histograms[('http_request_seconds', (('endpoint', '/repos/:repo/issues'),
+                                                        ('method', 'GET')))]['count'] == 2
+
+
+def test_prometheus():
+    metrics = gh.Metrics()
+    metrics.inc('labels_total', label='say "hi"')
+    metrics.observe('match_seconds', 0.003)
+    metrics.observe('match_seconds', 100)
+    with metrics.measure('fetch'):
+        pass
+
+    lines = metrics.prometheus({'queue_depth': [({}, 2)]}).splitlines()
+    assert '# TYPE gh_issue_agent_labels_total counter' in lines
+    assert 'gh_issue_agent_labels_total{label="say \\"hi\\""} 1' in lines
+    assert 'gh_issue_agent_match_seconds_bucket{le="0.0025"} 0' in lines
+    assert 'gh_issue_agent_match_seconds_bucket{le="0.005"} 1' in lines
+    assert 'gh_issue_agent_match_seconds_bucket{le="60"} 1' in lines
+    assert 'gh_issue_agent_match_seconds_bucket{le="+Inf"} 2' in lines
+    assert 'gh_issue_agent_match_seconds_count 2' in lines
+    assert 'gh_issue_agent_stage_seconds_count{stage="fetch"} 1' in lines
+    assert 'gh_issue_agent_queue_depth 2' in lines
+    assert metrics.summary()['fetch']['calls'] == 1
+    assert 'labels_total{label=say "hi"} 1' in metrics.report()
@@ -0,0 +1,72 @@
+import io
+import threading
+import time
+import pytest
+import gh_issue_agent as gh
+from test_app import FakeSession, fake_issues
+
+
+def test_pipeline_order():
+    stages = [(lambda n: [n, n + 100], 1), (lambda n: [n * 2], 1)]
+    assert gh.pipeline(range(5), stages, [1, 1]) == [0, 200, 2, 202, 4, 204, 6, 206, 8, 208]
+    assert gh.pipeline([], stages, [1, 1]) == []
+
+
+def test_pipeline_backpressure():
+    fed = []
+    lock = threading.Lock()
+    busy = [0, 0]
+    done = []
+
+    def source():
+        for n in range(20):
+            fed.append(n)
+            yield n
+
+    def slow(n):
+        with lock:
+            busy[0] += 1
+            busy[1] = max(busy)
+        time.sleep(0.01)
+        with lock:
+            busy[0] -= 1
+            # the source is ahead only by what the workers hold, what fits in the queue and one item waiting to be put
+            assert len(fed) <= len(done) + 3 + 2 + 1
+            done.append(n)
+        return [n]
+
+    assert sorted(gh.pipeline(source(), [(slow, 3)], [2])) == list(range(20))
+    assert busy[1] == 3
+
+
+def test_pipeline_error():
+    def fail(n):
+        if n == 7:
+            raise ValueError(n)
+        return [n]
+
+    with pytest.raises(ValueError):
+        gh.pipeline(range(1000), [(fail, 2), (lambda n: [n], 2)], [1, 1])
+
+    def source():
+        yield 1
+        raise KeyError('page')
+
+    with pytest.raises(KeyError):
+        gh.pipeline(source(), [(lambda n: [n], 1)], [1])
+
+
+@pytest.mark.parametrize('options', [{'pipeline': False},
+                                     {'pipeline': True},
+                                     {'pipeline': True, 'match_workers': 3, 'write_workers': 4, 'pipeline_depth': 1}])
+def test_console_pipeline(options):
+    session = FakeSession(fake_issues(12), {n: ['fix it now'] if n % 2 else [] for n in range(12)})
+    output = io.StringIO()
+    args = {'labels': {'.*serious.*': 'serious_issue', '.*now.*': 'ASAP'}, 'repo': 'a/b', 'default_label': 'default',
+            'comments': True, 'output': output, 'session': session, 'token': 'XXXXXXXX', 'workers': 2, **options}
+
+    assert gh.console_main(args) == 0
+    assert session.patched == {n: [label for label, on in (('serious_issue', n % 3), ('ASAP', n % 2)) if on]
+                               or ['default'] for n in range(12)}
+    assert 'Summary' not in output.getvalue()
+    assert 'issues_total 12' in output.getvalue()
@@ -0,0 +1,74 @@
+import io
+import random
+import gh_issue_agent as gh
+
+labels = {'.*bug.*': 'possible_bug', '.*serious.*': 'serious_issue', '.*now.*': 'ASAP', r'(crash)\s+\1': 'double',
+          '^(a|aa)+$': 'catastrophic'}
+
+
+def test_match_pool():
+    rnd = random.Random(0)
+    words = ['bug', 'serious', 'NOW', 'crash crash', 'aaa', 'text', ' ', '\n']
+    issues = [(''.join(rnd.choice(words) for _ in range(3)), rnd.choice([None, 'a bug', 'aaaa']),
+               [''.join(rnd.choice(words) for _ in range(4)) for _ in range(rnd.randint(0, 3))]) for _ in range(47)]
+    rules = gh.RuleSet(labels)
+
+    pool = gh.MatchPool(labels, processes=2, batch_size=5)
+    try:
+        assert pool.match(issues) == [rules.match_issue(*issue) for issue in issues]
+        assert pool.match([]) == []
+        assert pool.match(issues, threads=True) == [rules.match_thread(*issue) for issue in issues]
+    finally:
+        pool.close()
+
+
+def test_match_page_pool():
+    class Pool:
+        def match(self, issues, threads=False):
+            sent.append((issues, threads))
+            return [rules.match_thread(*issue) if threads else rules.match_issue(*issue) for issue in issues]
+
+    rules = gh.RuleSet(labels)
+    sent = []
+    issues = [{'number': 1, 'title': 'a bug', 'body': None, 'comments': 1, 'updated_at': 'x', 'comment_labels': []},
+              {'number': 2, 'title': 'text', 'body': None, 'comments': 2, 'updated_at': 'y',
+               'comment_labels': ['possible_bug']}]
+    args = {'match_pool': Pool(), 'comment_index': {}, 'default_label': 'default'}
+
+    gh.match_page(issues, [['fix it now'], ['serious']], rules, args)
+    assert sent == [([('a bug', None, ['fix it now'], []), ('text', None, ['serious'], ['possible_bug'])], True)]
+    assert [issue['labels'] for issue in issues] == [['possible_bug', 'ASAP'], ['possible_bug', 'serious_issue']]
+    assert args['comment_index'] == {'1': {'comments': 1, 'updated_at': 'x', 'labels': ['ASAP']},
+                                     '2': {'comments': 2, 'updated_at': 'y',
+                                           'labels': ['possible_bug', 'serious_issue']}}
+
+
+def test_console_match_processes():
+    session_issues = [{'number': n, 'title': 'issue %d' % n, 'body': 'serious' if n % 3 else None, 'labels': [],
+                       'comments_url': 'https://api.github.com/repos/a/b/issues/%d/comments' % n} for n in range(10)]
+
+    class Session:
+        patched = {}
+
+        def get(self, url, headers=None):
+            return Response([{'body': 'fix it now'}] if url.endswith('/comments') else session_issues)
+
+        def patch(self, url, json=None, headers=None):
+            self.patched[int(url.split('/')[-1])] = json['labels']
+            return Response(json)
+
+    class Response:
+        status_code = 200
+        headers = {}
+
+        def __init__(self, data):
+            self.data = data
+
+        def json(self):
+            return self.data
+
+    args = {'labels': labels, 'repo': 'a/b', 'default_label': 'default', 'comments': True, 'output': io.StringIO(),
+            'session': Session(), 'token': 'XXXXXXXX', 'match_processes': 2, 'match_batch_size': 3}
+    assert gh.console_main(args) == 0
+    assert 'match_pool' not in args
+    assert Session.patched == {n: (['serious_issue', 'ASAP'] if n % 3 else ['ASAP']) for n in range(10)}
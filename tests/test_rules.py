@@ -0,0 +1,84 @@
+import random
+import re
+import pytest
+import gh_issue_agent as gh
+
+labels = {'.*bug.*': 'possible_bug', '.*serious.*': 'serious_issue', '.*asap.*': 'ASAP', '.*now.*': 'ASAP',
+          r'(crash)\s+\1': 'double_crash', '(?P<w>fail)': 'failure'}
+
+
+def naive(texts):
+    ret = []
+    for regexp, label in labels.items():
+        if any(t is not None and re.search(regexp, t, re.IGNORECASE) for t in texts) and label not in ret:
+            ret.append(label)
+    return ret
+
+
+@pytest.mark.parametrize('texts', [('',),
+                                   (None, 'nothing here'),
+                                   ('serious bug', None),
+                                   ('a bug\nserious\nfix it NOW',),
+                                   ('now', 'bug'),
+                                   ('crash crash and it fails',),
+                                   ('ASAP serious bug now crash  crash fail',)])
+def test_rules_match(texts):
+    assert gh.RuleSet(labels).match(*texts) == naive(texts)
+    assert gh.RuleSet(labels, profile=True).match(*texts) == naive(texts)
+
+
+def test_rules_known():
+    rules = gh.RuleSet(labels)
+    assert rules.match_issue('serious', None, ['now'], ['failure', 'possible_bug']) == ['serious_issue', 'possible_bug',
+                                                                                        'ASAP', 'failure']
+    assert rules.match_issue(None, None, [], ['ASAP', 'unknown']) == ['ASAP', 'unknown']
+
+
+def test_rules_literals():
+    rules = gh.RuleSet({'.*bug.*': 'a', 'foo|bar(baz)+': 'b', r'(crash)\s+\1': 'c', '^(x|y)+$': 'd', 'Fix.*it': 'e'})
+    assert rules.literals == [{'bug'}, {'foo', 'bar'}, {'crash'}, None, {'fix'}]
+
+
+def test_rules_global_flags():
+    rules = gh.RuleSet({'a.b': 'dot', '(?s)c.d': 'cd', '(?i)E': 'e', '(?i:F)': 'f'})
+    assert rules.match('a\nb c\nd e') == ['cd', 'e']  # (?s) and (?i) don't apply to the other rules
+    assert rules.match('f') == ['f']
+
+
+@pytest.mark.parametrize('flags', [re.IGNORECASE, 0])
+def test_rules_pruned(flags):
+    patterns = ['.*bug.*', 'bug', 'Now', '.*?now.*?', 'se?rious', 'foo|bar(baz)+', r'(crash)\s+\1', '(?-i:ASAP)',
+                r'\bfix\b', '(?i)urgent', '(ab)+c{2,}', 'x*', '.*S.*']
+    words = ['bug', 'BUG', 'Now', 'nOw', 'srious', 'serious', 'foo', 'barbaz', 'bar', 'crash crash', 'ASAP', 'asap',
+             'fix', 'prefix', 'URGENT', 'ababcc', 'abc', 'ſ', 'İ', 'K', ' ', '\n', 'x']
+    rnd = random.Random(0)
+    rules = gh.RuleSet({p: p for p in patterns}, flags)
+
+    for _ in range(500):
+        text = ''.join(rnd.choice(words) for _ in range(rnd.randint(0, 6)))
+        assert rules.match(text) == [p for p in patterns if re.search(p, text, flags)], text
+
+
+def test_rules_profile():
+    rules = gh.RuleSet({'bug': 'possible_bug', r'^(a|aa)+$': 'catastrophic'}, profile=True)
+    rules.match('a bug', 'a' * 26 + 'b', None)
+
+    profile = rules.profile()
+    assert [(r['label'], r['calls'], r['hits'], r['chars']) for r in profile] == [('possible_bug', 2, 1, 32),
+                                                                                   ('catastrophic', 2, 0, 32)]
+    assert [r['slow'] for r in profile] == [False, True]
+    assert not any(r['disabled'] for r in profile)
+
+
+def test_rules_budget():
+    rules = gh.RuleSet({'bug': 'possible_bug', r'^(a|aa)+$': 'catastrophic'}, time_budget=0.001, max_length=30)
+    assert rules.match('a' * 26 + 'b', 'bug') == ['possible_bug']
+    assert rules.disabled == {1}
+    assert rules.match('a' * 26) == []  # disabled for good
+
+    assert gh.RuleSet({'bug': 'possible_bug'}, max_length=10).match('x' * 10 + 'bug') == []
+
+
+def test_rules_bad_pattern():
+    with pytest.raises(re.error):
+        gh.RuleSet({'(unclosed': 'x'})
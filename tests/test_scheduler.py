@@ -0,0 +1,70 @@
+import time
+import gh_issue_agent as gh
+from flexmock import flexmock
+
+
+class Response:
+    def __init__(self, status_code, headers=None, text=''):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.text = text
+
+
+class ScriptedSession:
+    """Answers requests with prepared responses, one after another"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.sent = []
+
+    def get(self, url, **kwargs):
+        self.sent.append(('get', time.time()))
+        return self.responses.pop(0)
+
+    def patch(self, url, **kwargs):
+        self.sent.append(('patch', time.time()))
+        return self.responses.pop(0)
+
+
+def test_scheduler_retries():
+    flexmock(time).should_receive('sleep').and_return(None)
+    session = ScriptedSession(Response(502), Response(403, {'retry-after': '2'}),
+                              Response(403, text='You have exceeded a secondary rate limit'), Response(200))
+    scheduler = gh.Scheduler(session, max_retries=5)
+
+    assert scheduler.get('https://api.github.com/x').status_code == 200
+    assert scheduler.retries == 3 and scheduler.waited >= 2
+
+
+def test_scheduler_gives_up():
+    session = ScriptedSession(Response(403, text='Must have admin rights'), Response(500), Response(500))
+
+    assert gh.Scheduler(session).get('https://api.github.com/x').status_code == 403
+    assert gh.Scheduler(session, max_retries=1, backoff=0).get('https://api.github.com/x').status_code == 500
+
+
+def test_scheduler_waits_for_reset():
+    sleeps = []
+    flexmock(time).should_receive('sleep').replace_with(sleeps.append)
+    reset = str(int(time.time()) + 30)
+    session = ScriptedSession(Response(200, {'x-ratelimit-remaining': '1', 'x-ratelimit-reset': reset}),
+                              Response(200, {'x-ratelimit-remaining': '0', 'x-ratelimit-reset': reset}),
+                              Response(200))
+    scheduler = gh.Scheduler(session)
+
+    scheduler.get('https://api.github.com/1')
+    scheduler.get('https://api.github.com/2')
+    assert not sleeps
+
+    scheduler.get('https://api.github.com/3')
+    assert len(sleeps) == 1 and 25 < sleeps[0] <= 30
+
+
+def test_scheduler_paces_writes():
+    session = ScriptedSession(Response(200), Response(200), Response(200))
+    scheduler = gh.Scheduler(session, write_interval=0.05)
+
+    for _ in range(3):
+        scheduler.patch('https://api.github.com/x')
+
+    assert session.sent[2][1] - session.sent[0][1] >= 0.09
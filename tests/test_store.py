@@ -0,0 +1,73 @@
+import io
+import pytest
+import gh_issue_agent as gh
+from test_app import FakeSession, fake_issues, flask_app, hook_args  # noqa: F401 (fixtures)
+
+
+def test_issue_store(tmpdir):
+    store = gh.IssueStore(str(tmpdir.join('issues.db')))
+    issue = {'number': 1, 'node_id': 'I_1', 'title': 'a bug', 'body': None, 'updated_at': 'x', 'labels': []}
+
+    store.put('a/b', issue, ['first'])
+    store.put('a/b', issue, ['second'], append=True)
+    assert ('a/b', 1) in store and ('a/b', 2) not in store
+    assert store.issues('a/b') == []  # not labeled by the agent
+
+    store.labeled('a/b', 1, ['z', 'a'])
+    assert store.issues('a/b') == [(dict(issue, labels=['a', 'z']), ['first', 'second'])]
+
+    store.put('a/b', dict(issue, labels=[{'name': 'a'}, {'name': 'z'}]))  # seen again with the same labels
+    assert len(store.issues('a/b')) == 1
+    store.put('c/d', dict(issue, labels=[{'name': 'manual'}]))
+    store.put('a/b', dict(issue, labels=[{'name': 'manual'}]))  # changed by somebody else
+    assert store.issues('a/b') == []
+
+    assert store.fingerprint('a/b') is None
+    store.set_fingerprint('a/b', 'abc')
+    assert store.fingerprint('a/b') == 'abc'
+    assert store.repos() == ['a/b', 'c/d']
+    assert store.stats() == {'repos': 2, 'issues': 2, 'labeled': 1}
+    store.close()
+
+
+@pytest.mark.parametrize('backend', ['rest', 'graphql'])
+def test_relabel(tmpdir, backend):
+    db = str(tmpdir.join('issues.db'))
+    issues = fake_issues(4)
+    issues[3]['labels'] = [{'name': 'manual'}]
+    session = FakeSession(issues, {n: ['fix it now'] if n == 2 else [] for n in range(4)})
+    args = {'labels': {'.*serious.*': 'serious_issue'}, 'repo': 'a/b', 'default_label': 'default', 'comments': True,
+            'output': io.StringIO(), 'session': session, 'token': 'XXXXXXXX', 'store': db}
+
+    assert gh.console_main(args) == 0
+    assert session.patched == {0: ['default'], 1: ['serious_issue'], 2: ['serious_issue']}
+
+    session.patched = {}
+    session.comments = {}  # relabeling doesn't download anything
+    args = dict(args, labels={'.*serious.*': 'serious_issue', '.*now.*': 'ASAP'}, repo=[], output=io.StringIO(),
+                backend=backend)
+    args.pop('stages')
+    assert gh.relabel_main(args) == 0
+    assert session.patched == {2: ['serious_issue', 'ASAP']}  # replaced by PATCH even with the GraphQL backend
+    assert [(i['number'], i['labels']) for i, _ in gh.IssueStore(db).issues('a/b')] == \
+        [(0, ['default']), (1, ['serious_issue']), (2, ['ASAP', 'serious_issue'])]
+    assert 'Relabeled a/b: 1 changed, 2 unchanged, 0 failed' in args['output'].getvalue()
+
+    args['output'] = io.StringIO()
+    assert gh.relabel_main(args) == 0
+    assert 'Labels of a/b are up to date' in args['output'].getvalue()
+
+    args.update(labels={'.*now.*': 'ASAP'}, dry_run=True, output=io.StringIO())
+    assert gh.relabel_main(args) == 0
+    assert session.patched == {2: ['serious_issue', 'ASAP']}
+    assert [(i['number'], i['labels']) for i in args['plan']] == [(1, ['default']), (2, ['ASAP'])]
+
+
+def test_hook_store(flask_app, hook_args, tmpdir):  # noqa: F811
+    gh.agent.g_args['store'] = str(tmpdir.join('issues.db'))
+    payload = {'issue': dict(fake_issues(1)[0], title='a bug'), 'repository': {'name': 'b'}}
+
+    assert flask_app.post('/hook', json=payload).status_code == 202
+    gh.get_queue().join()
+    assert gh.get_store().issues('a/b')[0][0]['labels'] == ['possible_bug']
+    gh.get_store().close()
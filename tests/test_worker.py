@@ -0,0 +1,70 @@
+import threading
+import gh_issue_agent as gh
+
+
+def test_queue_full():
+    started, release = threading.Event(), threading.Event()
+    done = []
+
+    def handler(n):
+        started.set()
+        release.wait()
+        done.append(n)
+
+    work = gh.WorkQueue(handler, workers=1, size=2)
+    assert work.submit(0)
+    started.wait()
+    assert work.submit(1) and work.submit(2)  # 0 is being processed, 1 and 2 wait
+    assert not work.submit(3)
+
+    release.set()
+    work.join()
+    stats = work.stats()
+    assert sorted(done) == [0, 1, 2]
+    assert (stats['processed'], stats['rejected'], stats['depth']) == (3, 1, 0)
+
+
+def test_queue_close():
+    release = threading.Event()
+    work = gh.WorkQueue(lambda: release.wait(), workers=1)
+    work.submit()
+
+    assert not work.close(timeout=0.05)
+    assert not work.submit()
+
+    release.set()
+    assert work.close(timeout=5)
+
+
+def test_queue_coalesce():
+    done = []
+    work = gh.WorkQueue(lambda key, n: done.append((key, n)), workers=2, window=0.2)
+
+    for n in range(5):
+        assert work.submit('a', n, key='a')
+        assert work.submit('b', n, key='b')
+    assert work.submit('c', 0)
+    work.join()
+
+    assert sorted(done) == [('a', 4), ('b', 4), ('c', 0)]
+    assert work.stats()['coalesced'] == 8
+
+    assert work.submit('a', 5, key='a')  # the burst is over, a new job
+    work.join()
+    assert done[-1] == ('a', 5)
+
+
+def test_expiring_set(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(gh.expiring.time, 'monotonic', lambda: now[0])
+    seen = gh.ExpiringSet(size=2, ttl=10)
+
+    assert seen.add('a') and not seen.add('a')
+    now[0] += 5
+    assert seen.add('b') and seen.add('c')  # 'a' evicted, there is room for 2 keys only
+    assert seen.add('a') and not seen.add('c')
+    now[0] += 10
+    assert seen.add('c') and len(seen) == 1  # 'a' and 'c' expired
+    seen.discard('c')
+    assert seen.add('c')
+    assert seen.duplicates == 2